@@ -1,6 +1,6 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin
-from .models import User, Connection, Message
+from .models import User, Connection, Message, Conversation
 
 
 # Register your models here.
@@ -17,3 +17,8 @@ class ConnectionAdmin(admin.ModelAdmin):
 @admin.register(Message)
 class MessageAdmin(admin.ModelAdmin):
     pass
+
+
+@admin.register(Conversation)
+class ConversationAdmin(admin.ModelAdmin):
+    pass
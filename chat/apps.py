@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class ChatConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'chat'
+
+    def ready(self):
+        # connects the User signal handlers and the query counter
+        from . import auth, graph, metrics, profiles, search  # noqa: F401
@@ -0,0 +1,196 @@
+"""
+Websocket authentication from the JWT in the `token` query parameter.
+
+Tokens are verified locally, signature and expiry, with the simplejwt
+settings the HTTP API uses. The user a token resolved to is then cached
+until the token expires, in a process-local LRU of CHAT_AUTH_CACHE_SIZE
+tokens, so reconnecting doesn't load the same User row again. Saving or
+deleting a user drops their cached tokens in this process: deactivated
+users are refused on their next connect, as JWTAuthentication refuses
+them over HTTP. Other processes notice when the token expires, at most
+ACCESS_TOKEN_LIFETIME later. A user loaded before a save that revoked
+them is not cached: every user has a generation that revoking bumps, and
+a load only fills the cache if it is unchanged.
+
+Every socket gets its own copy of the cached user, consumers may change
+it. The time spent is observed in chat_auth_seconds by outcome. Async
+HTTP views authenticate their Authorization header with `bearer_user`.
+"""
+
+import copy
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import parse_qs
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.core.exceptions import ValidationError
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import AccessToken
+from .metrics import auth_seconds
+from .models import User
+
+
+class TokenCache:
+    def __init__(self, max_size):
+        self.max_size = max_size
+        # token -> (expiry timestamp, user)
+        self.entries = OrderedDict()
+        # user id -> their cached tokens
+        self.tokens = {}
+        # user id -> [loads in flight, generation], while any are
+        self.loads = {}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, token):
+        with self.lock:
+            entry = self.entries.get(token)
+            if entry is not None and entry[0] > time.time():
+                self.entries.move_to_end(token)
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                self.drop(token)
+            self.misses += 1
+            return None
+
+    def begin(self, user_id):
+        """
+        Start loading `user_id`, returning the lookup to pass to `put`, or
+        to `abandon` if nothing is cached.
+        """
+        with self.lock:
+            entry = self.loads.setdefault(user_id, [0, 0])
+            entry[0] += 1
+            return user_id, entry[1]
+
+    def end(self, lookup):
+        # with the lock held, whether the user wasn't revoked since `begin`
+        user_id, generation = lookup
+        entry = self.loads[user_id]
+        entry[0] -= 1
+        if not entry[0]:
+            del self.loads[user_id]
+        return entry[1] == generation
+
+    def abandon(self, lookup):
+        with self.lock:
+            self.end(lookup)
+
+    def put(self, token, expires, user, lookup):
+        with self.lock:
+            if not self.end(lookup) or self.max_size <= 0:
+                return
+            self.entries[token] = (expires, user)
+            self.entries.move_to_end(token)
+            self.tokens.setdefault(user.id, set()).add(token)
+            while len(self.entries) > self.max_size:
+                self.drop(next(iter(self.entries)))
+                self.evictions += 1
+
+    def drop(self, token):
+        # with the lock held
+        _, user = self.entries.pop(token)
+        tokens = self.tokens[user.id]
+        tokens.discard(token)
+        if not tokens:
+            del self.tokens[user.id]
+
+    def revoke(self, user_id):
+        with self.lock:
+            for token in self.tokens.pop(user_id, ()):
+                del self.entries[token]
+            if user_id in self.loads:
+                # what is being loaded may predate the change
+                self.loads[user_id][1] += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.tokens.clear()
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self.entries),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+            }
+
+
+token_cache = TokenCache(max_size=getattr(settings, "CHAT_AUTH_CACHE_SIZE", 10000))
+
+
+def load_user(user_id):
+    user = User.objects.filter(pk=user_id).first()
+    if user is None or not user.is_active:
+        return None
+    return user
+
+
+async def authenticate(token):
+    """(user or None, outcome) of a raw access token."""
+    user = token_cache.get(token)
+    if user is not None:
+        return user, "cached"
+    try:
+        verified = AccessToken(token)
+        # the key revoke() is called with
+        user_id = User._meta.pk.to_python(verified[api_settings.USER_ID_CLAIM])
+    except (TokenError, KeyError, ValidationError):
+        return None, "invalid"
+    lookup = token_cache.begin(user_id)
+    try:
+        user = await database_sync_to_async(load_user)(user_id)
+    except BaseException:
+        token_cache.abandon(lookup)
+        raise
+    if user is None:
+        token_cache.abandon(lookup)
+        return None, "rejected"
+    token_cache.put(token, verified["exp"], user, lookup)
+    return user, "verified"
+
+
+async def bearer_user(request):
+    """The user of the `Authorization: Bearer <token>` header, or None."""
+    scheme, _, token = request.headers.get("Authorization", "").partition(" ")
+    if scheme.lower() != "bearer" or not token:
+        return None
+    user, _ = await authenticate(token.strip())
+    return user
+
+
+class JWTAuthMiddleware:
+    """Sets scope["user"] from the `token` query parameter."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        start = time.perf_counter()
+        tokens = parse_qs(scope["query_string"].decode()).get("token")
+        if tokens:
+            user, outcome = await authenticate(tokens[0])
+        else:
+            user, outcome = None, "anonymous"
+        auth_seconds.observe(time.perf_counter() - start, outcome)
+        user = copy.copy(user) if user is not None else AnonymousUser()
+        return await self.app(dict(scope, user=user), receive, send)
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def revoke_tokens(sender, instance, **kwargs):
+    token_cache.revoke(instance.id)
@@ -0,0 +1,130 @@
+"""
+Helpers shared by the benchmark management commands.
+
+Benchmarks run against a throwaway test database and an in-memory channel
+layer, so they never touch the project database or Redis.
+"""
+
+import math
+import threading
+from contextlib import contextmanager
+from channels.testing import WebsocketCommunicator
+from django.conf import settings
+from django.test.utils import override_settings, setup_databases, teardown_databases
+from rest_framework_simplejwt.tokens import AccessToken
+from .models import User, UserSearchToken
+from .search import user_tokens
+
+IN_MEMORY_CHANNEL_LAYERS = {
+    "default": {
+        "BACKEND": "channels.layers.InMemoryChannelLayer",
+        "CONFIG": {"capacity": 10000},
+    }
+}
+
+
+@contextmanager
+def benchmark_environment():
+    with override_settings(CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS):
+        old_config = setup_databases(verbosity=0, interactive=False)
+        try:
+            yield
+        finally:
+            teardown_databases(old_config, verbosity=0)
+
+
+def percentile(samples, pct):
+    # nearest-rank percentile, samples don't need to be sorted
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    rank = max(math.ceil(pct / 100 * len(ordered)), 1)
+    return ordered[rank - 1]
+
+
+def summarize(samples):
+    """Latency summary in milliseconds for a list of durations in seconds."""
+    return {
+        "count": len(samples),
+        "p50": round(percentile(samples, 50) * 1000, 3) if samples else None,
+        "p95": round(percentile(samples, 95) * 1000, 3) if samples else None,
+        "p99": round(percentile(samples, 99) * 1000, 3) if samples else None,
+        "max": round(max(samples) * 1000, 3) if samples else None,
+    }
+
+
+def seed_users(count, prefix="bench"):
+    # passwords are left unusable, hashing would dominate seeding time
+    User.objects.bulk_create(
+        [
+            User(
+                username=f"{prefix}{i}",
+                first_name=f"first{i}",
+                last_name=f"last{i}",
+                password="!",
+            )
+            for i in range(count)
+        ],
+        batch_size=1000,
+    )
+    return list(User.objects.filter(username__startswith=prefix).order_by("id"))
+
+
+def seed_search_tokens(users):
+    # bulk_create skips the post_save receiver that indexes users
+    UserSearchToken.objects.bulk_create(
+        (
+            UserSearchToken(user_id=user.id, token=token, weight=weight)
+            for user in users
+            for token, weight in user_tokens(
+                user.username, user.first_name, user.last_name
+            )
+        ),
+        batch_size=1000,
+    )
+
+
+async def open_socket(application, user, path="/chat/", timeout=30, **kwargs):
+    """Connect `user` to `application`, skipping the JWT middleware."""
+    communicator = WebsocketCommunicator(application, path, **kwargs)
+    communicator.scope["user"] = user
+    connected, _ = await communicator.connect(timeout=timeout)
+    if not connected:
+        raise RuntimeError(f"{user.username} could not connect")
+    return communicator
+
+
+async def open_asgi_socket(application, user, path="/chat/", timeout=30):
+    """
+    Connect `user` through the full ASGI stack of core.asgi: origin check,
+    JWT authentication from the `token` query parameter, then routing.
+    """
+    token = AccessToken.for_user(user)
+    host = next((host for host in settings.ALLOWED_HOSTS if host != "*"), "localhost")
+    communicator = WebsocketCommunicator(
+        application,
+        f"{path}?token={token}",
+        headers=[(b"origin", f"http://{host}".encode())],
+    )
+    connected, _ = await communicator.connect(timeout=timeout)
+    if not connected:
+        raise RuntimeError(f"{user.username} could not connect")
+    return communicator
+
+
+async def receive_source(communicator, source, timeout=30):
+    """Wait for the next frame with the given source, skipping others."""
+    while True:
+        frame = await communicator.receive_json_from(timeout=timeout)
+        if frame.get("source") == source:
+            return frame
+
+
+class ThreadSampler:
+    """Records the peak number of live threads while a benchmark runs."""
+
+    def __init__(self):
+        self.peak = threading.active_count()
+
+    def sample(self):
+        self.peak = max(self.peak, threading.active_count())
@@ -0,0 +1,129 @@
+"""
+Catch-up after a reconnect: what changed since the client's cursor.
+
+A client sends the cursor of its last `sync` response
+
+    {"source": "sync", "since": {"message_id": 1234, "time": "...Z"}}
+
+and gets, in one frame, the messages of its friends' connections after
+`message_id`, the friend list entries and pending requests changed after
+`time`, and a new cursor. Each is a range scan: messages on
+(connection, id), friend list entries on (user, -last_activity) and
+requests on (receiver, approved, created).
+
+At most CHAT_SYNC_MESSAGE_LIMIT messages are returned, oldest first; when
+there are more, `more` is true and the client syncs again with the new
+cursor. Times are compared with CATCH_UP_OVERLAP of slack, so a row
+written while the previous sync ran is sent again rather than missed;
+clients replace entries by id.
+
+Message ids don't commit in order: with concurrent writers, and the
+group commit of writer.py, a transaction holding a lower id can commit
+after a sync read a higher one. The messages created within the overlap
+at or below `message_id` are sent again too, before the newer ones, so
+that one committing late is not skipped for good.
+
+Without a valid cursor only a fresh one is returned, with `stale` set:
+the client reloads lists the usual way.
+"""
+
+from datetime import timedelta
+from django.conf import settings
+from django.db.models import Max
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from .fast_serializers import (
+    FRIEND_VALUES,
+    MESSAGE_VALUES,
+    REQUEST_VALUES,
+    friend_list_data,
+    iso_datetime,
+    messages_data,
+    request_list_data,
+)
+from .graph import social_graph
+from .models import Connection, Conversation, Message
+
+MESSAGE_LIMIT = getattr(settings, "CHAT_SYNC_MESSAGE_LIMIT", 200)
+CATCH_UP_OVERLAP = timedelta(seconds=5)
+
+
+def parse_cursor(since):
+    if not isinstance(since, dict):
+        return None, None
+    message_id = since.get("message_id")
+    if not isinstance(message_id, int) or isinstance(message_id, bool):
+        return None, None
+    try:
+        time = parse_datetime(since.get("time") or "")
+    except ValueError:
+        return None, None
+    if time is None or timezone.is_naive(time):
+        return None, None
+    return message_id, time
+
+
+def friend_messages(user):
+    connection_ids = social_graph.get(user.id).friend_connections()
+    return Message.objects.filter(connection_id__in=connection_ids)
+
+
+def start_cursor(user):
+    """Cursor of a client that has seen everything until now."""
+    now = timezone.now()
+    latest = friend_messages(user).aggregate(latest=Max("id"))["latest"] or 0
+    return {"message_id": latest, "time": iso_datetime(now)}
+
+
+def catch_up(user, since):
+    """The `sync` payload of `user` for the cursor `since`."""
+    message_id, time = parse_cursor(since)
+    if message_id is None:
+        return {
+            "messages": [],
+            "friends": [],
+            "requests": [],
+            "cursor": start_cursor(user),
+            "more": False,
+            "stale": True,
+        }
+
+    now = timezone.now()
+    changed_after = time - CATCH_UP_OVERLAP
+    messages = friend_messages(user).order_by("id").values(*MESSAGE_VALUES)
+    late = list(
+        messages.filter(id__lte=message_id, created__gt=changed_after)[:MESSAGE_LIMIT]
+    )
+    rows = list(messages.filter(id__gt=message_id)[: MESSAGE_LIMIT + 1])
+    more = len(rows) > MESSAGE_LIMIT
+    rows = rows[:MESSAGE_LIMIT]
+    if rows:
+        message_id = rows[-1]["id"]
+    rows = late + rows
+    serialized = []
+    if rows:
+        # both users of every connection, for messages_data
+        connections = Connection.objects.select_related("sender", "receiver").in_bulk(
+            {row["connection_id"] for row in rows}
+        )
+        for row in rows:
+            serialized += messages_data([row], connections[row["connection_id"]])
+
+    friends = friend_list_data(
+        Conversation.objects.filter(user=user, last_activity__gt=changed_after)
+        .order_by("-last_activity")
+        .values(*FRIEND_VALUES)
+    )
+    requests = request_list_data(
+        Connection.objects.filter(
+            receiver=user, approved=False, created__gt=changed_after
+        ).values(*REQUEST_VALUES)
+    )
+    return {
+        "messages": serialized,
+        "friends": friends,
+        "requests": requests,
+        "cursor": {"message_id": message_id, "time": iso_datetime(now)},
+        "more": more,
+        "stale": False,
+    }
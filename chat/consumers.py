@@ -1,72 +1,206 @@
-from channels.generic.websocket import WebsocketConsumer
+from channels.generic.websocket import WebsocketConsumer, AsyncWebsocketConsumer
+from channels.db import database_sync_to_async
 from asgiref.sync import async_to_sync
-import json
+import asyncio
 import base64
-from django.core.files.base import ContentFile
-from .serializers import (
-    UserSerializer,
-    SearchSerializer,
-    RequestSerializer,
-    FriendSerializer,
-    MessageSerializer,
+import time
+from io import BytesIO
+from .ephemeral import ephemeral
+from .catchup import catch_up
+from .fast_serializers import (
+    FRIEND_VALUES,
+    MESSAGE_VALUES,
+    REQUEST_VALUES,
+    friend_data,
+    friend_list_data,
+    message_data,
+    messages_data,
+    request_data,
+    request_list_data,
+    scope_user_data,
+    search_data,
 )
-from .models import User, Connection, Message
-from django.db.models import Q, Exists, OuterRef
-from django.db.models.functions import Coalesce
+from .graph import RECEIVED, connection_key, social_graph
+from .message_search import message_search_data
+from .metrics import group_send, handling, open_sockets
+from .models import User, Connection, Message, Conversation
+from .outbound import Outbound
+from .presence import friend_usernames, presence
+from .search import SEARCH_DEBOUNCE, search_queryset, search_user_ids, with_status
+from .session import session_data, wants_init
+from .thumbnails import ThumbnailError, ingest, remove_thumbnail, thumbnail_pool
+from .uploads import Upload, UploadError
+from .wire import negotiate
+from .writer import message_writer
+from .conversations import open_conversations, send_message, mark_read
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+
+
+MESSAGE_PAGE_SIZE = 12
+MAX_MESSAGE_PAGE_SIZE = 100
+
+
+def message_cursor(data):
+    """(before_created, before_id) of `data`, None when missing or invalid."""
+    before_id = data.get("before_id")
+    if not isinstance(before_id, int) or isinstance(before_id, bool):
+        return None
+    try:
+        before_created = parse_datetime(data.get("before_created") or "")
+    except (TypeError, ValueError):
+        # not a string, or a date out of range
+        return None
+    if before_created is None:
+        return None
+    return before_created, before_id
+
+
+def search_query(data):
+    """The `query` of `data`, empty when it isn't a string."""
+    query = data.get("query")
+    return query if isinstance(query, str) else ""
+
+
+def message_page(messages, data):
+    """
+    Slice one page of message.list out of `messages`, plus one extra row
+    used to tell whether there is a next page.
+
+    Clients sending `page` get the old offset pagination. Otherwise the
+    page starts after the (`before_created`, `before_id`) cursor, which is a
+    range scan on the (connection, created, id) index however deep it is.
+    An invalid cursor is ignored, like an invalid page size.
+    """
+    try:
+        page_size = int(data.get("page_size") or MESSAGE_PAGE_SIZE)
+    except (TypeError, ValueError):
+        page_size = MESSAGE_PAGE_SIZE
+    page_size = min(max(page_size, 1), MAX_MESSAGE_PAGE_SIZE)
+    messages = messages.order_by("-created", "-id")
+    if data.get("page") is not None:
+        page = data["page"]
+        return messages[page * page_size : (page + 1) * page_size + 1], page_size
+    cursor = message_cursor(data)
+    if cursor is not None:
+        before_created, before_id = cursor
+        messages = messages.filter(
+            Q(created__lt=before_created) | Q(created=before_created, id__lt=before_id)
+        )
+    return messages[: page_size + 1], page_size
+
+
+def message_list_data(rows, data, page_size, connection):
+    """Build the message.list payload from the rows of `message_page`."""
+    has_next = len(rows) > page_size
+    serialized = messages_data(rows[:page_size], connection)
+    if not has_next:
+        next_page = None
+    elif data.get("page") is not None:
+        next_page = data["page"] + 1
+    else:
+        last = serialized[-1]
+        next_page = {"before_id": last["id"], "before_created": last["created"]}
+    return {"messages": serialized, "next": next_page}
 
 
 class ChatConsumer(WebsocketConsumer):
+    async def __call__(self, scope, receive, send):
+        # base_send wraps the ASGI send in async_to_sync, outbound needs it as is
+        self.asgi_send = send
+        return await super().__call__(scope, receive, send)
+
     def connect(self):
         user = self.scope["user"]
         if not user.is_authenticated:
             return
         # save username to use as a group name for this user
         self.username = user.username
+        # (query, time, results) of the last search, to debounce repeats
+        self.last_search = (None, 0, None)
+        # binary upload in progress, see uploads.py
+        self.upload = None
+        # JSON or MessagePack frames, see wire.py
+        self.wire, subprotocol = negotiate(self.scope)
+        # frames queued for this socket, see outbound.py
+        self.outbound = Outbound(self.asgi_send, self.wire)
+        # load who this user is connected to before the first search
+        social_graph.get(user.id)
         # Join this user to a group with their username
         async_to_sync(self.channel_layer.group_add)(self.username, self.channel_name)
-        self.accept()
+        # tell friends this user is online, unless another socket already has
+        async_to_sync(presence.connect)(self.channel_layer, user, self.channel_name)
+        self.accept(subprotocol)
+        open_sockets.inc()
+        if wants_init(self.scope):
+            self.receive_session_init({})
 
     def disconnect(self, code):
         # Leave group/room
         async_to_sync(self.channel_layer.group_discard)(
             self.username, self.channel_name
         )
+        open_sockets.dec()
+        async_to_sync(self.outbound.close)()
+        async_to_sync(presence.disconnect)(
+            self.channel_layer, self.scope["user"], self.channel_name
+        )
+        if self.upload is not None:
+            self.upload.close()
 
     # Handle requests
 
     def receive(self, text_data=None, bytes_data=None):
-        # receive message from websocket
-        data = json.loads(text_data)
-        data_source = data.get("source")
-
-        if data_source == "thumbnail":
-            self.receive_thumbnail(data)
-        elif data_source == "search":
-            self.receive_search(data)
-        elif data_source == "request.connect":
-            self.receive_request_connect(data)
-        elif data_source == "request.list":
-            self.receive_request_list(data)
-        elif data_source == "request.accept":
-            self.receive_request_accept(data)
-        elif data_source == "friend.list":
-            self.receive_friend_list(data)
-        elif data_source == "message.send":
-            self.receive_message_send(data)
-        elif data_source == "message.list":
-            self.receive_message_list(data)
-        elif data_source == "message.type":
-            self.receive_message_type(data)
-        elif data_source == "typing.on":
-            self.receive_typing_on(data)
-
-        print("receive", json.dumps(data, indent=2))
+        with handling(self, text_data, bytes_data) as frame:
+            if bytes_data is not None and not self.wire.binary:
+                frame.source = "upload.chunk"
+                self.receive_upload_chunk(bytes_data)
+                return
+            # receive message from websocket
+            data = self.wire.loads(text_data, bytes_data)
+            data_source = data.get("source")
+            frame.source = data_source
+            if data_source == "upload.chunk":
+                self.receive_upload_chunk(data.get("chunk"))
+                return
+
+            if data_source == "thumbnail":
+                self.receive_thumbnail(data)
+            elif data_source == "search":
+                self.receive_search(data)
+            elif data_source == "request.connect":
+                self.receive_request_connect(data)
+            elif data_source == "request.list":
+                self.receive_request_list(data)
+            elif data_source == "request.accept":
+                self.receive_request_accept(data)
+            elif data_source == "friend.list":
+                self.receive_friend_list(data)
+            elif data_source == "message.send":
+                self.receive_message_send(data)
+            elif data_source == "message.list":
+                self.receive_message_list(data)
+            elif data_source == "message.type":
+                self.receive_message_type(data)
+            elif data_source == "typing.on":
+                self.receive_typing_on(data)
+            elif data_source == "upload.start":
+                self.receive_upload_start(data)
+            elif data_source == "presence.list":
+                self.receive_presence_list(data)
+            elif data_source == "sync":
+                self.receive_sync(data)
+            elif data_source == "session.init":
+                self.receive_session_init(data)
+            elif data_source == "message.search":
+                self.receive_message_search(data)
 
     def delete_thumbnail(self):
         user = self.scope["user"]
-        user.thumbnail.delete(save=True)
-        serialized = UserSerializer(user)
-        self.send_group(self.username, "thumbnail", serialized.data)
+        remove_thumbnail(user.id)
+        user.thumbnail = None
+        serialized = scope_user_data(user)
+        self.send_group(self.username, "thumbnail", serialized)
 
     def receive_request_connect(self, data):
         username = data["username"]
@@ -78,49 +212,35 @@ class ChatConsumer(WebsocketConsumer):
         connection, _ = Connection.objects.get_or_create(
             sender=self.scope["user"], receiver=receiver
         )
-        serialized = RequestSerializer(connection)
-        self.send_group(connection.sender.username, "request.connect", serialized.data)
-        self.send_group(
-            connection.receiver.username, "request.connect", serialized.data
-        )
+        social_graph.add(connection)
+        # already loaded, don't lazy load it again; the sender is the socket's
+        # user, loaded when it connected, see scope_user_data
+        connection.receiver = receiver
+        serialized = request_data(connection, scope_user_data(self.scope["user"]))
+        self.send_group(self.username, "request.connect", serialized)
+        self.send_group(receiver.username, "request.connect", serialized)
 
     def receive_search(self, data):
         user = self.scope["user"]
-        query = data.get("query")
-        users = (
-            User.objects.filter(
-                Q(first_name__istartswith=query)
-                | Q(last_name__istartswith=query)
-                | Q(username__istartswith=query)
-            )
-            .exclude(username=self.username)
-            .annotate(
-                pending_them=Exists(
-                    Connection.objects.filter(
-                        sender=user, receiver=OuterRef("id"), approved=False
-                    )
-                ),
-                pending_me=Exists(
-                    Connection.objects.filter(
-                        sender=OuterRef("id"), receiver=user, approved=False
-                    )
-                ),
-                connected=Exists(
-                    Connection.objects.filter(
-                        Q(sender=OuterRef("id"), receiver=user)
-                        | Q(receiver=OuterRef("id"), sender=user),
-                        approved=True,
-                    )
-                ),
-            )
-        )
-        serialized = SearchSerializer(users, many=True)
+        query = search_query(data)
+        last_query, searched_at, serialized = self.last_search
+        if query != last_query or time.monotonic() - searched_at > SEARCH_DEBOUNCE:
+            ids = search_user_ids(query, user.id)
+            users = with_status(search_queryset(ids), ids, social_graph.get(user.id))
+            serialized = search_data(users)
+            self.last_search = (query, time.monotonic(), serialized)
 
-        self.send_group(self.username, "search", serialized.data)
+        self.reply("search", serialized)
+
+    def receive_message_search(self, data):
+        serialized = message_search_data(self.scope["user"].id, data)
+        self.reply("message.search", serialized)
 
     def receive_typing_on(self, data):
         friend = data.get("friend")
-        self.send_group(
+        async_to_sync(ephemeral.emit)(
+            self.channel_layer,
+            self.username,
             friend["username"],
             "typing.on",
             {"friend_username": self.scope["user"].username},
@@ -131,109 +251,183 @@ class ChatConsumer(WebsocketConsumer):
         recipient_username = data.get("username")
 
         data = {"username": user.username}
-        self.send_group(recipient_username, "message.type", data)
+        async_to_sync(ephemeral.emit)(
+            self.channel_layer,
+            self.username,
+            recipient_username,
+            "message.type",
+            data,
+        )
+
+    def receive_session_init(self, data):
+        serialized = session_data(self.scope["user"])
+        self.reply("session.init", serialized)
+
+    def receive_sync(self, data):
+        serialized = catch_up(self.scope["user"], data.get("since"))
+        self.reply("sync", serialized)
+
+    def receive_presence_list(self, data):
+        # usernames of the friends online now, later changes come as presence
+        usernames = friend_usernames(self.scope["user"].id, online=True)
+        self.reply("presence.list", usernames)
 
     def receive_message_list(self, data):
         connectionId = data.get("connectionId")
-        page = data.get("page")
-        page_size = 12
+        if not social_graph.is_member(self.scope["user"].id, connectionId):
+            print(f"Error: not part of connection pk={connectionId}")
+            return
         try:
-            connection = Connection.objects.get(pk=connectionId)
+            connection = Connection.objects.select_related("sender", "receiver").get(
+                pk=connectionId
+            )
         except Connection.DoesNotExist:
             print(f"Connection pk={connectionId} does not exist")
             return
+        if not social_graph.verify(connection, self.scope["user"].id):
+            print(f"Error: not part of connection pk={connectionId}")
+            return
+        if not data.get("page") and message_cursor(data) is None:
+            # opening the conversation reads it
+            mark_read(connection, self.scope["user"])
 
-        messages = Message.objects.filter(connection=connection).order_by("-created")[
-            page * page_size : (page + 1) * page_size
-        ]
-        messages_count = Message.objects.filter(connection=connection).count()
-        serialized = MessageSerializer(messages, many=True)
-        data = {
-            "messages": serialized.data,
-            "next": page + 1 if messages_count > page * page_size else None,
-        }
-        self.send_group(self.username, "message.list", data)
+        messages, page_size = message_page(
+            Message.objects.filter(connection=connection).values(*MESSAGE_VALUES),
+            data,
+        )
+        data = message_list_data(list(messages), data, page_size, connection)
+        self.reply("message.list", data)
 
     def receive_message_send(self, data):
         user = self.scope["user"]
         connectionId = data.get("connectionId")
         messageText = data.get("messageText")
+        if not social_graph.is_member(user.id, connectionId):
+            print(f"Error: not part of connection pk={connectionId}")
+            return
         try:
-            connection = Connection.objects.get(pk=connectionId)
+            connection = Connection.objects.select_related("sender", "receiver").get(
+                pk=connectionId
+            )
         except Connection.DoesNotExist:
             print("Error: connection object not found")
             return
-        message = Message.objects.create(
-            connection=connection, sender=user, text=messageText
-        )
-        serialized = MessageSerializer(message)
-        self.send_group(connection.sender.username, "message.send", serialized.data)
-        self.send_group(connection.receiver.username, "message.send", serialized.data)
+        if not social_graph.verify(connection, user.id):
+            print(f"Error: not part of connection pk={connectionId}")
+            return
+        message = send_message(connection, user, messageText)
+        serialized = message_data(message, connection)
+        self.send_group(connection.sender.username, "message.send", serialized)
+        self.send_group(connection.receiver.username, "message.send", serialized)
 
     def receive_friend_list(self, data):
         user = self.scope["user"]
-        # latest message subquery
-        latest_message = Message.objects.filter(connection=OuterRef("id")).order_by(
-            "-created"
-        )[:1]
-        connections = (
-            Connection.objects.filter(Q(receiver=user) | Q(sender=user), approved=True)
-            .annotate(
-                latest_text=latest_message.values("text"),
-                latest_created=latest_message.values("created"),
-            )
-            .order_by(Coalesce("latest_created", "updated").desc())
+        conversations = (
+            Conversation.objects.filter(user=user)
+            .order_by("-last_activity")
+            .values(*FRIEND_VALUES)
         )
-        serialized = FriendSerializer(connections, context={"user": user}, many=True)
-        self.send_group(self.username, "friend.list", serialized.data)
+        serialized = friend_list_data(conversations)
+        self.reply("friend.list", serialized)
 
     def receive_request_list(self, data):
         user = self.scope["user"]
-        connections = Connection.objects.filter(receiver=user, approved=False)
-        serialized = RequestSerializer(connections, many=True)
-        self.send_group(self.username, "request.list", serialized.data)
+        connections = Connection.objects.filter(receiver=user, approved=False).values(
+            *REQUEST_VALUES
+        )
+        serialized = request_list_data(connections)
+        self.reply("request.list", serialized)
 
     def receive_request_accept(self, data):
         request_id = data.get("id")
         user = self.scope["user"]
-        connection = Connection.objects.get(pk=request_id)
+        # only the receiver of a pending request can accept it
+        if not social_graph.is_member(user.id, request_id, RECEIVED):
+            print(f"Error: no request pk={request_id} to accept")
+            return
+        connection = (
+            Connection.objects.select_related("sender", "receiver")
+            .filter(pk=request_id)
+            .first()
+        )
+        if connection is None or not social_graph.verify(connection, user.id, RECEIVED):
+            print(f"Error: no request pk={request_id} to accept")
+            return
         connection.approved = True
+        # `updated` is set in memory by auto_now, no need to reload the row
         connection.save()
-        connection.refresh_from_db()
-        serialized = RequestSerializer(connection)
-        self.send_group(self.username, "request.accept", serialized.data)
-        # send updated connections list
-        connections = Connection.objects.filter(receiver=user, approved=False)
-        serialized = RequestSerializer(connections, many=True)
-        self.send_group(self.username, "request.list", serialized.data)
-        self.receive_friend_list(data)  # refresh friend list for the user
-        # refresh friend's friends list
-        serialized_friend = FriendSerializer(
-            connection, context={"user": connection.sender}
-        )
-        self.send_group(
-            connection.sender.username, "friend.new", serialized_friend.data
-        )
+        social_graph.add(connection)
+        sender_side, receiver_side = open_conversations(connection)
+        # deltas only: the request leaves the list and each end gets a new
+        # friend, clients update their lists instead of reloading them
+        serialized = request_data(connection)
+        self.send_group(self.username, "request.accept", serialized)
+        self.send_group(self.username, "friend.new", friend_data(receiver_side))
+        serialized_friend = friend_data(sender_side)
+        self.send_group(connection.sender.username, "friend.new", serialized_friend)
 
     def receive_thumbnail(self, data):
-        user = self.scope["user"]
-        # convert base64 data to django content file
+        # base64 image, or nothing to remove the thumbnail
         image_str = data.get("base64")
         if not image_str:
             self.delete_thumbnail()
             return
-        image = ContentFile(base64.b64decode(image_str))
-        # update thumbnail field
-        filename = data.get("filename")
-        user.thumbnail.save(filename, image, save=True)
+        self.ingest_thumbnail(BytesIO(base64.b64decode(image_str)))
+
+    def ingest_thumbnail(self, file):
+        user = self.scope["user"]
+        # resized in the thumbnail pool, which bounds how many run at once
+        try:
+            user.thumbnail = thumbnail_pool.submit(ingest, user.id, file).result()
+        except ThumbnailError as error:
+            self.reply("thumbnail.error", {"error": str(error)})
+            return
+        finally:
+            file.close()
         # Serialize user
-        serialized = UserSerializer(user)
+        serialized = scope_user_data(user)
         # Send updated user data
-        self.send_group(self.username, "thumbnail", serialized.data)
+        self.send_group(self.username, "thumbnail", serialized)
+
+    def receive_upload_start(self, data):
+        if self.upload is not None:
+            self.upload.close()
+            self.upload = None
+        try:
+            self.upload = Upload(data.get("kind"), data.get("size"), data.get("sha256"))
+        except UploadError as error:
+            self.reply("upload.error", {"error": str(error)})
+
+    def receive_upload_chunk(self, chunk):
+        upload = self.upload
+        if upload is None:
+            error = "No upload in progress"
+            self.reply("upload.error", {"error": error})
+            return
+        try:
+            upload.write(chunk)
+            if not upload.complete:
+                return
+            file = upload.finish()
+        except UploadError as error:
+            upload.close()
+            self.upload = None
+            self.reply("upload.error", {"error": str(error)})
+            return
+        self.upload = None
+        # thumbnails are the only kind so far
+        self.ingest_thumbnail(file)
+
+    def reply(self, source, data):
+        """Send to this socket only, without a round trip through the layer."""
+        self.broadcast_group(
+            {"type": "broadcast_group", "source": source, "data": data}
+        )
 
     def send_group(self, group, source, data):
+        """Send to every socket of `group`: all the devices of a user."""
         response = {"type": "broadcast_group", "source": source, "data": data}
-        async_to_sync(self.channel_layer.group_send)(group, response)
+        async_to_sync(group_send)(self.channel_layer, group, response)
 
     def broadcast_group(self, data):
         """
@@ -249,4 +443,368 @@ class ChatConsumer(WebsocketConsumer):
             - source: where it originated from
             - data: data as a dict
         """
-        self.send(text_data=json.dumps(data))
+        async_to_sync(self.outbound.push)(data)
+
+
+class AsyncChatConsumer(AsyncWebsocketConsumer):
+    """
+    Native async version of ChatConsumer.
+
+    Speaks the same `source` protocol as ChatConsumer but never holds a
+    worker thread per socket: queries go through the async ORM and group
+    messages are awaited directly on the channel layer. Relations used by
+    the serializers are loaded up front because lazy loading is not allowed
+    from an async context.
+    """
+
+    async def connect(self):
+        user = self.scope["user"]
+        if not user.is_authenticated:
+            return
+        # save username to use as a group name for this user
+        self.username = user.username
+        # (query, time, results) of the last search, to debounce repeats
+        self.last_search = (None, 0, None)
+        # binary upload in progress, see uploads.py
+        self.upload = None
+        # JSON or MessagePack frames, see wire.py
+        self.wire, subprotocol = negotiate(self.scope)
+        # frames queued for this socket, see outbound.py
+        self.outbound = Outbound(self.base_send, self.wire)
+        # thumbnails being processed, referenced until they are done
+        self.thumbnail_tasks = set()
+        # load who this user is connected to before the first search
+        await database_sync_to_async(social_graph.get)(user.id)
+        # Join this user to a group with their username
+        await self.channel_layer.group_add(self.username, self.channel_name)
+        # tell friends this user is online, unless another socket already has
+        await presence.connect(self.channel_layer, user, self.channel_name)
+        await self.accept(subprotocol)
+        open_sockets.inc()
+        if wants_init(self.scope):
+            await self.receive_session_init({})
+
+    async def disconnect(self, code):
+        # Leave group/room
+        await self.channel_layer.group_discard(self.username, self.channel_name)
+        open_sockets.dec()
+        await self.outbound.close()
+        await presence.disconnect(
+            self.channel_layer, self.scope["user"], self.channel_name
+        )
+        if self.upload is not None:
+            self.upload.close()
+
+    # Handle requests
+
+    async def receive(self, text_data=None, bytes_data=None):
+        with handling(self, text_data, bytes_data) as frame:
+            if bytes_data is not None and not self.wire.binary:
+                frame.source = "upload.chunk"
+                await self.receive_upload_chunk(bytes_data)
+                return
+            # receive message from websocket
+            data = self.wire.loads(text_data, bytes_data)
+            data_source = data.get("source")
+            frame.source = data_source
+            if data_source == "upload.chunk":
+                await self.receive_upload_chunk(data.get("chunk"))
+                return
+
+            if data_source == "thumbnail":
+                await self.receive_thumbnail(data)
+            elif data_source == "search":
+                await self.receive_search(data)
+            elif data_source == "request.connect":
+                await self.receive_request_connect(data)
+            elif data_source == "request.list":
+                await self.receive_request_list(data)
+            elif data_source == "request.accept":
+                await self.receive_request_accept(data)
+            elif data_source == "friend.list":
+                await self.receive_friend_list(data)
+            elif data_source == "message.send":
+                await self.receive_message_send(data)
+            elif data_source == "message.list":
+                await self.receive_message_list(data)
+            elif data_source == "message.type":
+                await self.receive_message_type(data)
+            elif data_source == "typing.on":
+                await self.receive_typing_on(data)
+            elif data_source == "upload.start":
+                await self.receive_upload_start(data)
+            elif data_source == "presence.list":
+                await self.receive_presence_list(data)
+            elif data_source == "sync":
+                await self.receive_sync(data)
+            elif data_source == "session.init":
+                await self.receive_session_init(data)
+            elif data_source == "message.search":
+                await self.receive_message_search(data)
+
+    async def delete_thumbnail(self):
+        user = self.scope["user"]
+        await database_sync_to_async(remove_thumbnail)(user.id)
+        user.thumbnail = None
+        serialized = scope_user_data(user)
+        await self.send_group(self.username, "thumbnail", serialized)
+
+    async def receive_request_connect(self, data):
+        username = data["username"]
+        user = self.scope["user"]
+        try:
+            receiver = await User.objects.aget(username=username)
+        except User.DoesNotExist:
+            print("Error: user not found")
+            return
+        connection, _ = await Connection.objects.aget_or_create(
+            sender=user, receiver=receiver
+        )
+        social_graph.add(connection)
+        # already loaded, don't lazy load it again; the sender is the socket's
+        # user, loaded when it connected, see scope_user_data
+        connection.receiver = receiver
+        serialized = request_data(connection, scope_user_data(user))
+        await self.send_group(self.username, "request.connect", serialized)
+        await self.send_group(receiver.username, "request.connect", serialized)
+
+    async def receive_search(self, data):
+        user = self.scope["user"]
+        query = search_query(data)
+        last_query, searched_at, serialized = self.last_search
+        if query != last_query or time.monotonic() - searched_at > SEARCH_DEBOUNCE:
+            ids = await database_sync_to_async(search_user_ids)(query, user.id)
+            users = [u async for u in search_queryset(ids)]
+            adjacency = social_graph.peek(user.id) or await database_sync_to_async(
+                social_graph.get
+            )(user.id)
+            serialized = search_data(with_status(users, ids, adjacency))
+            self.last_search = (query, time.monotonic(), serialized)
+
+        await self.reply("search", serialized)
+
+    async def receive_message_search(self, data):
+        serialized = await database_sync_to_async(message_search_data)(
+            self.scope["user"].id, data
+        )
+        await self.reply("message.search", serialized)
+
+    async def receive_typing_on(self, data):
+        friend = data.get("friend")
+        await ephemeral.emit(
+            self.channel_layer,
+            self.username,
+            friend["username"],
+            "typing.on",
+            {"friend_username": self.scope["user"].username},
+        )
+
+    async def receive_message_type(self, data):
+        user = self.scope["user"]
+        recipient_username = data.get("username")
+
+        data = {"username": user.username}
+        await ephemeral.emit(
+            self.channel_layer,
+            self.username,
+            recipient_username,
+            "message.type",
+            data,
+        )
+
+    async def receive_session_init(self, data):
+        serialized = await database_sync_to_async(session_data)(self.scope["user"])
+        await self.reply("session.init", serialized)
+
+    async def receive_sync(self, data):
+        serialized = await database_sync_to_async(catch_up)(
+            self.scope["user"], data.get("since")
+        )
+        await self.reply("sync", serialized)
+
+    async def receive_presence_list(self, data):
+        # usernames of the friends online now, later changes come as presence
+        usernames = await database_sync_to_async(friend_usernames)(
+            self.scope["user"].id, online=True
+        )
+        await self.reply("presence.list", usernames)
+
+    async def receive_message_list(self, data):
+        connectionId = data.get("connectionId")
+        if not await self.is_member(connectionId):
+            print(f"Error: not part of connection pk={connectionId}")
+            return
+        try:
+            connection = await Connection.objects.select_related(
+                "sender", "receiver"
+            ).aget(pk=connectionId)
+        except Connection.DoesNotExist:
+            print(f"Connection pk={connectionId} does not exist")
+            return
+        if not social_graph.verify(connection, self.scope["user"].id):
+            print(f"Error: not part of connection pk={connectionId}")
+            return
+        if not data.get("page") and message_cursor(data) is None:
+            # opening the conversation reads it
+            await database_sync_to_async(mark_read)(connection, self.scope["user"])
+
+        messages, page_size = message_page(
+            Message.objects.filter(connection=connection).values(*MESSAGE_VALUES),
+            data,
+        )
+        data = message_list_data(
+            [m async for m in messages], data, page_size, connection
+        )
+        await self.reply("message.list", data)
+
+    async def receive_message_send(self, data):
+        user = self.scope["user"]
+        connectionId = data.get("connectionId")
+        messageText = data.get("messageText")
+        if not await self.is_member(connectionId):
+            print(f"Error: not part of connection pk={connectionId}")
+            return
+        # stored and broadcast with the other sends of its batch
+        message = await message_writer.send(
+            self.channel_layer, connection_key(connectionId), user, messageText
+        )
+        if message is None:
+            print("Error: connection object not found")
+
+    async def receive_friend_list(self, data):
+        user = self.scope["user"]
+        conversations = (
+            Conversation.objects.filter(user=user)
+            .order_by("-last_activity")
+            .values(*FRIEND_VALUES)
+        )
+        serialized = friend_list_data([c async for c in conversations])
+        await self.reply("friend.list", serialized)
+
+    async def receive_request_list(self, data):
+        user = self.scope["user"]
+        connections = Connection.objects.filter(receiver=user, approved=False).values(
+            *REQUEST_VALUES
+        )
+        serialized = request_list_data([c async for c in connections])
+        await self.reply("request.list", serialized)
+
+    async def receive_request_accept(self, data):
+        request_id = data.get("id")
+        # only the receiver of a pending request can accept it
+        if not await self.is_member(request_id, RECEIVED):
+            print(f"Error: no request pk={request_id} to accept")
+            return
+        connection = (
+            await Connection.objects.select_related("sender", "receiver")
+            .filter(pk=request_id)
+            .afirst()
+        )
+        user_id = self.scope["user"].id
+        if connection is None or not social_graph.verify(connection, user_id, RECEIVED):
+            print(f"Error: no request pk={request_id} to accept")
+            return
+        connection.approved = True
+        # `updated` is set in memory by auto_now, no need to reload the row
+        await connection.asave()
+        social_graph.add(connection)
+        sender_side, receiver_side = await database_sync_to_async(open_conversations)(
+            connection
+        )
+        # deltas only: the request leaves the list and each end gets a new
+        # friend, clients update their lists instead of reloading them
+        serialized = request_data(connection)
+        await self.send_group(self.username, "request.accept", serialized)
+        await self.send_group(self.username, "friend.new", friend_data(receiver_side))
+        serialized_friend = friend_data(sender_side)
+        await self.send_group(
+            connection.sender.username, "friend.new", serialized_friend
+        )
+
+    async def receive_thumbnail(self, data):
+        image_str = data.get("base64")
+        if not image_str:
+            await self.delete_thumbnail()
+            return
+        self.start_thumbnail(BytesIO(base64.b64decode(image_str)))
+
+    def start_thumbnail(self, file):
+        # resized in the thumbnail pool while this socket keeps serving frames
+        task = asyncio.create_task(self.ingest_thumbnail(file))
+        self.thumbnail_tasks.add(task)
+        task.add_done_callback(self.thumbnail_tasks.discard)
+
+    async def ingest_thumbnail(self, file):
+        user = self.scope["user"]
+        loop = asyncio.get_running_loop()
+        try:
+            user.thumbnail = await loop.run_in_executor(
+                thumbnail_pool, ingest, user.id, file
+            )
+        except ThumbnailError as error:
+            await self.reply("thumbnail.error", {"error": str(error)})
+            return
+        finally:
+            file.close()
+        # Serialize user
+        serialized = scope_user_data(user)
+        # Send updated user data
+        await self.send_group(self.username, "thumbnail", serialized)
+
+    async def receive_upload_start(self, data):
+        if self.upload is not None:
+            self.upload.close()
+            self.upload = None
+        try:
+            self.upload = Upload(data.get("kind"), data.get("size"), data.get("sha256"))
+        except UploadError as error:
+            await self.reply("upload.error", {"error": str(error)})
+
+    async def receive_upload_chunk(self, chunk):
+        upload = self.upload
+        if upload is None:
+            error = "No upload in progress"
+            await self.reply("upload.error", {"error": error})
+            return
+        try:
+            upload.write(chunk)
+            if not upload.complete:
+                return
+            file = upload.finish()
+        except UploadError as error:
+            upload.close()
+            self.upload = None
+            await self.reply("upload.error", {"error": str(error)})
+            return
+        self.upload = None
+        # thumbnails are the only kind so far
+        self.start_thumbnail(file)
+
+    async def is_member(self, connection_id, *states):
+        """social_graph.is_member for this user, querying only on a miss."""
+        user_id = self.scope["user"].id
+        if social_graph.is_cached_member(user_id, connection_id, *states):
+            return True
+        return await database_sync_to_async(social_graph.is_member)(
+            user_id, connection_id, *states
+        )
+
+    async def reply(self, source, data):
+        """Send to this socket only, without a round trip through the layer."""
+        await self.broadcast_group(
+            {"type": "broadcast_group", "source": source, "data": data}
+        )
+
+    async def send_group(self, group, source, data):
+        """Send to every socket of `group`: all the devices of a user."""
+        response = {"type": "broadcast_group", "source": source, "data": data}
+        await group_send(self.channel_layer, group, response)
+
+    async def broadcast_group(self, data):
+        """
+        data:
+            - type: "broadcast_group"
+            - source: where it originated from
+            - data: data as a dict
+        """
+        await self.outbound.push(data)
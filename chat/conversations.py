@@ -0,0 +1,80 @@
+from django.db import models, transaction
+from django.db.models import Case, F, Value, When
+from .models import Conversation, Message
+
+PREVIEW_LENGTH = 255
+
+
+def open_conversations(connection):
+    """
+    Create both friend list entries of a newly approved connection.
+
+    Returns the (sender side, receiver side) pair. Existing entries are
+    left untouched, so accepting twice is harmless.
+    """
+    sides = (
+        Conversation(
+            connection=connection,
+            user=connection.sender,
+            friend=connection.receiver,
+            last_activity=connection.updated,
+        ),
+        Conversation(
+            connection=connection,
+            user=connection.receiver,
+            friend=connection.sender,
+            last_activity=connection.updated,
+        ),
+    )
+    Conversation.objects.bulk_create(sides, ignore_conflicts=True)
+    return sides
+
+
+def send_message(connection, sender, text):
+    """Store a message and move it to the top of both friend lists."""
+    return send_messages([(connection, sender, text)])[0]
+
+
+@transaction.atomic
+def send_messages(entries):
+    """
+    send_message for each (connection, sender, text) of `entries`, in one
+    transaction. Messages are inserted in the given order, so ids and
+    `created` keep that order within each connection.
+    """
+    messages = Message.objects.bulk_create(
+        [
+            Message(connection=connection, sender=sender, text=text)
+            for connection, sender, text in entries
+        ]
+    )
+    sent = {}
+    for (connection, _, _), message in zip(entries, messages):
+        sent.setdefault(connection.id, (connection, []))[1].append(message)
+    for connection, batch in sent.values():
+        last = batch[-1]
+        Conversation.objects.filter(connection=connection).update(
+            last_message=last,
+            preview=last.text[:PREVIEW_LENGTH],
+            last_activity=last.created,
+            # each side gains the messages the other side sent
+            unread=F("unread")
+            + Case(
+                *[
+                    When(
+                        user_id=user_id,
+                        then=Value(sum(m.sender_id != user_id for m in batch)),
+                    )
+                    for user_id in (connection.sender_id, connection.receiver_id)
+                ],
+                default=Value(0),
+                output_field=models.PositiveIntegerField(),
+            ),
+        )
+    return messages
+
+
+def mark_read(connection, user):
+    Conversation.objects.filter(connection=connection, user=user, unread__gt=0).update(
+        unread=0
+    )
@@ -0,0 +1,47 @@
+"""
+JSON encoding of websocket frames.
+
+CHAT_JSON_ENCODER picks the library: "json" (standard library, the
+default), "orjson", "ujson", or "auto" for the fastest one installed.
+Only "json" keeps frames byte-identical: the third party encoders write
+compact JSON, which decodes to the same data as json.dumps but is not the
+same bytes, so they have to be asked for.
+"""
+
+import json
+from django.conf import settings
+
+
+def orjson_dumps():
+    import orjson
+
+    return lambda data: orjson.dumps(data).decode()
+
+
+def ujson_dumps():
+    import ujson
+
+    return lambda data: ujson.dumps(
+        data, ensure_ascii=False, escape_forward_slashes=False
+    )
+
+
+def json_dumps():
+    return json.dumps
+
+
+ENCODERS = {"orjson": orjson_dumps, "ujson": ujson_dumps, "json": json_dumps}
+
+
+def get_dumps(name):
+    if name != "auto":
+        return ENCODERS[name]()
+    for candidate in ("orjson", "ujson"):
+        try:
+            return ENCODERS[candidate]()
+        except ImportError:
+            continue
+    return json.dumps
+
+
+dumps = get_dumps(getattr(settings, "CHAT_JSON_ENCODER", "json"))
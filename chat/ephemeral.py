@@ -0,0 +1,131 @@
+"""
+Ephemeral events: typing indicators that are worth nothing once stale.
+
+Instead of one group_send per keystroke, events from a sender to a
+recipient are coalesced: the first one of each CHAT_TYPING_WINDOW is
+sent, later ones only keep the indicator alive. CHAT_TYPING_EXPIRY
+seconds after the last one, a "typing.off" is sent on the sender's behalf,
+so clients don't need their own timeouts. Each recipient accepts at most
+CHAT_EPHEMERAL_RATE events per second from this process; past that they
+are dropped, never queued.
+
+State lives on the event loop the consumers run on and is only touched
+from it, so it needs no locking. The sync consumer reaches it through
+async_to_sync.
+"""
+
+import asyncio
+from django.conf import settings
+from .metrics import group_send
+
+
+class EphemeralChannel:
+    """Typing indicators on their way to the channel layer."""
+
+    def __init__(self, window, expiry, rate):
+        self.window = window
+        self.expiry = expiry
+        self.rate = rate
+        # (sender, recipient, source) -> loop time it was last sent
+        self.last_sent = {}
+        # (sender, recipient) -> TimerHandle of its typing.off
+        self.expiries = {}
+        # recipient -> [second it counts, events sent in it]
+        self.budgets = {}
+        # typing.off sends, referenced until they are done
+        self.tasks = set()
+        self.emitted = 0
+        self.coalesced = 0
+        self.dropped = 0
+        self.expired = 0
+
+    async def emit(self, channel_layer, sender, recipient, source, data):
+        """
+        Send `source` from `sender` to the `recipient` group unless an
+        identical event went out less than `window` ago or the recipient
+        is over its rate. Returns whether it was sent.
+        """
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        self.keep_alive(loop, channel_layer, sender, recipient)
+        key = (sender, recipient, source)
+        last = self.last_sent.get(key)
+        if last is not None and now - last < self.window:
+            self.coalesced += 1
+            return False
+        if not self.spend(recipient, now):
+            self.dropped += 1
+            return False
+        self.last_sent[key] = now
+        self.emitted += 1
+        await group_send(
+            channel_layer,
+            recipient,
+            {"type": "broadcast_group", "source": source, "data": data},
+        )
+        return True
+
+    def spend(self, recipient, now):
+        second = int(now)
+        budget = self.budgets.get(recipient)
+        if budget is None or budget[0] != second:
+            budget = self.budgets[recipient] = [second, 0]
+        if budget[1] >= self.rate:
+            return False
+        budget[1] += 1
+        return True
+
+    def keep_alive(self, loop, channel_layer, sender, recipient):
+        pair = (sender, recipient)
+        handle = self.expiries.get(pair)
+        if handle is not None:
+            handle.cancel()
+        self.expiries[pair] = loop.call_later(
+            self.expiry, self.expire, channel_layer, sender, recipient
+        )
+
+    def expire(self, channel_layer, sender, recipient):
+        # the sender stopped typing: forget the pair and say so
+        del self.expiries[(sender, recipient)]
+        for key in [key for key in self.last_sent if key[:2] == (sender, recipient)]:
+            del self.last_sent[key]
+        budget = self.budgets.get(recipient)
+        if budget is not None and budget[0] < int(asyncio.get_running_loop().time()):
+            del self.budgets[recipient]
+        self.expired += 1
+        task = asyncio.ensure_future(
+            group_send(
+                channel_layer,
+                recipient,
+                {
+                    "type": "broadcast_group",
+                    "source": "typing.off",
+                    "data": {"friend_username": sender},
+                },
+            )
+        )
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    def clear(self):
+        for handle in self.expiries.values():
+            handle.cancel()
+        self.expiries.clear()
+        self.last_sent.clear()
+        self.budgets.clear()
+
+    def stats(self):
+        return {
+            "emitted": self.emitted,
+            "coalesced": self.coalesced,
+            "dropped": self.dropped,
+            "expired": self.expired,
+            "typing": len(self.expiries),
+        }
+
+
+ephemeral = EphemeralChannel(
+    window=getattr(settings, "CHAT_TYPING_WINDOW", 1.0),
+    expiry=getattr(settings, "CHAT_TYPING_EXPIRY", 3.0),
+    rate=getattr(settings, "CHAT_EPHEMERAL_RATE", 20),
+)
@@ -0,0 +1,93 @@
+"""
+NDJSON export of a conversation, for archiving.
+
+    GET /chat/connections/<id>/export/?after_id=1234&since=2024-05-01T00:00:00Z
+    Authorization: Bearer <access token>
+
+streams the messages of a connection the caller is part of, oldest first,
+one message.list entry per line. Rows are read CHAT_EXPORT_CHUNK_SIZE at a
+time from a chunked iterator and written as they come, so memory stays
+the same however long the conversation is.
+
+Incremental exports pass the id of the last line they got as `after_id`;
+`since` keeps the messages created at or after a time. Clients accepting
+gzip in Accept-Encoding (with a q-value above 0) get the stream gzip
+compressed. Only friends can export: not pending requests.
+"""
+
+import zlib
+from django.conf import settings
+from django.utils.dateparse import parse_datetime
+from .encoders import dumps
+from .fast_serializers import MESSAGE_VALUES, messages_data
+from .models import Message
+
+EXPORT_CHUNK_SIZE = getattr(settings, "CHAT_EXPORT_CHUNK_SIZE", 2000)
+
+
+class ExportError(Exception):
+    pass
+
+
+def export_queryset(connection, after_id=None, since=None):
+    """Messages of `connection` matching the query parameters, by id."""
+    messages = Message.objects.filter(connection=connection)
+    if after_id is not None:
+        try:
+            messages = messages.filter(id__gt=int(after_id))
+        except ValueError:
+            raise ExportError("after_id must be a message id")
+    if since is not None:
+        try:
+            since = parse_datetime(since)
+        except ValueError:
+            since = None
+        if since is None:
+            raise ExportError("since must be an ISO 8601 datetime")
+        messages = messages.filter(created__gte=since)
+    return messages.order_by("id").values(*MESSAGE_VALUES)
+
+
+def accepts_gzip(accept_encoding):
+    """Whether an Accept-Encoding header value allows gzip."""
+    qualities = {}
+    for item in accept_encoding.split(","):
+        coding, _, params = item.partition(";")
+        quality = 1.0
+        for param in params.split(";"):
+            name, _, value = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        qualities[coding.strip().lower()] = quality
+    quality = qualities.get("gzip", qualities.get("x-gzip", qualities.get("*", 0)))
+    return quality > 0
+
+
+def ndjson(rows, connection):
+    lines = [dumps(message) for message in messages_data(rows, connection)]
+    return ("\n".join(lines) + "\n").encode()
+
+
+async def export_stream(connection, messages, compress=False):
+    """Chunks of the NDJSON lines of `messages`, gzipped if `compress`."""
+    # wbits=31 writes the gzip header and trailer
+    gzip = zlib.compressobj(wbits=31) if compress else None
+    rows = []
+    async for row in messages.aiterator(chunk_size=EXPORT_CHUNK_SIZE):
+        rows.append(row)
+        if len(rows) < EXPORT_CHUNK_SIZE:
+            continue
+        chunk = ndjson(rows, connection)
+        rows = []
+        if gzip is None:
+            yield chunk
+        elif chunk := gzip.compress(chunk):
+            yield chunk
+    chunk = ndjson(rows, connection) if rows else b""
+    if gzip is not None:
+        chunk = gzip.compress(chunk) + gzip.flush()
+    if chunk:
+        yield chunk
@@ -0,0 +1,261 @@
+"""
+Fast-path serializers for websocket frames.
+
+They build exactly the data of the DRF serializers in serializers.py (the
+json.dumps output is byte for byte the same) without DRF field
+introspection. Every payload shape is a FieldPlan compiled once at import
+time, reading either model instances or `.values()` rows, which also skip
+model instantiation.
+"""
+
+from operator import attrgetter, itemgetter
+from django.conf import settings
+from django.utils import timezone
+from .models import User
+from .profiles import profile_cache
+from .serializers import capitalize_all
+from .thumbnails import variant
+
+
+def iso_datetime(value):
+    # same output as DRF DateTimeField with the default ISO 8601 format
+    if not value:
+        return None
+    if settings.USE_TZ and timezone.is_aware(value):
+        value = value.astimezone(timezone.get_current_timezone())
+    value = value.isoformat()
+    if value.endswith("+00:00"):
+        value = value[:-6] + "Z"
+    return value
+
+
+def thumbnail_url(value):
+    # FieldFile on instances, the stored name in `.values()` rows
+    name = getattr(value, "name", value)
+    if not name:
+        return None
+    return User._meta.get_field("thumbnail").storage.url(variant(name))
+
+
+def full_name(first_name, last_name):
+    return capitalize_all(f"{first_name} {last_name}")
+
+
+def search_status(pending_them, pending_me, connected):
+    if pending_them:
+        return "pending-them"
+    elif pending_me:
+        return "pending-me"
+    elif connected:
+        return "connected"
+    else:
+        return "not-connected"
+
+
+class FieldPlan:
+    """
+    Output keys of one payload shape, in order, with where to read them.
+
+    Each field is (key, source, convert). `source` is a model field name,
+    or a tuple of names for computed keys, whose values are then passed to
+    `convert` as separate arguments. `convert` may be None.
+    """
+
+    def __init__(self, *fields):
+        self.fields = fields
+        self.instance_plan = self.compile(attrgetter, "")
+        self.row_plans = {}
+
+    def compile(self, getter, prefix):
+        plan = []
+        for key, source, convert in self.fields:
+            names = source if isinstance(source, tuple) else (source,)
+            get = getter(*(prefix + name for name in names))
+            plan.append((key, get, convert, len(names) > 1))
+        return tuple(plan)
+
+    def values(self, prefix=""):
+        """Field names to pass to `.values()` for rows read with `prefix`."""
+        names = []
+        for _, source, _ in self.fields:
+            for name in source if isinstance(source, tuple) else (source,):
+                if prefix + name not in names:
+                    names.append(prefix + name)
+        return names
+
+    def run(self, plan, obj):
+        data = {}
+        for key, get, convert, many in plan:
+            value = get(obj)
+            if convert is None:
+                data[key] = value
+            elif many:
+                data[key] = convert(*value)
+            else:
+                data[key] = convert(value)
+        return data
+
+    def from_instance(self, obj):
+        return self.run(self.instance_plan, obj)
+
+    def from_row(self, row, prefix=""):
+        plan = self.row_plans.get(prefix)
+        if plan is None:
+            plan = self.row_plans[prefix] = self.compile(itemgetter, prefix)
+        return self.run(plan, row)
+
+
+USER_PLAN = FieldPlan(
+    ("id", "id", None),
+    ("username", "username", None),
+    ("first_name", "first_name", None),
+    ("last_name", "last_name", None),
+    ("full_name", ("first_name", "last_name"), full_name),
+    ("thumbnail", "thumbnail", thumbnail_url),
+)
+
+SEARCH_PLAN = FieldPlan(
+    ("username", "username", None),
+    ("full_name", ("first_name", "last_name"), full_name),
+    ("thumbnail", "thumbnail", thumbnail_url),
+    ("status", ("pending_them", "pending_me", "connected"), search_status),
+)
+
+# `.values()` names read by the row based functions below
+SEARCH_VALUES = SEARCH_PLAN.values()
+FRIEND_VALUES = [
+    "connection_id",
+    "preview",
+    "last_activity",
+    "unread",
+    *USER_PLAN.values("friend__"),
+]
+MESSAGE_VALUES = ["id", "connection_id", "sender_id", "text", "created"]
+REQUEST_VALUES = [
+    "id",
+    "created",
+    *USER_PLAN.values("sender__"),
+    *USER_PLAN.values("receiver__"),
+]
+
+
+def user_data(user):
+    """
+    UserSerializer(user).data, through the profile cache. `user` must have
+    just been read from the database.
+    """
+    return profile_cache.get(user.id, lambda: USER_PLAN.from_instance(user))
+
+
+def scope_user_data(user):
+    """
+    user_data of a socket's own user, loaded when it connected. It is read
+    from the cache but never fills it, so that the profile of an instance
+    older than the last invalidation isn't cached for every reader.
+    """
+    return profile_cache.get(user.id, lambda: USER_PLAN.from_instance(user), fill=False)
+
+
+def user_row_data(row, prefix):
+    """user_data for the user read with `prefix` in a `.values()` row."""
+    return profile_cache.get(
+        row[prefix + "id"], lambda: USER_PLAN.from_row(row, prefix)
+    )
+
+
+def search_data(rows):
+    """SearchSerializer(users, many=True).data, from SEARCH_VALUES rows."""
+    return [SEARCH_PLAN.from_row(row) for row in rows]
+
+
+def request_data(connection, sender_data=None):
+    """
+    RequestSerializer(connection).data. `sender_data` replaces the user_data
+    of a sender that wasn't just read, such as a socket's own user.
+    """
+    return {
+        "id": connection.id,
+        "sender": sender_data or user_data(connection.sender),
+        "receiver": user_data(connection.receiver),
+        "created": iso_datetime(connection.created),
+    }
+
+
+def request_list_data(rows):
+    """RequestSerializer(connections, many=True).data, from REQUEST_VALUES rows."""
+    return [
+        {
+            "id": row["id"],
+            "sender": user_row_data(row, "sender__"),
+            "receiver": user_row_data(row, "receiver__"),
+            "created": iso_datetime(row["created"]),
+        }
+        for row in rows
+    ]
+
+
+def friend_data(conversation):
+    """FriendSerializer(conversation).data"""
+    return {
+        "id": conversation.connection_id,
+        "friend": user_data(conversation.friend),
+        "preview": conversation.preview or "New connection",
+        "updated": conversation.last_activity.isoformat(),
+        "unread": conversation.unread,
+    }
+
+
+def friend_list_data(rows):
+    """FriendSerializer(conversations, many=True).data, from FRIEND_VALUES rows."""
+    return [
+        {
+            "id": row["connection_id"],
+            "friend": user_row_data(row, "friend__"),
+            "preview": row["preview"] or "New connection",
+            "updated": row["last_activity"].isoformat(),
+            "unread": row["unread"],
+        }
+        for row in rows
+    ]
+
+
+def message_data(message, connection):
+    """MessageSerializer(message).data"""
+    return messages_data(
+        [
+            {
+                "id": message.id,
+                "connection_id": message.connection_id,
+                "sender_id": message.sender_id,
+                "text": message.text,
+                "created": message.created,
+            }
+        ],
+        connection,
+    )[0]
+
+
+def messages_data(rows, connection):
+    """
+    MessageSerializer(messages, many=True).data, from MESSAGE_VALUES rows of
+    `connection`, whose sender and receiver must be loaded.
+
+    Messages only ever involve the two users of the connection, so each of
+    them is serialized once for the whole page.
+    """
+    sender = user_data(connection.sender)
+    receiver = user_data(connection.receiver)
+    data = []
+    for row in rows:
+        from_sender = row["sender_id"] == connection.sender_id
+        data.append(
+            {
+                "id": row["id"],
+                "connection": row["connection_id"],
+                "sender": sender if from_sender else receiver,
+                "receiver": receiver if from_sender else sender,
+                "text": row["text"],
+                "created": iso_datetime(row["created"]),
+            }
+        )
+    return data
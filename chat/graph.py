@@ -0,0 +1,187 @@
+"""
+Process-local cache of the social graph: who each user is connected to.
+
+Search statuses and the "is this user part of connection X" checks of the
+consumers read it instead of querying Connection. A user's adjacency is
+loaded with one query the first time it is needed, then kept current by
+the consumers as requests are sent and accepted. Entries expire after
+CHAT_SOCIAL_GRAPH_TTL seconds, which bounds how long a connection made
+through another process can go unnoticed by search. Membership checks
+never trust a miss: they reload the user once before refusing. A hit may
+be stale too, so the handlers that go on to load the connection (to list,
+send, accept or export) check it again against that row with `verify`.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from django.conf import settings
+from django.db.models import Q
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+from .models import Connection
+
+FRIEND = "friend"
+# pending requests, as seen from the user
+SENT = "sent"
+RECEIVED = "received"
+ALL_STATES = (FRIEND, SENT, RECEIVED)
+
+
+class Adjacency:
+    """Connections of one user."""
+
+    __slots__ = ("friends", "sent", "received", "connections", "expires")
+
+    def __init__(self, expires):
+        # user ids
+        self.friends = set()
+        self.sent = set()
+        self.received = set()
+        # connection id -> (other user id, FRIEND, SENT or RECEIVED)
+        self.connections = {}
+        self.expires = expires
+
+    def add(self, connection_id, other_id, state):
+        previous = self.connections.get(connection_id)
+        if previous is not None and previous[1] != FRIEND:
+            getattr(self, previous[1]).discard(other_id)
+        self.connections[connection_id] = (other_id, state)
+        if state == FRIEND:
+            self.friends.add(other_id)
+        else:
+            getattr(self, state).add(other_id)
+
+    def flags(self, other_id):
+        """(pending_them, pending_me, connected) as read by SearchSerializer."""
+        return (
+            other_id in self.sent,
+            other_id in self.received,
+            other_id in self.friends,
+        )
+
+    def friend_connections(self):
+        return [
+            connection_id
+            for connection_id, (_, state) in self.connections.items()
+            if state == FRIEND
+        ]
+
+    def has(self, connection_id, states):
+        entry = self.connections.get(connection_id)
+        return entry is not None and entry[1] in states
+
+
+def connection_key(connection_id):
+    # ids sent by clients may be strings
+    try:
+        return int(connection_id)
+    except (TypeError, ValueError):
+        return None
+
+
+def side_of(connection, user_id):
+    """(other user id, state) of `connection` for `user_id`."""
+    if connection.sender_id == user_id:
+        other_id, pending = connection.receiver_id, SENT
+    else:
+        other_id, pending = connection.sender_id, RECEIVED
+    return other_id, FRIEND if connection.approved else pending
+
+
+class SocialGraph:
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def peek(self, user_id):
+        """Cached adjacency of `user_id`, or None. Never queries."""
+        with self.lock:
+            adjacency = self.entries.get(user_id)
+            if adjacency is None or adjacency.expires <= time.monotonic():
+                return None
+            self.entries.move_to_end(user_id)
+            return adjacency
+
+    def get(self, user_id):
+        adjacency = self.peek(user_id)
+        if adjacency is None:
+            adjacency = self.load(user_id)
+        return adjacency
+
+    def load(self, user_id):
+        adjacency = Adjacency(time.monotonic() + self.ttl)
+        connections = Connection.objects.filter(
+            Q(sender_id=user_id) | Q(receiver_id=user_id)
+        ).only("id", "sender_id", "receiver_id", "approved")
+        for connection in connections:
+            adjacency.add(connection.id, *side_of(connection, user_id))
+        if self.max_size > 0:
+            with self.lock:
+                self.entries[user_id] = adjacency
+                self.entries.move_to_end(user_id)
+                while len(self.entries) > self.max_size:
+                    self.entries.popitem(last=False)
+        return adjacency
+
+    def is_member(self, user_id, connection_id, *states):
+        """
+        Whether `user_id` is on connection `connection_id` in one of
+        `states` (any state if none are given).
+        """
+        connection_id = connection_key(connection_id)
+        if connection_id is None:
+            return False
+        if self.is_cached_member(user_id, connection_id, *states):
+            return True
+        # it may have been made or accepted through another process
+        return self.load(user_id).has(connection_id, states or ALL_STATES)
+
+    def is_cached_member(self, user_id, connection_id, *states):
+        """is_member without querying: False may be a stale cache."""
+        adjacency = self.peek(user_id)
+        return adjacency is not None and adjacency.has(
+            connection_key(connection_id), states or ALL_STATES
+        )
+
+    def verify(self, connection, user_id, *states):
+        """
+        is_member against `connection` as just read from the database. A
+        cached user that disagrees is forgotten, to be reloaded.
+        """
+        member = user_id in (connection.sender_id, connection.receiver_id) and (
+            side_of(connection, user_id)[1] in (states or ALL_STATES)
+        )
+        if not member:
+            self.forget(user_id)
+        return member
+
+    def add(self, connection):
+        """Record a new or updated connection on the cached sides."""
+        for user_id in (connection.sender_id, connection.receiver_id):
+            adjacency = self.peek(user_id)
+            if adjacency is not None:
+                with self.lock:
+                    adjacency.add(connection.id, *side_of(connection, user_id))
+
+    def forget(self, user_id):
+        with self.lock:
+            self.entries.pop(user_id, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+social_graph = SocialGraph(
+    max_size=getattr(settings, "CHAT_SOCIAL_GRAPH_SIZE", 10000),
+    ttl=getattr(settings, "CHAT_SOCIAL_GRAPH_TTL", 60),
+)
+
+
+@receiver(post_delete, sender=Connection)
+def forget_connection(sender, instance, **kwargs):
+    social_graph.forget(instance.sender_id)
+    social_graph.forget(instance.receiver_id)
@@ -0,0 +1,71 @@
+from django.core.management.base import BaseCommand
+from django.db.models import OuterRef
+from django.db.models.functions import Coalesce
+from chat.conversations import PREVIEW_LENGTH
+from chat.models import Connection, Conversation, Message
+
+
+class Command(BaseCommand):
+    help = (
+        "Create or refresh the friend list entries (Conversation) of every "
+        "approved connection from its latest message. Safe to run again."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        latest_message = Message.objects.filter(connection=OuterRef("id")).order_by(
+            "-created", "-id"
+        )[:1]
+        connections = (
+            Connection.objects.filter(approved=True)
+            .annotate(
+                latest_id=latest_message.values("id"),
+                latest_text=latest_message.values("text"),
+                latest_created=Coalesce(latest_message.values("created"), "updated"),
+            )
+            .values_list(
+                "id",
+                "sender_id",
+                "receiver_id",
+                "latest_id",
+                "latest_text",
+                "latest_created",
+            )
+            .order_by("id")
+        )
+        batch = []
+        total = 0
+        for row in connections.iterator(chunk_size=options["batch_size"]):
+            connection_id, sender_id, receiver_id, latest_id, text, created = row
+            for user_id, friend_id in (
+                (sender_id, receiver_id),
+                (receiver_id, sender_id),
+            ):
+                batch.append(
+                    Conversation(
+                        connection_id=connection_id,
+                        user_id=user_id,
+                        friend_id=friend_id,
+                        last_message_id=latest_id,
+                        preview=(text or "")[:PREVIEW_LENGTH],
+                        last_activity=created,
+                    )
+                )
+            if len(batch) >= options["batch_size"]:
+                total += self.flush(batch)
+                batch = []
+        if batch:
+            total += self.flush(batch)
+        self.stdout.write(self.style.SUCCESS(f"Backfilled {total} conversations"))
+
+    def flush(self, batch):
+        # unread counts are kept: there is no read state to rebuild them from
+        Conversation.objects.bulk_create(
+            batch,
+            update_conflicts=True,
+            unique_fields=["user", "connection"],
+            update_fields=["last_message", "preview", "last_activity"],
+        )
+        return len(batch)
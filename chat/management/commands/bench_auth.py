@@ -0,0 +1,128 @@
+import asyncio
+import json
+import time
+from channels.testing import HttpCommunicator
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand
+from chat.benchmarks import (
+    benchmark_environment,
+    open_socket,
+    receive_source,
+    seed_users,
+    summarize,
+)
+from chat.models import Connection, Message, User
+from chat.passwords import password_pool
+from chat.routing import CONSUMERS
+
+
+class Command(BaseCommand):
+    help = (
+        "Sign in through core.asgi.application while sockets of the same "
+        "process round trip message.list: logins per second, how many were "
+        "refused as overloaded, and the socket latency before and during."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--logins", type=int, default=40)
+        parser.add_argument("--concurrency", type=int, default=20)
+        parser.add_argument("--sockets", type=int, default=20)
+        parser.add_argument("--seconds", type=float, default=2.0, help="idle phase")
+
+    def handle(self, *args, **options):
+        # imported late: building the application loads the routing
+        from core.asgi import application
+
+        with benchmark_environment():
+            users = self.seed(max(options["logins"], options["sockets"]))
+            results = asyncio.run(self.run(application, users, options))
+        results["workers"] = password_pool.workers
+        results["limit"] = password_pool.limit
+        self.stdout.write(json.dumps(results, indent=2))
+
+    def seed(self, count):
+        friend, *users = seed_users(count + 1)
+        # one hash shared by everyone, it is the checking that is measured
+        User.objects.update(password=make_password("bench-password"))
+        connections = Connection.objects.bulk_create(
+            [Connection(sender=user, receiver=friend, approved=True) for user in users]
+        )
+        Message.objects.bulk_create(
+            Message(connection=connection, sender=connection.sender, text="hi")
+            for connection in connections
+        )
+        for user, connection in zip(users, connections):
+            user.bench_connection_id = connection.id
+        return users
+
+    async def run(self, application, users, options):
+        consumer = CONSUMERS[getattr(settings, "CHAT_CONSUMER", "async")].as_asgi()
+        sockets = [
+            (await open_socket(consumer, user), user)
+            for user in users[: options["sockets"]]
+        ]
+        phase = {"name": "idle"}
+        samples = {"idle": [], "logins": []}
+        stop = asyncio.Event()
+
+        async def client(communicator, user):
+            frame = {"source": "message.list", "connectionId": user.bench_connection_id}
+            while not stop.is_set():
+                name = phase["name"]
+                start = time.perf_counter()
+                await communicator.send_json_to(frame)
+                await receive_source(communicator, "message.list")
+                samples[name].append(time.perf_counter() - start)
+
+        clients = [
+            asyncio.create_task(client(communicator, user))
+            for communicator, user in sockets
+        ]
+        await asyncio.sleep(options["seconds"])
+
+        phase["name"] = "logins"
+        host = next(
+            (host for host in settings.ALLOWED_HOSTS if host != "*"), "localhost"
+        )
+        semaphore = asyncio.Semaphore(options["concurrency"])
+        statuses, latencies = [], []
+
+        async def login(user):
+            body = json.dumps({"username": user.username, "password": "bench-password"})
+            async with semaphore:
+                start = time.perf_counter()
+                response = await HttpCommunicator(
+                    application,
+                    "POST",
+                    "/chat/signin/",
+                    body=body.encode(),
+                    headers=[
+                        (b"host", host.encode()),
+                        (b"content-type", b"application/json"),
+                    ],
+                ).get_response(timeout=120)
+                latencies.append(time.perf_counter() - start)
+                statuses.append(response["status"])
+
+        start = time.perf_counter()
+        await asyncio.gather(*(login(user) for user in users[: options["logins"]]))
+        elapsed = time.perf_counter() - start
+        stop.set()
+        await asyncio.gather(*clients)
+        for communicator, _ in sockets:
+            await communicator.disconnect()
+
+        signed_in = statuses.count(200)
+        return {
+            "logins": {
+                "signed_in": signed_in,
+                "overloaded": statuses.count(503),
+                "other": len(statuses) - signed_in - statuses.count(503),
+                "per_second": round(signed_in / elapsed, 1),
+                "latency_ms": summarize(latencies),
+            },
+            "message_list_latency_ms": {
+                name: summarize(values) for name, values in samples.items()
+            },
+        }
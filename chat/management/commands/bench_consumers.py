@@ -0,0 +1,103 @@
+import asyncio
+import json
+import time
+from django.core.management.base import BaseCommand
+from chat.benchmarks import (
+    ThreadSampler,
+    benchmark_environment,
+    open_socket,
+    receive_source,
+    seed_users,
+    summarize,
+)
+from chat.models import Connection, Message
+from chat.routing import CONSUMERS
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare the sync and async chat consumers: how many sockets one "
+        "process opens and the message.list round trip latency under load."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--connections", type=int, default=200)
+        parser.add_argument("--rounds", type=int, default=5)
+        parser.add_argument("--messages", type=int, default=24)
+        parser.add_argument(
+            "--consumer", choices=sorted(CONSUMERS), action="append", default=None
+        )
+
+    def handle(self, *args, **options):
+        results = {}
+        with benchmark_environment():
+            users = self.seed(options["connections"], options["messages"])
+            for kind in options["consumer"] or sorted(CONSUMERS):
+                results[kind] = asyncio.run(
+                    self.run(CONSUMERS[kind].as_asgi(), users, options["rounds"])
+                )
+        self.stdout.write(json.dumps(results, indent=2))
+
+    def seed(self, count, messages):
+        friend, *users = seed_users(count + 1)
+        connections = Connection.objects.bulk_create(
+            [Connection(sender=user, receiver=friend, approved=True) for user in users]
+        )
+        Message.objects.bulk_create(
+            [
+                Message(connection=connection, sender=connection.sender, text=f"hi {i}")
+                for connection in connections
+                for i in range(messages)
+            ],
+            batch_size=1000,
+        )
+        for user, connection in zip(users, connections):
+            user.bench_connection_id = connection.id
+        return users
+
+    async def run(self, application, users, rounds):
+        threads = ThreadSampler()
+
+        async def connect(user):
+            start = time.perf_counter()
+            communicator = await open_socket(application, user)
+            threads.sample()
+            return communicator, time.perf_counter() - start
+
+        start = time.perf_counter()
+        opened = await asyncio.gather(*(connect(user) for user in users))
+        connect_elapsed = time.perf_counter() - start
+        sockets = [communicator for communicator, _ in opened]
+
+        async def client(communicator, user):
+            samples = []
+            for _ in range(rounds):
+                start = time.perf_counter()
+                await communicator.send_json_to(
+                    {
+                        "source": "message.list",
+                        "connectionId": user.bench_connection_id,
+                        "page": 0,
+                    }
+                )
+                await receive_source(communicator, "message.list")
+                samples.append(time.perf_counter() - start)
+                threads.sample()
+            return samples
+
+        start = time.perf_counter()
+        per_client = await asyncio.gather(
+            *(client(communicator, user) for communicator, user in zip(sockets, users))
+        )
+        elapsed = time.perf_counter() - start
+        await asyncio.gather(*(communicator.disconnect() for communicator in sockets))
+
+        latencies = [sample for samples in per_client for sample in samples]
+        return {
+            "connections": len(sockets),
+            "connections_per_second": round(len(sockets) / connect_elapsed, 1),
+            "connect_latency_ms": summarize([latency for _, latency in opened]),
+            "requests_per_second": round(len(latencies) / elapsed, 1),
+            "message_list_latency_ms": summarize(latencies),
+            "peak_threads": threads.peak,
+        }
@@ -0,0 +1,111 @@
+import json
+import random
+import time
+from django.core.management.base import BaseCommand
+from chat.benchmarks import benchmark_environment, seed_users, summarize
+from chat.graph import social_graph
+from chat.management.commands.bench_search import random_name
+from chat.message_search import query_terms, scan_search, search_messages
+from chat.models import Connection, Message
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark message.search on a large message fixture: the full-text "
+        "index of the database engine against scanning with icontains."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--messages", type=int, default=2_000_000)
+        parser.add_argument("--users", type=int, default=2000)
+        parser.add_argument("--friends", type=int, default=50, help="of the searcher")
+        parser.add_argument("--words", type=int, default=5000, help="vocabulary")
+        parser.add_argument("--repeat", type=int, default=10)
+        parser.add_argument("--batch-size", type=int, default=10_000)
+        parser.add_argument("--seed", type=int, default=0)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options["seed"])
+        with benchmark_environment():
+            start = time.perf_counter()
+            searcher, vocabulary = self.seed(rng, options)
+            seeded = time.perf_counter() - start
+            # frequent, average and rare words, then a prefix and two words
+            common, middle, rare = (
+                vocabulary[0],
+                vocabulary[len(vocabulary) // 10],
+                vocabulary[-1],
+            )
+            queries = [common, middle, rare, middle[:3], f"{common} {middle}"]
+            results = {
+                "messages": options["messages"],
+                "seed_seconds": round(seeded, 1),
+                "queries": {
+                    query: {
+                        "results": len(search_messages(searcher.id, query)[0]),
+                        "scan_ms": summarize(
+                            self.time(
+                                lambda: self.scan(searcher, query), options["repeat"]
+                            )
+                        ),
+                        "indexed_ms": summarize(
+                            self.time(
+                                lambda: search_messages(searcher.id, query),
+                                options["repeat"],
+                            )
+                        ),
+                    }
+                    for query in queries
+                },
+            }
+        self.stdout.write(json.dumps(results, indent=2))
+
+    def seed(self, rng, options):
+        """
+        Users connected at random, the searcher to `friends` of them, and
+        messages of eight words drawn with a Zipf-like frequency.
+        """
+        searcher, *users = seed_users(options["users"] + 1)
+        pairs = {(searcher.id, user.id) for user in users[: options["friends"]]}
+        while len(pairs) < options["users"] * 2:
+            sender, receiver = rng.sample(users, 2)
+            pairs.add((sender.id, receiver.id))
+        connections = Connection.objects.bulk_create(
+            Connection(sender_id=sender, receiver_id=receiver, approved=True)
+            for sender, receiver in pairs
+        )
+        vocabulary = sorted({random_name(rng) for _ in range(options["words"])})
+        rng.shuffle(vocabulary)
+        weights = [1 / rank for rank in range(1, len(vocabulary) + 1)]
+        batch_size = options["batch_size"]
+        for offset in range(0, options["messages"], batch_size):
+            count = min(batch_size, options["messages"] - offset)
+            Message.objects.bulk_create(
+                Message(
+                    connection_id=connection.id,
+                    sender_id=connection.sender_id,
+                    text=" ".join(rng.choices(vocabulary, weights, k=8)),
+                )
+                for connection in rng.choices(connections, k=count)
+            )
+        social_graph.clear()
+        return searcher, vocabulary
+
+    def time(self, search, repeat):
+        samples = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            search()
+            samples.append(time.perf_counter() - start)
+        return samples
+
+    def scan(self, user, query):
+        # the same page without an index
+        messages = Message.objects.filter(
+            connection_id__in=social_graph.get(user.id).friend_connections()
+        )
+        return list(
+            scan_search(query_terms(query), messages)
+            .order_by("-id")
+            .values("id", "snippet")[:21]
+        )
@@ -0,0 +1,101 @@
+import asyncio
+import json
+import time
+from django.core.management.base import BaseCommand
+from chat.benchmarks import (
+    benchmark_environment,
+    open_socket,
+    receive_source,
+    seed_users,
+    summarize,
+)
+from chat.consumers import AsyncChatConsumer
+from chat.conversations import open_conversations
+from chat.models import Connection
+from chat.writer import message_writer
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure message.send throughput of the async consumer at several "
+        "group commit windows, against writing each message on its own."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--connections", type=int, default=100)
+        parser.add_argument("--messages", type=int, default=20)
+        parser.add_argument(
+            "--window",
+            type=float,
+            action="append",
+            default=None,
+            help="batch window in milliseconds, repeatable",
+        )
+        parser.add_argument("--batch-size", type=int, default=100)
+
+    def handle(self, *args, **options):
+        windows = options["window"] or [0, 1, 2, 5, 10]
+        # a batch of one is a transaction per message
+        runs = [("unbatched", 0, 1)] + [
+            (f"{window:g}ms", window / 1000, options["batch_size"])
+            for window in windows
+        ]
+        results = {}
+        saved = message_writer.window, message_writer.max_batch
+        with benchmark_environment():
+            users = self.seed(options["connections"])
+            try:
+                for name, window, max_batch in runs:
+                    message_writer.window = window
+                    message_writer.max_batch = max_batch
+                    results[name] = asyncio.run(self.run(users, options["messages"]))
+            finally:
+                message_writer.window, message_writer.max_batch = saved
+        self.stdout.write(json.dumps(results, indent=2))
+
+    def seed(self, count):
+        friend, *users = seed_users(count + 1)
+        connections = Connection.objects.bulk_create(
+            [Connection(sender=user, receiver=friend, approved=True) for user in users]
+        )
+        for user, connection in zip(users, connections):
+            connection.sender, connection.receiver = user, friend
+            open_conversations(connection)
+            user.bench_connection_id = connection.id
+        return users
+
+    async def run(self, users, messages):
+        application = AsyncChatConsumer.as_asgi()
+        sockets = await asyncio.gather(*(open_socket(application, u) for u in users))
+        batches = message_writer.batches
+
+        async def client(communicator, user):
+            samples = []
+            for i in range(messages):
+                start = time.perf_counter()
+                await communicator.send_json_to(
+                    {
+                        "source": "message.send",
+                        "connectionId": user.bench_connection_id,
+                        "messageText": f"message {i}",
+                    }
+                )
+                await receive_source(communicator, "message.send")
+                samples.append(time.perf_counter() - start)
+            return samples
+
+        start = time.perf_counter()
+        per_client = await asyncio.gather(
+            *(client(communicator, user) for communicator, user in zip(sockets, users))
+        )
+        elapsed = time.perf_counter() - start
+        await asyncio.gather(*(communicator.disconnect() for communicator in sockets))
+
+        latencies = [sample for samples in per_client for sample in samples]
+        batches = message_writer.batches - batches
+        return {
+            "messages": len(latencies),
+            "messages_per_second": round(len(latencies) / elapsed, 1),
+            "average_batch": round(len(latencies) / batches, 1),
+            "send_latency_ms": summarize(latencies),
+        }
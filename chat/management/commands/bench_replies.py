@@ -0,0 +1,115 @@
+import asyncio
+import json
+import time
+from django.core.management.base import BaseCommand
+from chat import metrics
+from chat.benchmarks import (
+    benchmark_environment,
+    open_socket,
+    receive_source,
+    seed_search_tokens,
+    seed_users,
+    summarize,
+)
+from chat.conversations import open_conversations
+from chat.models import Connection, Message
+from chat.routing import CONSUMERS
+
+
+def observations(histogram, *label_values):
+    entry = histogram.values.get(label_values)
+    return sum(entry[:-1]) if entry else 0
+
+
+class Command(BaseCommand):
+    help = (
+        "Count the channel layer sends behind each source: replies are written "
+        "to the requesting socket, only fan-out goes through the layer (a "
+        "publish to Redis and a receive back in production). Before, every "
+        "frame a socket got was one group_send."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--friends", type=int, default=20)
+        parser.add_argument("--messages", type=int, default=50)
+        parser.add_argument("--rounds", type=int, default=200)
+        parser.add_argument(
+            "--consumer", choices=sorted(CONSUMERS), action="append", default=None
+        )
+
+    def handle(self, *args, **options):
+        results = {}
+        with benchmark_environment():
+            user, friend = self.seed(options["friends"], options["messages"])
+            for kind in options["consumer"] or sorted(CONSUMERS):
+                results[kind] = asyncio.run(
+                    self.run(CONSUMERS[kind].as_asgi(), user, friend, options["rounds"])
+                )
+        self.stdout.write(json.dumps(results, indent=2))
+
+    def seed(self, friends, messages):
+        """A user with `friends` friends, as many pending requests, messages."""
+        user, *others = seed_users(2 * friends + 1)
+        seed_search_tokens(others)
+        connections = Connection.objects.bulk_create(
+            [
+                Connection(sender=user, receiver=other, approved=True)
+                for other in others[:friends]
+            ]
+            + [Connection(sender=other, receiver=user) for other in others[friends:]]
+        )
+        for connection in connections[:friends]:
+            open_conversations(connection)
+        Message.objects.bulk_create(
+            (
+                Message(connection=connection, sender=user, text=f"hi {i}")
+                for connection in connections[:friends]
+                for i in range(messages)
+            ),
+            batch_size=1000,
+        )
+        user.bench_connection_id = connections[0].id
+        return user, others[0]
+
+    async def run(self, application, user, friend, rounds):
+        frames = {
+            "search": {"query": "bench"},
+            "message.list": {"connectionId": user.bench_connection_id},
+            "friend.list": {},
+            "request.list": {},
+            "presence.list": {},
+            "session.init": {},
+            "sync": {"since": {"message_id": 0, "time": "2000-01-01T00:00:00Z"}},
+            # fanned out to both ends, whose sockets are both open
+            "message.send": {
+                "connectionId": user.bench_connection_id,
+                "messageText": "hello",
+            },
+        }
+        communicator = await open_socket(application, user)
+        other = await open_socket(application, friend)
+        results = {}
+        for source, frame in frames.items():
+            group_sends = observations(metrics.group_send_seconds, source)
+            sent = metrics.frames_sent.values.get((source,), 0)
+            samples = []
+            for _ in range(rounds):
+                start = time.perf_counter()
+                await communicator.send_json_to({"source": source, **frame})
+                await receive_source(communicator, source)
+                samples.append(time.perf_counter() - start)
+                if source == "message.send":
+                    await receive_source(other, source)
+            group_sends = observations(metrics.group_send_seconds, source) - group_sends
+            sent = metrics.frames_sent.values.get((source,), 0) - sent
+            results[source] = {
+                "frames_per_request": round(sent / rounds, 2),
+                "group_sends_per_request": round(group_sends / rounds, 2),
+                "group_sends_saved_per_request": round(
+                    (sent - group_sends) / rounds, 2
+                ),
+                "latency_ms": summarize(samples),
+            }
+        await communicator.disconnect()
+        await other.disconnect()
+        return results
@@ -0,0 +1,107 @@
+import json
+import random
+import time
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+from chat.benchmarks import benchmark_environment, summarize
+from chat.graph import social_graph
+from chat.models import User, UserSearchToken
+from chat.search import search_queryset, search_user_ids, user_tokens, with_status
+
+
+SYLLABLES = ["an", "bel", "cor", "da", "el", "fin", "gra", "ho", "is", "jo", "ka"]
+SYLLABLES += ["li", "mar", "no", "ol", "pe", "qui", "ro", "sa", "tor", "u", "vi"]
+
+
+def random_name(rng):
+    return "".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4)))
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark the search source on a large user fixture: the old "
+        "istartswith query against the indexed token search."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=1_000_000)
+        parser.add_argument("--repeat", type=int, default=20)
+        parser.add_argument("--batch-size", type=int, default=10_000)
+        parser.add_argument("--seed", type=int, default=0)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options["seed"])
+        with benchmark_environment():
+            start = time.perf_counter()
+            self.seed(rng, options["users"], options["batch_size"])
+            seeded = time.perf_counter() - start
+            searcher = User.objects.order_by("id").first()
+            queries = ["a", "ma", "mar", "mari", "jo ro"]
+            results = {
+                "users": options["users"],
+                "seed_seconds": round(seeded, 1),
+                "queries": {
+                    query: {
+                        "istartswith_ms": summarize(
+                            self.time(
+                                lambda: self.old_search(searcher, query),
+                                options["repeat"],
+                            )
+                        ),
+                        "indexed_ms": summarize(
+                            self.time(
+                                lambda: self.new_search(searcher, query),
+                                options["repeat"],
+                            )
+                        ),
+                    }
+                    for query in queries
+                },
+            }
+        self.stdout.write(json.dumps(results, indent=2))
+
+    def seed(self, rng, count, batch_size):
+        for offset in range(0, count, batch_size):
+            users = User.objects.bulk_create(
+                User(
+                    username=f"{random_name(rng)}{i}",
+                    first_name=random_name(rng),
+                    last_name=random_name(rng),
+                    password="!",
+                )
+                for i in range(offset, min(offset + batch_size, count))
+            )
+            UserSearchToken.objects.bulk_create(
+                (
+                    UserSearchToken(user_id=user.id, token=token, weight=weight)
+                    for user in users
+                    for token, weight in user_tokens(
+                        user.username, user.first_name, user.last_name
+                    )
+                ),
+                batch_size=batch_size,
+            )
+
+    def time(self, search, repeat):
+        samples = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            search()
+            samples.append(time.perf_counter() - start)
+        return samples
+
+    def old_search(self, user, query):
+        # what receive_search ran before the token index, minus the statuses
+        return list(
+            User.objects.filter(
+                Q(first_name__istartswith=query)
+                | Q(last_name__istartswith=query)
+                | Q(username__istartswith=query)
+            )
+            .exclude(username=user.username)
+            .values_list("id", flat=True)
+        )
+
+    def new_search(self, user, query):
+        ids = search_user_ids(query, user.id)
+        return with_status(search_queryset(ids), ids, social_graph.get(user.id))
@@ -0,0 +1,85 @@
+import json
+import timeit
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from chat import encoders
+from chat.benchmarks import benchmark_environment, seed_users
+from chat.conversations import open_conversations
+from chat.fast_serializers import (
+    FRIEND_VALUES,
+    MESSAGE_VALUES,
+    friend_list_data,
+    messages_data,
+)
+from chat.models import Connection, Conversation, Message
+from chat.serializers import FriendSerializer, MessageSerializer
+
+
+class Command(BaseCommand):
+    help = (
+        "Micro-benchmark building message.list and friend.list frames with "
+        "the DRF serializers and with chat.fast_serializers."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--friends", type=int, default=50)
+        parser.add_argument("--page-size", type=int, default=12)
+        parser.add_argument("--number", type=int, default=200)
+
+    def handle(self, *args, **options):
+        with benchmark_environment():
+            user, *friends = seed_users(options["friends"] + 1)
+            for friend in friends:
+                open_conversations(
+                    Connection.objects.create(
+                        sender=user, receiver=friend, approved=True
+                    )
+                )
+            connection = Connection.objects.select_related("sender", "receiver")[0]
+            Message.objects.bulk_create(
+                Message(connection=connection, sender=user, text=f"message {i}")
+                for i in range(options["page_size"])
+            )
+            messages = Message.objects.filter(connection=connection).order_by("-id")
+            conversations = Conversation.objects.filter(user=user)
+            # rows are fetched once, only building and encoding frames is timed
+            message_instances = list(
+                messages.select_related(
+                    "sender", "connection__sender", "connection__receiver"
+                )
+            )
+            message_rows = list(messages.values(*MESSAGE_VALUES))
+            friend_instances = list(conversations.select_related("friend"))
+            friend_rows = list(conversations.values(*FRIEND_VALUES))
+            cases = {
+                "message.list": (
+                    lambda: MessageSerializer(message_instances, many=True).data,
+                    lambda: messages_data(message_rows, connection),
+                ),
+                "friend.list": (
+                    lambda: FriendSerializer(friend_instances, many=True).data,
+                    lambda: friend_list_data(friend_rows),
+                ),
+            }
+            results = {
+                source: self.compare(drf, fast, options["number"])
+                for source, (drf, fast) in cases.items()
+            }
+        results["encoder"] = settings.CHAT_JSON_ENCODER
+        self.stdout.write(json.dumps(results, indent=2))
+
+    def compare(self, drf, fast, number):
+        drf_data, fast_data = drf(), fast()
+        paths = {
+            "drf+json": lambda: json.dumps(drf()),
+            "fast+json": lambda: json.dumps(fast()),
+            "fast+encoder": lambda: encoders.dumps(fast()),
+        }
+        result = {"identical": json.dumps(drf_data) == json.dumps(fast_data)}
+        for name, path in paths.items():
+            seconds = min(timeit.repeat(path, number=number, repeat=3)) / number
+            result[name] = {
+                "us_per_frame": round(seconds * 1e6, 1),
+                "frames_per_second": round(1 / seconds),
+            }
+        return result
@@ -0,0 +1,110 @@
+import json
+import timeit
+from django.core.management.base import BaseCommand
+from chat.benchmarks import benchmark_environment, seed_users
+from chat.consumers import message_list_data
+from chat.conversations import open_conversations, send_message
+from chat.fast_serializers import (
+    FRIEND_VALUES,
+    MESSAGE_VALUES,
+    REQUEST_VALUES,
+    friend_list_data,
+    message_data,
+    request_list_data,
+    search_data,
+)
+from chat.graph import social_graph
+from chat.models import Connection, Conversation, Message
+from chat.search import index_user, search_queryset, search_user_ids, with_status
+from chat.wire import WIRES
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare the JSON and MessagePack wire formats: bytes per frame and "
+        "encode/decode time of each source."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--friends", type=int, default=30)
+        parser.add_argument("--page-size", type=int, default=12)
+        parser.add_argument("--number", type=int, default=500)
+
+    def handle(self, *args, **options):
+        with benchmark_environment():
+            frames = self.frames(options["friends"], options["page_size"])
+        results = {
+            source: self.compare(frame, options["number"])
+            for source, frame in frames.items()
+        }
+        self.stdout.write(json.dumps(results, indent=2))
+
+    def frames(self, friends, page_size):
+        """One frame of each source, as broadcast_group sends it."""
+        user, *friends = seed_users(friends + 1)
+        for friend in friends:
+            index_user(friend)
+        connections = [
+            Connection.objects.create(sender=user, receiver=friend, approved=True)
+            for friend in friends[: len(friends) // 2]
+        ]
+        for connection in connections:
+            open_conversations(connection)
+        for friend in friends[len(friends) // 2 :]:
+            Connection.objects.create(sender=friend, receiver=user)
+        connection = Connection.objects.select_related("sender", "receiver").get(
+            pk=connections[0].pk
+        )
+        for i in range(page_size):
+            message = send_message(connection, user, f"message number {i}")
+        rows = Message.objects.filter(connection=connection).order_by("-id")
+        ids = search_user_ids("bench", user.id)
+        data = {
+            "message.list": message_list_data(
+                list(rows.values(*MESSAGE_VALUES)[: page_size + 1]),
+                {},
+                page_size,
+                connection,
+            ),
+            "message.send": message_data(message, connection),
+            "friend.list": friend_list_data(
+                Conversation.objects.filter(user=user).values(*FRIEND_VALUES)
+            ),
+            "request.list": request_list_data(
+                Connection.objects.filter(receiver=user, approved=False).values(
+                    *REQUEST_VALUES
+                )
+            ),
+            "search": search_data(
+                with_status(search_queryset(ids), ids, social_graph.get(user.id))
+            ),
+            "message.type": {"username": user.username},
+        }
+        return {
+            source: {"type": "broadcast_group", "source": source, "data": value}
+            for source, value in data.items()
+        }
+
+    def compare(self, frame, number):
+        result = {}
+        for name, wire in WIRES.items():
+            sent = wire.frame(frame)
+            text_data, bytes_data = sent.get("text_data"), sent.get("bytes_data")
+            size = len(bytes_data if text_data is None else text_data.encode())
+            encode = min(
+                timeit.repeat(lambda: wire.frame(frame), number=number, repeat=3)
+            )
+            decode = min(
+                timeit.repeat(
+                    lambda: wire.loads(text_data, bytes_data), number=number, repeat=3
+                )
+            )
+            result[name] = {
+                "bytes": size,
+                "encode_us": round(encode / number * 1e6, 2),
+                "decode_us": round(decode / number * 1e6, 2),
+            }
+        result["msgpack_size_ratio"] = round(
+            result["msgpack"]["bytes"] / result["json"]["bytes"], 3
+        )
+        return result
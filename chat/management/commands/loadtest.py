@@ -0,0 +1,247 @@
+import asyncio
+import json
+import platform
+import random
+import subprocess
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from chat.benchmarks import (
+    benchmark_environment,
+    open_asgi_socket,
+    receive_source,
+    seed_search_tokens,
+    seed_users,
+    summarize,
+)
+from chat.conversations import open_conversations
+from chat.models import Connection, Message
+
+SOURCES = ("message.send", "message.list", "friend.list", "search")
+
+
+def parse_mix(value):
+    """Weights of a --mix value such as message.send=4,search=1."""
+    mix = {}
+    for part in value.split(","):
+        source, _, weight = part.partition("=")
+        if source not in SOURCES:
+            raise ValueError(f"unknown source {source!r}")
+        mix[source] = float(weight or 1)
+    return mix
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Command(BaseCommand):
+    help = (
+        "Drive simulated clients through the websocket protocol of "
+        "core.asgi.application in-process and report throughput and latency "
+        "per source as JSON. Runs are seeded, so two commits can be compared "
+        "with the same workload."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--clients", type=int, default=50)
+        parser.add_argument("--friends", type=int, default=5, help="per client")
+        parser.add_argument(
+            "--messages", type=int, default=20, help="seeded per connection"
+        )
+        parser.add_argument(
+            "--operations", type=int, default=40, help="sent by each client"
+        )
+        parser.add_argument(
+            "--mix",
+            type=parse_mix,
+            default=parse_mix("message.send=4,message.list=3,friend.list=2,search=1"),
+            help="relative weight of each source",
+        )
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--output", help="write the report to this file")
+        parser.add_argument(
+            "--baseline", help="report to compare against, e.g. from the last commit"
+        )
+
+    def handle(self, *args, **options):
+        # imported late: building the application loads the routing
+        from core.asgi import application
+
+        with benchmark_environment():
+            clients = self.seed(
+                options["clients"], options["friends"], options["messages"]
+            )
+            results = asyncio.run(
+                self.run(
+                    application,
+                    clients,
+                    options["operations"],
+                    options["mix"],
+                    options["seed"],
+                )
+            )
+        report = {
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "consumer": getattr(settings, "CHAT_CONSUMER", "async"),
+            "encoder": getattr(settings, "CHAT_JSON_ENCODER", "json"),
+            "options": {
+                key: options[key]
+                for key in ("clients", "friends", "messages", "operations", "seed")
+            },
+            "mix": options["mix"],
+            **results,
+        }
+        if options["baseline"]:
+            with open(options["baseline"]) as file:
+                report["change"] = self.compare(json.load(file), report)
+        output = json.dumps(report, indent=2)
+        if options["output"]:
+            with open(options["output"], "w") as file:
+                file.write(output + "\n")
+        self.stdout.write(output)
+
+    def seed(self, count, friends, messages):
+        """
+        `count` users, each friends with the next `friends` users in a ring,
+        with `messages` messages in every conversation.
+        """
+        users = seed_users(count, prefix="load")
+        seed_search_tokens(users)
+        friends = min(friends, count - 1)
+        pairs = {
+            tuple(sorted((i, (i + offset) % count)))
+            for i in range(count)
+            for offset in range(1, friends + 1)
+        }
+        connections = Connection.objects.bulk_create(
+            [
+                Connection(sender=users[i], receiver=users[j], approved=True)
+                for i, j in sorted(pairs)
+            ]
+        )
+        for connection in connections:
+            open_conversations(connection)
+        Message.objects.bulk_create(
+            (
+                Message(connection=connection, sender=connection.sender, text=f"hi {i}")
+                for connection in connections
+                for i in range(messages)
+            ),
+            batch_size=1000,
+        )
+        for user in users:
+            user.load_connection_ids = []
+        by_id = {user.id: user for user in users}
+        for connection in connections:
+            by_id[connection.sender_id].load_connection_ids.append(connection.id)
+            by_id[connection.receiver_id].load_connection_ids.append(connection.id)
+        return users
+
+    async def run(self, application, clients, operations, mix, seed):
+        start = time.perf_counter()
+        sockets = await asyncio.gather(
+            *(open_asgi_socket(application, user) for user in clients)
+        )
+        connect_elapsed = time.perf_counter() - start
+        sources, weights = zip(*mix.items())
+        samples = {source: [] for source in sources}
+
+        async def client(index, communicator, user):
+            # the same seed always sends the same frames
+            rng = random.Random(seed * 100003 + index)
+            for n in range(operations):
+                source = rng.choices(sources, weights)[0]
+                frame, match = self.frame(rng, source, user, n)
+                start = time.perf_counter()
+                await communicator.send_json_to(frame)
+                while not match(await receive_source(communicator, source)):
+                    pass
+                samples[source].append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        await asyncio.gather(
+            *(
+                client(index, communicator, user)
+                for index, (communicator, user) in enumerate(zip(sockets, clients))
+            )
+        )
+        elapsed = time.perf_counter() - start
+        await asyncio.gather(*(communicator.disconnect() for communicator in sockets))
+
+        total = sum(len(latencies) for latencies in samples.values())
+        return {
+            "connect": {
+                "per_second": round(len(sockets) / connect_elapsed, 1),
+            },
+            "total": {
+                "operations": total,
+                "per_second": round(total / elapsed, 1),
+                "seconds": round(elapsed, 3),
+            },
+            "sources": {
+                source: {
+                    "per_second": round(len(latencies) / elapsed, 1),
+                    "latency_ms": summarize(latencies),
+                }
+                for source, latencies in samples.items()
+            },
+        }
+
+    def frame(self, rng, source, user, n):
+        """(frame to send, test that a reply of `source` answers it)."""
+        if source == "message.send":
+            text = f"{user.username} says {n}"
+            frame = {
+                "source": source,
+                "connectionId": rng.choice(user.load_connection_ids),
+                "messageText": text,
+            }
+            # friends' messages arrive on the same socket
+            return frame, lambda reply: reply["data"]["text"] == text
+        if source == "message.list":
+            frame = {
+                "source": source,
+                "connectionId": rng.choice(user.load_connection_ids),
+            }
+        elif source == "search":
+            frame = {"source": source, "query": f"load{rng.randrange(100)}"}
+        else:
+            frame = {"source": source}
+        return frame, lambda reply: True
+
+    def compare(self, baseline, report):
+        """Ratio of each figure to the baseline's: above 1 is more."""
+
+        def ratio(new, old):
+            return round(new / old, 3) if new is not None and old else None
+
+        change = {
+            "per_second": ratio(
+                report["total"]["per_second"], baseline["total"]["per_second"]
+            ),
+            "sources": {},
+        }
+        for source, figures in report["sources"].items():
+            old = baseline["sources"].get(source)
+            if old is None:
+                continue
+            change["sources"][source] = {
+                "per_second": ratio(figures["per_second"], old["per_second"]),
+                **{
+                    f"latency_{key}": ratio(
+                        figures["latency_ms"][key], old["latency_ms"][key]
+                    )
+                    for key in ("p50", "p95", "p99")
+                },
+            }
+        return change
@@ -0,0 +1,170 @@
+"""
+Full-text search over message history for the `message.search` source.
+
+    {"source": "message.search", "query": "dinner fri", "before_id": 1234}
+
+returns the newest messages of the caller's friends' connections holding
+every word of the query, the last word as a prefix:
+
+    {"query": "dinner fri",
+     "results": [{"id", "connection", "sender", "created", "snippet"}],
+     "next": {"before_id": 987} or null}
+
+Pages go back in time: a client asks for the next one by sending `next`
+along with the same query. Snippets are HTML escaped, with the matching
+words in <mark>.
+
+The index depends on the database engine, see migration 0009:
+
+- SQLite: chat_message_fts, an FTS5 table over the text of chat_message.
+  Triggers keep it in sync, so messages stored with bulk_create by the
+  message writer are indexed as well.
+- PostgreSQL: a GIN index over to_tsvector('simple', text), which the
+  search expression matches.
+
+Other engines fall back to scanning with icontains.
+"""
+
+import html
+import re
+from django.conf import settings
+from django.db import connection
+from django.db.models import F
+from .fast_serializers import iso_datetime, user_data
+from .graph import social_graph
+from .models import Message, User
+
+MESSAGE_SEARCH_PAGE_SIZE = getattr(settings, "CHAT_MESSAGE_SEARCH_PAGE_SIZE", 20)
+MAX_MESSAGE_SEARCH_PAGE_SIZE = 50
+# words of a query past this many are ignored
+MAX_TERMS = 8
+# around matches in snippets, replaced by <mark> once the text is escaped
+START, STOP = "\ue000", "\ue001"
+
+word = re.compile(r"\w+")
+
+
+def query_terms(query):
+    return word.findall((query or "").casefold())[:MAX_TERMS]
+
+
+def sqlite_search(terms, connection_ids, before_id, limit):
+    # quoted, so that no word is read as an FTS5 operator
+    match = " ".join(f'"{term}"' for term in terms) + "*"
+    placeholders = ", ".join(["%s"] * len(connection_ids))
+    before = "AND m.id < %s" if before_id is not None else ""
+    messages = Message.objects.raw(
+        f"""
+        SELECT m.id, m.connection_id, m.sender_id, m.created,
+            snippet(chat_message_fts, 0, %s, %s, '…', 16) AS snippet
+        FROM chat_message_fts JOIN chat_message m ON m.id = chat_message_fts.rowid
+        WHERE chat_message_fts MATCH %s AND m.connection_id IN ({placeholders})
+        {before}
+        ORDER BY chat_message_fts.rowid DESC
+        LIMIT %s
+        """,
+        [START, STOP, match, *connection_ids]
+        + ([before_id] if before_id is not None else [])
+        + [limit],
+    )
+    return [
+        {
+            "id": message.id,
+            "connection_id": message.connection_id,
+            "sender_id": message.sender_id,
+            "created": message.created,
+            "snippet": message.snippet,
+        }
+        for message in messages
+    ]
+
+
+def postgresql_search(terms, messages):
+    from django.contrib.postgres.search import (
+        SearchHeadline,
+        SearchQuery,
+        SearchVector,
+    )
+
+    query = SearchQuery(" & ".join(terms) + ":*", config="simple", search_type="raw")
+    return messages.annotate(
+        document=SearchVector("text", config="simple"),
+        snippet=SearchHeadline(
+            "text",
+            query,
+            config="simple",
+            start_sel=START,
+            stop_sel=STOP,
+            max_fragments=1,
+        ),
+    ).filter(document=query)
+
+
+def scan_search(terms, messages):
+    for term in terms:
+        messages = messages.filter(text__icontains=term)
+    return messages.annotate(snippet=F("text"))
+
+
+def search_messages(user_id, query, before_id=None, page_size=None):
+    """
+    (rows, next before_id or None) of the `message.search` page of
+    `user_id`, newest first.
+    """
+    page_size = min(
+        max(page_size or MESSAGE_SEARCH_PAGE_SIZE, 1), MAX_MESSAGE_SEARCH_PAGE_SIZE
+    )
+    terms = query_terms(query)
+    connection_ids = social_graph.get(user_id).friend_connections()
+    if not terms or not connection_ids:
+        return [], None
+    if connection.vendor == "sqlite":
+        rows = sqlite_search(terms, connection_ids, before_id, page_size + 1)
+    else:
+        messages = Message.objects.filter(connection_id__in=connection_ids)
+        if before_id is not None:
+            messages = messages.filter(id__lt=before_id)
+        if connection.vendor == "postgresql":
+            messages = postgresql_search(terms, messages)
+        else:
+            messages = scan_search(terms, messages)
+        rows = list(
+            messages.order_by("-id").values(
+                "id", "connection_id", "sender_id", "created", "snippet"
+            )[: page_size + 1]
+        )
+    if len(rows) > page_size:
+        return rows[:page_size], rows[page_size - 1]["id"]
+    return rows, None
+
+
+def highlight(snippet):
+    escaped = html.escape(snippet)
+    return escaped.replace(START, "<mark>").replace(STOP, "</mark>")
+
+
+def message_search_data(user_id, data):
+    """The `message.search` payload answering the frame `data`."""
+    query = data.get("query") or ""
+    before_id = data.get("before_id")
+    if not isinstance(before_id, int) or isinstance(before_id, bool):
+        before_id = None
+    page_size = data.get("page_size")
+    if not isinstance(page_size, int) or isinstance(page_size, bool):
+        page_size = None
+    rows, next_id = search_messages(user_id, query, before_id, page_size)
+    senders = User.objects.in_bulk({row["sender_id"] for row in rows})
+    return {
+        "query": query,
+        "results": [
+            {
+                "id": row["id"],
+                "connection": row["connection_id"],
+                "sender": user_data(senders[row["sender_id"]]),
+                "created": iso_datetime(row["created"]),
+                "snippet": highlight(row["snippet"]),
+            }
+            for row in rows
+        ],
+        "next": {"before_id": next_id} if next_id is not None else None,
+    }
@@ -0,0 +1,257 @@
+"""
+Metrics of the chat consumers, in the Prometheus text format.
+
+Every received frame is timed by `handling`, which also counts the queries
+it runs: a wrapper installed on each database connection adds them to the
+frame in the current context, which sync_to_async carries into the thread
+the query runs on. Frames are labelled with their source if a consumer
+handles it and "unknown" otherwise, so clients can't create series.
+
+Values are per process; each process serves its own at /chat/metrics/.
+When CHAT_METRICS_TOKEN is set, scrapes must send it as a bearer token;
+otherwise only staff users signed in to the admin can read them.
+
+One frame in CHAT_FRAME_LOG_RATE is also logged to "chat.frames" as a
+JSON line.
+"""
+
+import contextvars
+import json
+import logging
+import random
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+LOG_RATE = getattr(settings, "CHAT_FRAME_LOG_RATE", 0.0)
+
+frame_log = logging.getLogger("chat.frames")
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        # label values -> value
+        self.values = {}
+        self.lock = threading.Lock()
+        registry.append(self)
+
+    def inc(self, *label_values, amount=1):
+        with self.lock:
+            self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def samples(self):
+        with self.lock:
+            values = sorted(self.values.items())
+        for label_values, value in values:
+            yield self.name, dict(zip(self.labels, label_values)), value
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, *label_values, amount=1):
+        self.inc(*label_values, amount=-amount)
+
+
+class Histogram(Counter):
+    kind = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = buckets
+
+    def observe(self, value, *label_values):
+        with self.lock:
+            entry = self.values.get(label_values)
+            if entry is None:
+                # observations per bucket, then +Inf, sum
+                entry = self.values[label_values] = [0] * (len(self.buckets) + 1) + [0]
+            entry[bisect_left(self.buckets, value)] += 1
+            entry[-1] += value
+
+    def samples(self):
+        with self.lock:
+            values = sorted((key, list(entry)) for key, entry in self.values.items())
+        for label_values, entry in values:
+            labels = dict(zip(self.labels, label_values))
+            count = 0
+            for bound, observed in zip(self.buckets + ("+Inf",), entry):
+                count += observed
+                yield f"{self.name}_bucket", {**labels, "le": str(bound)}, count
+            yield f"{self.name}_sum", labels, entry[-1]
+            yield f"{self.name}_count", labels, count
+
+
+registry = []
+
+open_sockets = Gauge("chat_open_sockets", "Websockets accepted and not closed.")
+frames_received = Counter(
+    "chat_frames_received_total", "Frames received from clients.", ("source",)
+)
+bytes_received = Counter(
+    "chat_received_bytes_total", "Bytes of frames received from clients.", ("source",)
+)
+frames_sent = Counter("chat_frames_sent_total", "Frames sent to clients.", ("source",))
+bytes_sent = Counter(
+    "chat_sent_bytes_total", "Bytes of frames sent to clients.", ("source",)
+)
+handler_seconds = Histogram(
+    "chat_handler_seconds", "Time spent handling a received frame.", ("source",)
+)
+handler_queries = Counter(
+    "chat_handler_queries_total", "Queries run while handling frames.", ("source",)
+)
+handler_query_seconds = Counter(
+    "chat_handler_query_seconds_total",
+    "Time spent in queries while handling frames.",
+    ("source",),
+)
+auth_seconds = Histogram(
+    "chat_auth_seconds", "Time spent authenticating websocket connects.", ("outcome",)
+)
+password_seconds = Histogram(
+    "chat_password_seconds",
+    "Time to hash or check a password, waiting for a thread included.",
+    ("operation",),
+)
+password_rejected = Counter(
+    "chat_password_rejected_total", "Sign ins and sign ups refused as overloaded."
+)
+outbound_bytes = Gauge(
+    "chat_outbound_queued_bytes", "Bytes of frames queued for sockets, not sent yet."
+)
+outbound_congested = Gauge(
+    "chat_outbound_congested_sockets",
+    "Sockets over their high watermark, dropping typing events.",
+)
+outbound_dropped = Counter(
+    "chat_outbound_dropped_total",
+    "Frames dropped instead of being sent to a socket behind.",
+    ("source",),
+)
+outbound_resyncs = Counter(
+    "chat_outbound_resyncs_total",
+    "Sockets closed with a resync frame for falling too far behind.",
+)
+outbound_delay_seconds = Histogram(
+    "chat_outbound_delay_seconds", "Time frames wait in a socket's queue to be sent."
+)
+group_send_seconds = Histogram(
+    "chat_group_send_seconds", "Time taken by channel layer group_send.", ("source",)
+)
+layer_delay_seconds = Histogram(
+    "chat_layer_delay_seconds",
+    "Time from group_send to the frame reaching a socket's queue.",
+)
+
+
+def render():
+    lines = []
+    for metric in registry:
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        for name, labels, value in metric.samples():
+            if labels:
+                pairs = ",".join(f'{key}="{value}"' for key, value in labels.items())
+                name = f"{name}{{{pairs}}}"
+            lines.append(f"{name} {value}")
+    return "\n".join(lines) + "\n"
+
+
+class Frame:
+    __slots__ = ("source", "queries", "query_seconds")
+
+    def __init__(self):
+        self.source = None
+        self.queries = 0
+        self.query_seconds = 0.0
+
+
+current_frame = contextvars.ContextVar("current_frame", default=None)
+
+
+def source_label(consumer, source):
+    if isinstance(source, str) and hasattr(
+        consumer, "receive_" + source.replace(".", "_")
+    ):
+        return source
+    return "unknown"
+
+
+@contextmanager
+def handling(consumer, text_data, bytes_data):
+    """
+    Measure the handling of a frame received by `consumer`. The body sets
+    the `source` of the yielded Frame once it is decoded.
+    """
+    frame = Frame()
+    token = current_frame.set(frame)
+    start = time.perf_counter()
+    try:
+        yield frame
+    finally:
+        elapsed = time.perf_counter() - start
+        current_frame.reset(token)
+        source = source_label(consumer, frame.source)
+        size = len(bytes_data) if bytes_data is not None else len(text_data.encode())
+        frames_received.inc(source)
+        bytes_received.inc(source, amount=size)
+        handler_seconds.observe(elapsed, source)
+        handler_queries.inc(source, amount=frame.queries)
+        handler_query_seconds.inc(source, amount=frame.query_seconds)
+        if LOG_RATE and random.random() < LOG_RATE:
+            entry = {
+                "source": source,
+                "user": getattr(consumer, "username", None),
+                "bytes": size,
+                "ms": round(elapsed * 1000, 3),
+                "queries": frame.queries,
+                "query_ms": round(frame.query_seconds * 1000, 3),
+            }
+            frame_log.info(json.dumps(entry))
+
+
+def count_sent(source, frame):
+    """Count `frame`, the keyword arguments of a consumer's send()."""
+    data = frame.get("bytes_data")
+    size = len(data) if data is not None else len(frame["text_data"].encode())
+    frames_sent.inc(source)
+    bytes_sent.inc(source, amount=size)
+
+
+async def group_send(channel_layer, group, message):
+    # wall clock, read by another process with channels-redis, see outbound.py
+    message = {**message, "sent_at": time.time()}
+    start = time.perf_counter()
+    try:
+        await channel_layer.group_send(group, message)
+    finally:
+        group_send_seconds.observe(time.perf_counter() - start, message["source"])
+
+
+def count_queries(execute, sql, params, many, context):
+    frame = current_frame.get()
+    if frame is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        frame.queries += 1
+        frame.query_seconds += time.perf_counter() - start
+
+
+@receiver(connection_created)
+def instrument_connection(sender, connection, **kwargs):
+    if count_queries not in connection.execute_wrappers:
+        connection.execute_wrappers.append(count_queries)
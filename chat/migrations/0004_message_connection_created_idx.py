@@ -0,0 +1,17 @@
+# Generated by Django 5.0.2 on 2026-10-17 15:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0003_message'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['connection', 'created', 'id'], name='message_connection_created_idx'),
+        ),
+    ]
@@ -0,0 +1,90 @@
+# Generated by Django 5.0.2 on 2026-10-17 16:04
+
+import re
+import unicodedata
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+# The tokens of chat/search.py as of this migration. Inlined so that later
+# changes to the app can't rewrite this migration.
+TOKEN_LENGTH = 150
+# username, first_name, last_name, lower weights rank first
+WEIGHTS = (0, 1, 2)
+word_separator = re.compile(r"[\W_]+")
+
+
+def normalize(text):
+    text = unicodedata.normalize("NFKD", text or "")
+    text = "".join(char for char in text if not unicodedata.combining(char))
+    return " ".join(text.casefold().split())
+
+
+def user_tokens(*names):
+    tokens = set()
+    for name, weight in zip(names, WEIGHTS):
+        value = normalize(name)
+        if not value:
+            continue
+        tokens.add((value[:TOKEN_LENGTH], weight))
+        for word in word_separator.split(value):
+            if word:
+                tokens.add((word[:TOKEN_LENGTH], weight))
+    return tokens
+
+
+def index_users(apps, schema_editor):
+    User = apps.get_model("chat", "User")
+    UserSearchToken = apps.get_model("chat", "UserSearchToken")
+    users = User.objects.values_list("id", "username", "first_name", "last_name")
+    UserSearchToken.objects.bulk_create(
+        (
+            UserSearchToken(user_id=user_id, token=token, weight=weight)
+            for user_id, *names in users.iterator()
+            for token, weight in user_tokens(*names)
+        ),
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("chat", "0005_conversation"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="UserSearchToken",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("token", models.CharField(max_length=150)),
+                ("weight", models.PositiveSmallIntegerField()),
+                (
+                    "user",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="search_tokens",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        fields=["weight", "token", "user"],
+                        name="search_token_prefix_idx",
+                    )
+                ],
+            },
+        ),
+        migrations.RunPython(index_users, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 5.0.2 on 2026-10-17 18:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("chat", "0007_presence"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="connection",
+            index=models.Index(
+                fields=["receiver", "approved", "created"],
+                name="connection_received_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="message",
+            index=models.Index(
+                fields=["connection", "id"], name="message_connection_id_idx"
+            ),
+        ),
+    ]
@@ -0,0 +1,74 @@
+# Generated by Django 5.0.2 on 2026-10-17 18:20
+
+from django.db import migrations
+
+# The full-text index message.search reads, see chat/message_search.py.
+# Inlined so that later changes to the app can't rewrite this migration.
+CREATE = {
+    "sqlite": [
+        """
+        CREATE VIRTUAL TABLE chat_message_fts USING fts5(
+            text, content='chat_message', content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2'
+        )
+        """,
+        """
+        CREATE TRIGGER chat_message_fts_insert AFTER INSERT ON chat_message BEGIN
+            INSERT INTO chat_message_fts(rowid, text) VALUES (new.id, new.text);
+        END
+        """,
+        """
+        CREATE TRIGGER chat_message_fts_delete AFTER DELETE ON chat_message BEGIN
+            INSERT INTO chat_message_fts(chat_message_fts, rowid, text)
+            VALUES ('delete', old.id, old.text);
+        END
+        """,
+        """
+        CREATE TRIGGER chat_message_fts_update AFTER UPDATE OF text ON chat_message
+        BEGIN
+            INSERT INTO chat_message_fts(chat_message_fts, rowid, text)
+            VALUES ('delete', old.id, old.text);
+            INSERT INTO chat_message_fts(rowid, text) VALUES (new.id, new.text);
+        END
+        """,
+        # index the messages stored so far
+        "INSERT INTO chat_message_fts(chat_message_fts) VALUES ('rebuild')",
+    ],
+    # the same expression as SearchVector("text", config="simple")
+    "postgresql": [
+        """
+        CREATE INDEX message_text_search_idx ON chat_message
+        USING GIN (to_tsvector('simple'::regconfig, COALESCE("text", '')))
+        """
+    ],
+}
+DROP = {
+    "sqlite": [
+        "DROP TRIGGER chat_message_fts_insert",
+        "DROP TRIGGER chat_message_fts_delete",
+        "DROP TRIGGER chat_message_fts_update",
+        "DROP TABLE chat_message_fts",
+    ],
+    "postgresql": ["DROP INDEX message_text_search_idx"],
+}
+
+
+def create_index(apps, schema_editor):
+    for statement in CREATE.get(schema_editor.connection.vendor, []):
+        schema_editor.execute(statement)
+
+
+def drop_index(apps, schema_editor):
+    for statement in DROP.get(schema_editor.connection.vendor, []):
+        schema_editor.execute(statement)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("chat", "0008_sync_indexes"),
+    ]
+
+    operations = [
+        migrations.RunPython(create_index, drop_index),
+    ]
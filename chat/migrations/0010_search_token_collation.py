@@ -0,0 +1,45 @@
+# Generated by Django 5.0.2 on 2026-10-17 19:10
+
+from django.db import migrations
+
+# search.py matches prefixes with the range [term, term + U+10FFFF), which
+# only holds when tokens sort by code point. SQLite compares text as BINARY
+# already; other engines get a binary collation on the token column.
+COLLATE = {
+    "postgresql": [
+        "ALTER TABLE chat_usersearchtoken ALTER COLUMN token TYPE varchar(150) "
+        'COLLATE "C"'
+    ],
+    "mysql": [
+        "ALTER TABLE chat_usersearchtoken MODIFY token varchar(150) "
+        "CHARACTER SET utf8mb4 COLLATE utf8mb4_bin NOT NULL"
+    ],
+}
+UNCOLLATE = {
+    "postgresql": [
+        "ALTER TABLE chat_usersearchtoken ALTER COLUMN token TYPE varchar(150) "
+        'COLLATE "default"'
+    ],
+    "mysql": ["ALTER TABLE chat_usersearchtoken MODIFY token varchar(150) NOT NULL"],
+}
+
+
+def collate(apps, schema_editor):
+    for statement in COLLATE.get(schema_editor.connection.vendor, []):
+        schema_editor.execute(statement)
+
+
+def uncollate(apps, schema_editor):
+    for statement in UNCOLLATE.get(schema_editor.connection.vendor, []):
+        schema_editor.execute(statement)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("chat", "0009_message_search"),
+    ]
+
+    operations = [
+        migrations.RunPython(collate, uncollate),
+    ]
@@ -25,6 +25,15 @@ class Connection(models.Model):
     created = models.DateTimeField(auto_now_add=True)
     updated = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            # pending requests received since a sync cursor
+            models.Index(
+                fields=["receiver", "approved", "created"],
+                name="connection_received_idx",
+            )
+        ]
+
     def __str__(self):
         return f"{self.sender.username} -> {self.receiver.username}"
 
@@ -39,5 +48,113 @@ class Message(models.Model):
     text = models.TextField()
     created = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            # keyset pagination of message.list
+            models.Index(
+                fields=["connection", "created", "id"],
+                name="message_connection_created_idx",
+            ),
+            # messages after a sync cursor
+            models.Index(fields=["connection", "id"], name="message_connection_id_idx"),
+        ]
+
     def __str__(self):
         return f"{self.sender.username} -> {self.text}"
+
+
+class Conversation(models.Model):
+    """
+    One user's side of an approved connection, as listed in friend.list.
+
+    Keeps the latest message, its preview and the unread count next to the
+    user so the friend list is a range scan on (user, last_activity)
+    instead of subqueries over Message per connection.
+    """
+
+    connection = models.ForeignKey(
+        Connection, on_delete=models.CASCADE, related_name="conversations"
+    )
+    user = models.ForeignKey(
+        User, on_delete=models.CASCADE, related_name="conversations"
+    )
+    friend = models.ForeignKey(User, on_delete=models.CASCADE, related_name="+")
+    last_message = models.ForeignKey(
+        Message, on_delete=models.SET_NULL, null=True, blank=True, related_name="+"
+    )
+    preview = models.CharField(max_length=255, blank=True)
+    last_activity = models.DateTimeField()
+    unread = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["user", "connection"], name="unique_conversation_side"
+            )
+        ]
+        indexes = [
+            models.Index(
+                fields=["user", "-last_activity"],
+                name="conversation_user_activity_idx",
+            )
+        ]
+
+    def __str__(self):
+        return f"{self.user.username} <-> {self.friend.username}"
+
+
+class UserSearchToken(models.Model):
+    """
+    Normalized word or whole value of a user's username or names, used by
+    the indexed prefix search in search.py.
+    """
+
+    # lower weights rank first
+    USERNAME = 0
+    FIRST_NAME = 1
+    LAST_NAME = 2
+
+    user = models.ForeignKey(
+        User, on_delete=models.CASCADE, related_name="search_tokens"
+    )
+    token = models.CharField(max_length=150)
+    weight = models.PositiveSmallIntegerField()
+
+    class Meta:
+        indexes = [
+            # one range scan per weight, already in rank order
+            models.Index(
+                fields=["weight", "token", "user"], name="search_token_prefix_idx"
+            )
+        ]
+
+    def __str__(self):
+        return f"{self.user.username}: {self.token}"
+
+
+class PresenceSocket(models.Model):
+    """
+    An open websocket, leased by the worker process serving it until
+    `expires`. The worker renews its leases while it is alive, see
+    presence.py.
+    """
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="sockets")
+    channel_name = models.CharField(max_length=255, unique=True)
+    worker = models.CharField(max_length=32, db_index=True)
+    expires = models.DateTimeField(db_index=True)
+
+    def __str__(self):
+        return f"{self.user.username}: {self.channel_name}"
+
+
+class OnlineUser(models.Model):
+    """A user whose friends were last told they are online."""
+
+    user = models.OneToOneField(
+        User, on_delete=models.CASCADE, primary_key=True, related_name="+"
+    )
+    since = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return self.user.username
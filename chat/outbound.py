@@ -0,0 +1,205 @@
+"""
+Outbound frames of a socket, with backpressure.
+
+broadcast_group used to await the ASGI send of every frame itself, so a
+client reading slowly held up the consumer, and the frames meant for it
+piled up in its channel layer queue until channels-redis dropped them
+without a word. Frames now go into the socket's `Outbound` and a task
+sends them in order, which leaves the consumer free to keep draining its
+channel and makes the backlog of each socket visible:
+
+- Past CHAT_OUTBOUND_HIGH_WATERMARK bytes queued the socket is congested:
+  queued typing events are dropped, stale ones first, and new ones are
+  dropped as they come until the queue is back under
+  CHAT_OUTBOUND_LOW_WATERMARK. Presence is never dropped: typing.off
+  corrects a lost typing.on, but nothing would correct a lost presence
+  change. Whenever several are queued, chat frames are sent first, then
+  presence, then typing events.
+- Past CHAT_OUTBOUND_LIMIT bytes the client is too far behind to catch up
+  frame by frame. The queue is dropped, and the socket gets a "resync"
+  frame and is closed with RESYNC_CLOSE_CODE; the client reconnects and
+  catches up with `sync`, see catchup.py.
+
+Servers that await the client when sending (uvicorn, hypercorn) fill the
+queue as soon as a client falls behind. Daphne buffers what it is sent
+instead, so there the queue only grows while frames are produced faster
+than the event loop hands them over, and the watermarks and resync
+hardly ever fire. What backs up under Daphne is the channel layer queue
+of a busy consumer: group_send stamps its messages with the time they
+were sent, and the time they took to get here is chat_layer_delay_seconds.
+A send that fails, as it does once the client is gone, closes the queue.
+"""
+
+import asyncio
+import contextvars
+import logging
+import time
+from collections import deque
+from django.conf import settings
+from .metrics import (
+    count_sent,
+    layer_delay_seconds,
+    outbound_bytes,
+    outbound_congested,
+    outbound_delay_seconds,
+    outbound_dropped,
+    outbound_resyncs,
+)
+
+HIGH_WATERMARK = getattr(settings, "CHAT_OUTBOUND_HIGH_WATERMARK", 256 * 1024)
+LOW_WATERMARK = getattr(settings, "CHAT_OUTBOUND_LOW_WATERMARK", 64 * 1024)
+LIMIT = getattr(settings, "CHAT_OUTBOUND_LIMIT", 4 * 1024 * 1024)
+# worth nothing once stale, the first to go when a socket is congested
+EPHEMERAL_SOURCES = {"typing.on", "typing.off", "message.type"}
+# never dropped, but sent after chat frames
+PRESENCE_SOURCES = {"presence"}
+# in the range left to applications by RFC 6455
+RESYNC_CLOSE_CODE = 4008
+
+logger = logging.getLogger(__name__)
+
+
+def frame_size(frame):
+    data = frame.get("bytes_data")
+    return len(data) if data is not None else len(frame["text_data"].encode())
+
+
+def asgi_message(frame):
+    """The websocket.send message of `frame`, the keyword arguments of send()."""
+    data = frame.get("bytes_data")
+    if data is not None:
+        return {"type": "websocket.send", "bytes": data}
+    return {"type": "websocket.send", "text": frame["text_data"]}
+
+
+class Outbound:
+    """Frames on their way to one socket."""
+
+    def __init__(self, send, wire, high=None, low=None, limit=None):
+        # the ASGI send of the socket
+        self.send = send
+        self.wire = wire
+        self.high = HIGH_WATERMARK if high is None else high
+        self.low = LOW_WATERMARK if low is None else low
+        self.limit = LIMIT if limit is None else limit
+        # (source, frame, size, time queued), in the order they are sent
+        self.frames = deque()
+        self.presence = deque()
+        self.ephemeral = deque()
+        # bytes of the frames of every queue
+        self.queued = 0
+        self.congested = False
+        self.closed = False
+        # closing the socket with a resync frame
+        self.resyncing = False
+        # sending the queue, while there is one
+        self.task = None
+
+    async def push(self, data):
+        """Queue the frame of `data`, a `source` and its `data`."""
+        if self.closed:
+            return
+        sent_at = data.pop("sent_at", None)
+        if sent_at is not None:
+            layer_delay_seconds.observe(max(time.time() - sent_at, 0))
+        source = data["source"]
+        if source in EPHEMERAL_SOURCES and self.congested:
+            outbound_dropped.inc(source)
+            return
+        frame = self.wire.frame(data)
+        size = frame_size(frame)
+        self.queue(source).append((source, frame, size, time.perf_counter()))
+        self.queued += size
+        outbound_bytes.inc(amount=size)
+        if self.queued > self.limit:
+            self.resync()
+            return
+        if self.queued > self.high and not self.congested:
+            self.congest()
+        if self.task is None:
+            self.task = self.spawn(self.drain())
+
+    def queue(self, source):
+        if source in EPHEMERAL_SOURCES:
+            return self.ephemeral
+        if source in PRESENCE_SOURCES:
+            return self.presence
+        return self.frames
+
+    def spawn(self, coroutine):
+        # runs outside of the context of the handler that queued the frame,
+        # which for the sync consumer holds a thread that is long gone
+        return asyncio.get_running_loop().create_task(
+            coroutine, context=contextvars.Context()
+        )
+
+    def congest(self):
+        self.congested = True
+        outbound_congested.inc()
+        while self.ephemeral:
+            source, frame, size, queued = self.ephemeral.popleft()
+            self.release(size)
+            outbound_dropped.inc(source)
+
+    def release(self, size):
+        self.queued -= size
+        outbound_bytes.dec(amount=size)
+        if self.congested and self.queued <= self.low:
+            self.congested = False
+            outbound_congested.dec()
+
+    async def drain(self):
+        try:
+            while self.frames or self.presence or self.ephemeral:
+                queue = self.frames or self.presence or self.ephemeral
+                source, frame, size, queued = queue.popleft()
+                try:
+                    await self.send(asgi_message(frame))
+                finally:
+                    self.release(size)
+                outbound_delay_seconds.observe(time.perf_counter() - queued)
+                count_sent(source, frame)
+            if self.resyncing:
+                await self.send_resync()
+        except Exception as error:
+            # the socket is unusable, most likely closed by the client
+            logger.warning("Sending to a socket failed, closing its queue: %r", error)
+            self.discard(dropped=False)
+        finally:
+            self.task = None
+
+    def discard(self, dropped):
+        """
+        Drop whatever is still queued, and anything pushed from now on.
+        Frames are counted as dropped if `dropped`: a socket that has gone
+        away is not one that fell behind.
+        """
+        self.closed = True
+        for queue in (self.frames, self.presence, self.ephemeral):
+            while queue:
+                source, frame, size, queued = queue.popleft()
+                self.release(size)
+                if dropped:
+                    outbound_dropped.inc(source)
+
+    def resync(self):
+        outbound_resyncs.inc()
+        self.discard(dropped=True)
+        # once the frame being sent, if any, is out
+        self.resyncing = True
+        if self.task is None:
+            self.task = self.spawn(self.drain())
+
+    async def send_resync(self):
+        frame = self.wire.frame(
+            {"source": "resync", "data": {"reason": "too far behind"}}
+        )
+        await self.send(asgi_message(frame))
+        count_sent("resync", frame)
+        await self.send({"type": "websocket.close", "code": RESYNC_CLOSE_CODE})
+
+    async def close(self):
+        """Called once the socket is gone."""
+        self.discard(dropped=False)
+        if self.task is not None:
+            self.task.cancel()
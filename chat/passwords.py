@@ -0,0 +1,72 @@
+"""
+Password hashing for sign in and sign up, off the event loop.
+
+Hashing a password takes a few hundred milliseconds of CPU by design, and
+the auth views run in the same process as the websockets. They hash in
+`password_pool` threads instead (hashlib releases the GIL), at most
+CHAT_PASSWORD_WORKERS at once. Up to CHAT_PASSWORD_BACKLOG more wait for
+a thread; beyond that `run` raises Overloaded right away, and the views
+answer 503 rather than letting logins pile up.
+"""
+
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.contrib.auth.hashers import check_password, make_password
+from .metrics import password_rejected, password_seconds
+
+
+class Overloaded(Exception):
+    pass
+
+
+class PasswordPool:
+    def __init__(self, workers, backlog):
+        self.workers = workers
+        self.executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="password"
+        )
+        self.limit = workers + backlog
+        # jobs hashing or waiting for a thread
+        self.pending = 0
+        self.lock = threading.Lock()
+
+    async def run(self, function, *args):
+        with self.lock:
+            if self.pending >= self.limit:
+                password_rejected.inc()
+                raise Overloaded
+            self.pending += 1
+        start = time.perf_counter()
+        try:
+            return await asyncio.get_running_loop().run_in_executor(
+                self.executor, function, *args
+            )
+        finally:
+            with self.lock:
+                self.pending -= 1
+            password_seconds.observe(time.perf_counter() - start, function.__name__)
+
+
+password_pool = PasswordPool(
+    workers=getattr(settings, "CHAT_PASSWORD_WORKERS", 2),
+    backlog=getattr(settings, "CHAT_PASSWORD_BACKLOG", 32),
+)
+
+
+def hash_password(raw):
+    return make_password(raw)
+
+
+def verify_password(raw, encoded):
+    """
+    (whether `raw` matches `encoded`, the new hash when `encoded` uses
+    outdated hasher settings and should be replaced, else None)
+    """
+    upgraded = []
+    matches = check_password(
+        raw, encoded, setter=lambda raw: upgraded.append(make_password(raw))
+    )
+    return matches, upgraded[0] if upgraded else None
@@ -0,0 +1,198 @@
+"""
+Presence: which users have a websocket open, told to their friends.
+
+Every socket is a PresenceSocket row leased by the worker process serving
+it. Workers renew their leases every CHAT_PRESENCE_HEARTBEAT seconds, so
+the sockets of a worker that died expire CHAT_PRESENCE_TTL seconds later
+and the next heartbeat of any worker sweeps them.
+
+A user is online while one of their sockets is live, whatever the device
+or worker. OnlineUser records what friends were last told, and "presence"
+frames are only sent when a conditional insert or delete of it changes
+something, so every transition is published exactly once across workers.
+Going offline waits CHAT_PRESENCE_GRACE seconds after the last socket
+closes: reconnecting within it is not a transition at all.
+
+Frames go to the user's approved connections only:
+
+    {"source": "presence", "data": {"username": "alice", "online": true}}
+"""
+
+import asyncio
+import contextvars
+import uuid
+from datetime import timedelta
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+from .graph import social_graph
+from .metrics import group_send
+from .models import OnlineUser, PresenceSocket, User
+
+# identifies the leases of this process
+WORKER = uuid.uuid4().hex
+
+
+def live_sockets():
+    return PresenceSocket.objects.filter(
+        user=OuterRef("user_id"), expires__gt=timezone.now()
+    )
+
+
+def came_online(user_id, channel_name, ttl):
+    """Lease a socket of `user_id`. Returns whether they came online."""
+    PresenceSocket.objects.create(
+        user_id=user_id,
+        channel_name=channel_name,
+        worker=WORKER,
+        expires=timezone.now() + timedelta(seconds=ttl),
+    )
+    try:
+        with transaction.atomic():
+            OnlineUser.objects.create(user_id=user_id)
+    except IntegrityError:
+        # already online, from another socket
+        return False
+    return True
+
+
+def release(channel_name):
+    PresenceSocket.objects.filter(channel_name=channel_name).delete()
+
+
+def went_offline(user_ids):
+    """
+    (id, username) of those of `user_ids` online without a live socket,
+    now offline.
+    """
+    offline = []
+    candidates = (
+        OnlineUser.objects.filter(user_id__in=user_ids)
+        .exclude(Exists(live_sockets()))
+        .values_list("user_id", "user__username")
+    )
+    for user_id, username in candidates:
+        # a socket may have opened since
+        deleted, _ = (
+            OnlineUser.objects.filter(user_id=user_id)
+            .exclude(Exists(live_sockets()))
+            .delete()
+        )
+        if deleted:
+            offline.append((user_id, username))
+    return offline
+
+
+def heartbeat(ttl):
+    """
+    Renew the leases of this worker, drop expired ones and return the
+    users left without a live socket, now offline.
+    """
+    now = timezone.now()
+    PresenceSocket.objects.filter(worker=WORKER).update(
+        expires=now + timedelta(seconds=ttl)
+    )
+    PresenceSocket.objects.filter(expires__lte=now).delete()
+    stale = OnlineUser.objects.exclude(Exists(live_sockets())).values_list(
+        "user_id", flat=True
+    )
+    return went_offline(list(stale))
+
+
+def friend_usernames(user_id, online=False):
+    friends = User.objects.filter(id__in=social_graph.get(user_id).friends)
+    if online:
+        friends = friends.filter(Exists(OnlineUser.objects.filter(user=OuterRef("pk"))))
+    return list(friends.values_list("username", flat=True))
+
+
+class Presence:
+    """Sockets of this worker and the transitions they cause."""
+
+    def __init__(self, ttl, heartbeat, grace):
+        self.ttl = ttl
+        self.heartbeat = heartbeat
+        self.grace = grace
+        # user id -> sockets open in this process
+        self.local = {}
+        # user id -> TimerHandle of their offline check
+        self.pending = {}
+        self.heartbeat_task = None
+
+    async def connect(self, channel_layer, user, channel_name):
+        self.local[user.id] = self.local.get(user.id, 0) + 1
+        handle = self.pending.pop(user.id, None)
+        if handle is not None:
+            handle.cancel()
+        self.start_heartbeat(channel_layer)
+        if await database_sync_to_async(came_online)(user.id, channel_name, self.ttl):
+            await self.publish(channel_layer, user.id, user.username, True)
+
+    async def disconnect(self, channel_layer, user, channel_name):
+        await database_sync_to_async(release)(channel_name)
+        self.local[user.id] -= 1
+        if self.local[user.id]:
+            return
+        del self.local[user.id]
+        if not self.local and self.heartbeat_task is not None:
+            self.heartbeat_task.cancel()
+            self.heartbeat_task = None
+        # debounced: reconnecting within the grace period cancels it
+        self.pending[user.id] = asyncio.get_running_loop().call_later(
+            self.grace,
+            self.spawn,
+            self.check,
+            channel_layer,
+            user.id,
+            context=contextvars.Context(),
+        )
+
+    def spawn(self, function, *args):
+        # runs outside of the context of whichever socket scheduled it,
+        # which for the sync consumer holds a thread that is long gone
+        return asyncio.get_running_loop().create_task(
+            function(*args), context=contextvars.Context()
+        )
+
+    async def check(self, channel_layer, user_id):
+        self.pending.pop(user_id, None)
+        for user_id, username in await database_sync_to_async(went_offline)([user_id]):
+            await self.publish(channel_layer, user_id, username, False)
+
+    def start_heartbeat(self, channel_layer):
+        if self.heartbeat_task is None and self.heartbeat:
+            self.heartbeat_task = self.spawn(self.beat, channel_layer)
+
+    async def beat(self, channel_layer):
+        while True:
+            await asyncio.sleep(self.heartbeat)
+            offline = await database_sync_to_async(heartbeat)(self.ttl)
+            for user_id, username in offline:
+                await self.publish(channel_layer, user_id, username, False)
+
+    def clear(self):
+        for handle in self.pending.values():
+            handle.cancel()
+        self.pending.clear()
+        self.local.clear()
+        if self.heartbeat_task is not None:
+            self.heartbeat_task.cancel()
+            self.heartbeat_task = None
+
+    async def publish(self, channel_layer, user_id, username, online):
+        response = {
+            "type": "broadcast_group",
+            "source": "presence",
+            "data": {"username": username, "online": online},
+        }
+        for friend in await database_sync_to_async(friend_usernames)(user_id):
+            await group_send(channel_layer, friend, response)
+
+
+presence = Presence(
+    ttl=getattr(settings, "CHAT_PRESENCE_TTL", 90),
+    heartbeat=getattr(settings, "CHAT_PRESENCE_HEARTBEAT", 30),
+    grace=getattr(settings, "CHAT_PRESENCE_GRACE", 5),
+)
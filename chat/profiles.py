@@ -0,0 +1,106 @@
+"""
+Cache of serialized public user profiles (UserSerializer data).
+
+The same senders and receivers are serialized into every message and friend
+list frame. Profiles are kept in a process-local LRU keyed by user id,
+optionally backed by a Django cache shared between processes, and dropped
+whenever the user is saved. Local entries also expire after
+CHAT_PROFILE_CACHE_TTL seconds, which bounds how long a change saved by
+another process can go unnoticed.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+from .models import User
+
+
+class ProfileCache:
+    def __init__(self, max_size, ttl, backend=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.backend = backend
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def key(self, user_id):
+        return f"chat:profile:{user_id}"
+
+    def get(self, user_id, build, fill=True):
+        """
+        Cached profile of `user_id`, calling `build()` on a miss. What it
+        builds is only cached if `fill`.
+        """
+        if self.max_size <= 0:
+            return build()
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(user_id)
+            if entry is not None and entry[0] > now:
+                self.entries.move_to_end(user_id)
+                self.hits += 1
+                return entry[1]
+        data = None
+        if self.backend is not None:
+            data = caches[self.backend].get(self.key(user_id))
+        with self.lock:
+            if data is not None:
+                self.shared_hits += 1
+            else:
+                self.misses += 1
+        if data is None:
+            data = build()
+            if not fill:
+                return data
+            if self.backend is not None:
+                caches[self.backend].set(self.key(user_id), data, self.ttl)
+        with self.lock:
+            self.entries[user_id] = (now + self.ttl, data)
+            self.entries.move_to_end(user_id)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+        return data
+
+    def invalidate(self, user_id):
+        with self.lock:
+            self.entries.pop(user_id, None)
+        if self.backend is not None:
+            caches[self.backend].delete(self.key(user_id))
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.shared_hits + self.misses
+            return {
+                "size": len(self.entries),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "shared_hits": self.shared_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+            }
+
+
+profile_cache = ProfileCache(
+    max_size=getattr(settings, "CHAT_PROFILE_CACHE_SIZE", 10000),
+    ttl=getattr(settings, "CHAT_PROFILE_CACHE_TTL", 60),
+    backend=getattr(settings, "CHAT_PROFILE_CACHE_BACKEND", None),
+)
+
+
+@receiver(post_save, sender=User)
+def invalidate_profile(sender, instance, **kwargs):
+    profile_cache.invalidate(instance.id)
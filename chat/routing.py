@@ -1,5 +1,14 @@
+from django.conf import settings
 from django.urls import path
 from . import consumers
 
 
-websocket_urlpatterns = [path("chat/", consumers.ChatConsumer.as_asgi())]
+# CHAT_CONSUMER setting picks the websocket implementation
+CONSUMERS = {
+    "async": consumers.AsyncChatConsumer,
+    "sync": consumers.ChatConsumer,
+}
+
+websocket_urlpatterns = [
+    path("chat/", CONSUMERS[getattr(settings, "CHAT_CONSUMER", "async")].as_asgi())
+]
@@ -0,0 +1,139 @@
+"""
+Indexed prefix search over users for the `search` source.
+
+Every user has UserSearchToken rows holding the normalized (accent
+stripped, casefolded) words and whole values of their username and names.
+A query term matches the tokens in the range [term, term + U+10FFFF), a
+plain B-tree range scan on any database engine, unlike `istartswith` over
+three columns which scans the whole user table.
+
+The range only holds prefixes when tokens sort by code point, so the
+token column is binary collated: SQLite's BINARY, "C" on PostgreSQL and
+utf8mb4_bin on MySQL, see migration 0010. A locale collation would miss
+some tokens and let others in.
+"""
+
+import re
+import unicodedata
+from django.conf import settings
+from django.db.models import Exists, OuterRef
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+from .models import User, UserSearchToken
+
+
+SEARCH_LIMIT = getattr(settings, "CHAT_SEARCH_LIMIT", 20)
+# seconds an identical back-to-back query on one socket reuses its results
+SEARCH_DEBOUNCE = getattr(settings, "CHAT_SEARCH_DEBOUNCE", 2.0)
+TOKEN_LENGTH = UserSearchToken._meta.get_field("token").max_length
+INDEXED_FIELDS = {
+    "username": UserSearchToken.USERNAME,
+    "first_name": UserSearchToken.FIRST_NAME,
+    "last_name": UserSearchToken.LAST_NAME,
+}
+
+# SEARCH_VALUES without the status fields, which come from the social graph
+USER_VALUES = ["id", "username", "first_name", "last_name", "thumbnail"]
+
+word_separator = re.compile(r"[\W_]+")
+
+
+def normalize(text):
+    text = unicodedata.normalize("NFKD", text or "")
+    text = "".join(char for char in text if not unicodedata.combining(char))
+    return " ".join(text.casefold().split())
+
+
+def user_tokens(username, first_name, last_name):
+    """Set of (token, weight) to index for a user."""
+    tokens = set()
+    values = {"username": username, "first_name": first_name, "last_name": last_name}
+    for field, weight in INDEXED_FIELDS.items():
+        value = normalize(values[field])
+        if not value:
+            continue
+        tokens.add((value[:TOKEN_LENGTH], weight))
+        for word in word_separator.split(value):
+            if word:
+                tokens.add((word[:TOKEN_LENGTH], weight))
+    return tokens
+
+
+def index_user(user):
+    tokens = user_tokens(user.username, user.first_name, user.last_name)
+    indexed = set(
+        UserSearchToken.objects.filter(user=user).values_list("token", "weight")
+    )
+    if indexed == tokens:
+        return
+    UserSearchToken.objects.filter(user=user).delete()
+    UserSearchToken.objects.bulk_create(
+        UserSearchToken(user=user, token=token, weight=weight)
+        for token, weight in tokens
+    )
+
+
+def query_terms(query):
+    return [term[:TOKEN_LENGTH] for term in normalize(query).split()]
+
+
+def matching_tokens(term):
+    return UserSearchToken.objects.filter(
+        token__gte=term, token__lt=term + "\U0010ffff"
+    )
+
+
+def search_user_ids(query, exclude_user_id, limit=SEARCH_LIMIT):
+    """
+    Ids of the best `limit` users matching every term of `query`.
+
+    Username matches rank before first name matches, before last name
+    matches. Within each, tokens are taken in index order, so a whole
+    token equal to the term comes before longer tokens it prefixes. Every
+    weight is its own range scan that stops after `limit` rows.
+    """
+    terms = query_terms(query)
+    ids = []
+    if not terms:
+        return ids
+    for weight in INDEXED_FIELDS.values():
+        if len(ids) >= limit:
+            break
+        tokens = matching_tokens(terms[0]).filter(weight=weight)
+        for term in terms[1:]:
+            tokens = tokens.filter(
+                Exists(matching_tokens(term).filter(user_id=OuterRef("user_id")))
+            )
+        tokens = (
+            tokens.exclude(user_id=exclude_user_id)
+            .exclude(user_id__in=ids)
+            .order_by("token", "user_id")
+            .values_list("user_id", flat=True)
+        )
+        for user_id in tokens[: limit - len(ids)]:
+            if user_id not in ids:
+                ids.append(user_id)
+    return ids
+
+
+def search_queryset(ids):
+    """`.values()` rows of the found users, still missing their status."""
+    return User.objects.filter(id__in=ids).values(*USER_VALUES)
+
+
+def with_status(rows, ids, adjacency):
+    """`rows` in rank order, with the searcher's connection status to each."""
+    position = {user_id: i for i, user_id in enumerate(ids)}
+    rows = sorted(rows, key=lambda row: position[row["id"]])
+    for row in rows:
+        row["pending_them"], row["pending_me"], row["connected"] = adjacency.flags(
+            row["id"]
+        )
+    return rows
+
+
+@receiver(post_save, sender=User)
+def reindex_user(sender, instance, update_fields=None, **kwargs):
+    if update_fields is not None and not set(update_fields) & set(INDEXED_FIELDS):
+        return
+    index_user(instance)
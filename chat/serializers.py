@@ -1,5 +1,6 @@
 from rest_framework import serializers
-from .models import User, Connection, Message
+from .models import User, Connection, Message, Conversation
+from .thumbnails import variant
 
 
 def capitalize_all(sentence):
@@ -10,6 +11,7 @@ def capitalize_all(sentence):
 
 class UserSerializer(serializers.ModelSerializer):
     full_name = serializers.SerializerMethodField()
+    thumbnail = serializers.SerializerMethodField()
 
     class Meta:
         model = User
@@ -19,6 +21,12 @@ class UserSerializer(serializers.ModelSerializer):
         full_name = f"{obj.first_name} {obj.last_name}"
         return capitalize_all(full_name)
 
+    def get_thumbnail(self, obj):
+        # the small variant, see thumbnails.py
+        if not obj.thumbnail:
+            return None
+        return obj.thumbnail.storage.url(variant(obj.thumbnail.name))
+
 
 class SignUpUserSerializer(serializers.ModelSerializer):
     class Meta:
@@ -50,11 +58,21 @@ class SearchSerializer(UserSerializer):
         fields = ["username", "full_name", "thumbnail", "status"]
 
     def get_status(self, obj):
-        if obj.pending_them:
+        # the searcher's social_graph adjacency, or annotated users
+        adjacency = self.context.get("adjacency")
+        if adjacency is not None:
+            pending_them, pending_me, connected = adjacency.flags(obj.id)
+        else:
+            pending_them, pending_me, connected = (
+                obj.pending_them,
+                obj.pending_me,
+                obj.connected,
+            )
+        if pending_them:
             return "pending-them"
-        elif obj.pending_me:
+        elif pending_me:
             return "pending-me"
-        elif obj.connected:
+        elif connected:
             return "connected"
         else:
             return "not-connected"
@@ -70,31 +88,20 @@ class RequestSerializer(serializers.ModelSerializer):
 
 
 class FriendSerializer(serializers.ModelSerializer):
-
-    friend = serializers.SerializerMethodField()
+    id = serializers.IntegerField(source="connection_id")
+    friend = UserSerializer()
     preview = serializers.SerializerMethodField()
     updated = serializers.SerializerMethodField()
 
     class Meta:
-        model = Connection
-        fields = ["id", "friend", "preview", "updated"]
-
-    def get_friend(self, obj):
-        if obj.sender.username == self.context["user"].username:
-            return UserSerializer(obj.receiver).data
-        return UserSerializer(obj.sender).data
+        model = Conversation
+        fields = ["id", "friend", "preview", "updated", "unread"]
 
     def get_preview(self, obj):
-        if not hasattr(obj, "latest_text"):
-            return "New connection"
-        return obj.latest_text or "New connection"
+        return obj.preview or "New connection"
 
     def get_updated(self, obj):
-        if not hasattr(obj, "latest_created"):
-            date = obj.updated
-        else:
-            date = obj.latest_created or obj.updated
-        return date.isoformat()
+        return obj.last_activity.isoformat()
 
 
 class MessageSerializer(serializers.ModelSerializer):
@@ -106,7 +113,7 @@ class MessageSerializer(serializers.ModelSerializer):
         fields = ["id", "connection", "sender", "receiver", "text", "created"]
 
     def get_receiver(self, obj):
-        if obj.connection.sender.username == obj.sender.username:
+        if obj.connection.sender_id == obj.sender_id:
             return UserSerializer(obj.connection.receiver).data
         else:
             return UserSerializer(obj.connection.sender).data
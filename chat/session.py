@@ -0,0 +1,50 @@
+"""
+The session.init frame: everything a client shows after connecting.
+
+    {"user": <profile>, "friends": <friend.list>, "requests": <request.list>,
+     "unread": <total unread>, "online": <presence.list>, "cursor": <sync>}
+
+It replaces a friend.list, request.list and presence.list round trip each,
+in four queries whatever the number of friends. Clients get it with a
+`session.init` frame, or without any round trip by connecting with
+`init=1` in the query string. `cursor` is where the next `sync` starts
+from after a reconnect.
+"""
+
+from urllib.parse import parse_qs
+from .catchup import start_cursor
+from .fast_serializers import (
+    FRIEND_VALUES,
+    REQUEST_VALUES,
+    friend_list_data,
+    request_list_data,
+    scope_user_data,
+)
+from .models import Connection, Conversation
+from .presence import friend_usernames
+
+
+def wants_init(scope):
+    query = parse_qs(scope.get("query_string", b"").decode())
+    return query.get("init", ["0"])[-1] == "1"
+
+
+def session_data(user):
+    # taken first, so that what changes while the lists are read is synced
+    cursor = start_cursor(user)
+    friends = friend_list_data(
+        Conversation.objects.filter(user=user)
+        .order_by("-last_activity")
+        .values(*FRIEND_VALUES)
+    )
+    requests = request_list_data(
+        Connection.objects.filter(receiver=user, approved=False).values(*REQUEST_VALUES)
+    )
+    return {
+        "user": scope_user_data(user),
+        "friends": friends,
+        "requests": requests,
+        "unread": sum(friend["unread"] for friend in friends),
+        "online": friend_usernames(user.id, online=True),
+        "cursor": cursor,
+    }
@@ -1,3 +1,1245 @@
-from django.test import TestCase
+import asyncio
+import gzip
+import hashlib
+import json
+import msgpack
+import shutil
+import tempfile
+import time
+from datetime import timedelta
+from io import BytesIO
+from unittest.mock import patch
+from asgiref.sync import sync_to_async
+from channels.testing import WebsocketCommunicator
+from django.db import connection
+from django.db.models import Value
+from django.test import TestCase, override_settings
+from PIL import Image
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework_simplejwt.tokens import AccessToken
+from .auth import JWTAuthMiddleware, authenticate, load_user, token_cache
+from .benchmarks import IN_MEMORY_CHANNEL_LAYERS
+from .consumers import AsyncChatConsumer, ChatConsumer
+from .conversations import open_conversations, send_message
+from .ephemeral import EphemeralChannel, ephemeral
+from .message_search import message_search_data
+from .outbound import RESYNC_CLOSE_CODE, Outbound, frame_size
+from .passwords import password_pool
+from .fast_serializers import (
+    FRIEND_VALUES,
+    MESSAGE_VALUES,
+    REQUEST_VALUES,
+    SEARCH_VALUES,
+    friend_data,
+    friend_list_data,
+    message_data,
+    messages_data,
+    request_data,
+    request_list_data,
+    scope_user_data,
+    search_data,
+    user_data,
+)
+from .graph import FRIEND, RECEIVED, SENT, SocialGraph, social_graph
+from . import metrics
+from .models import (
+    User,
+    Connection,
+    Message,
+    Conversation,
+    OnlineUser,
+    PresenceSocket,
+)
+from .presence import WORKER, heartbeat, presence
+from .profiles import ProfileCache
+from .search import search_user_ids
+from .thumbnails import ThumbnailError, ingest, remove_thumbnail, render, variant
+from .uploads import Upload, UploadError
+from .wire import negotiate
+from .writer import MessageWriter
+from .serializers import (
+    UserSerializer,
+    SearchSerializer,
+    RequestSerializer,
+    FriendSerializer,
+    MessageSerializer,
+)
 
-# Create your tests here.
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS)
+class AsyncConsumerQueryCountTests(TestCase):
+    """
+    Exact number of queries each websocket `source` runs.
+
+    Counts must not depend on how many rows are returned, so every list is
+    seeded with several rows: a relation loaded per row shows up here.
+    """
+
+    consumer = AsyncChatConsumer
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(username="alice", first_name="alice")
+        cls.friends = [
+            User.objects.create(username=f"bob{i}", first_name="bob") for i in range(3)
+        ]
+        cls.connections = []
+        for friend in cls.friends:
+            connection = Connection.objects.create(
+                sender=cls.user, receiver=friend, approved=True
+            )
+            open_conversations(connection)
+            cls.connections.append(connection)
+        Message.objects.bulk_create(
+            [
+                Message(
+                    connection=cls.connections[0],
+                    sender=cls.user if i % 2 else cls.friends[0],
+                    text=f"message {i}",
+                )
+                for i in range(20)
+            ]
+        )
+        cls.requests = [
+            Connection.objects.create(
+                sender=User.objects.create(username=f"carol{i}"), receiver=cls.user
+            )
+            for i in range(3)
+        ]
+
+    def setUp(self):
+        # ids are reused once a test's rows are rolled back
+        social_graph.clear()
+        ephemeral.clear()
+        presence.clear()
+
+    async def assertSourceQueries(self, num, data, reply_source=None, repeat=1):
+        communicator = WebsocketCommunicator(self.consumer.as_asgi(), "/chat/")
+        communicator.scope["user"] = self.user
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        # assertNumQueries can't open the connection from the event loop
+        queries = CaptureQueriesContext(connection)
+        await sync_to_async(queries.__enter__)()
+        try:
+            for _ in range(repeat):
+                await communicator.send_json_to(data)
+                while True:
+                    frame = await communicator.receive_json_from(timeout=5)
+                    if frame["source"] == (reply_source or data["source"]):
+                        break
+        finally:
+            await sync_to_async(queries.__exit__)(None, None, None)
+            await communicator.disconnect()
+        captured = await sync_to_async(lambda: queries.captured_queries)()
+        executed = "\n".join(query["sql"] for query in captured)
+        self.assertEqual(
+            len(captured),
+            num,
+            f"{data['source']} ran {len(captured)} queries:\n{executed}",
+        )
+        return frame["data"]
+
+    async def test_search(self):
+        results = await self.assertSourceQueries(4, {"source": "search", "query": "bo"})
+        self.assertEqual([user["status"] for user in results], ["connected"] * 3)
+        results = await self.assertSourceQueries(
+            4, {"source": "search", "query": "car"}
+        )
+        self.assertEqual([user["status"] for user in results], ["pending-me"] * 3)
+
+    async def test_request_connect(self):
+        await self.assertSourceQueries(
+            5, {"source": "request.connect", "username": "carol0"}
+        )
+
+    async def test_request_list(self):
+        results = await self.assertSourceQueries(1, {"source": "request.list"})
+        self.assertEqual(len(results), 3)
+
+    async def test_request_accept(self):
+        friend = await self.assertSourceQueries(
+            3,
+            {"source": "request.accept", "id": self.requests[0].id},
+            reply_source="friend.new",
+        )
+        self.assertEqual(friend["id"], self.requests[0].id)
+        self.assertEqual(friend["preview"], "New connection")
+
+    async def test_message_search(self):
+        results = await self.assertSourceQueries(
+            2, {"source": "message.search", "query": "mess"}
+        )
+        self.assertEqual(len(results["results"]), 20)
+
+    async def test_friend_list(self):
+        results = await self.assertSourceQueries(1, {"source": "friend.list"})
+        self.assertEqual(len(results), 3)
+
+    async def test_message_send(self):
+        await self.assertSourceQueries(
+            5,
+            {
+                "source": "message.send",
+                "connectionId": self.connections[0].id,
+                "messageText": "hello",
+            },
+        )
+
+    async def test_sync(self):
+        # sent well before the cursor, out of its overlap
+        await Message.objects.aupdate(created=timezone.now() - timedelta(hours=1))
+        cursor = await self.assertSourceQueries(1, {"source": "sync"})
+        self.assertTrue(cursor["stale"])
+        cursor = cursor["cursor"]
+        await Message.objects.acreate(
+            connection=self.connections[1], sender=self.friends[1], text="new"
+        )
+        results = await self.assertSourceQueries(
+            5, {"source": "sync", "since": {**cursor, "message_id": 0}}
+        )
+        self.assertEqual(len(results["messages"]), 21)
+        results = await self.assertSourceQueries(5, {"source": "sync", "since": cursor})
+        self.assertEqual([m["text"] for m in results["messages"]], ["new"])
+        self.assertEqual(results["messages"][0]["sender"]["username"], "bob1")
+        self.assertFalse(results["more"])
+
+    async def test_sync_message_committed_late(self):
+        await Message.objects.aupdate(created=timezone.now() - timedelta(hours=1))
+        late, new = [
+            await Message.objects.acreate(
+                connection=self.connections[1], sender=self.friends[1], text=text
+            )
+            for text in ("late", "new")
+        ]
+        # a previous sync read `new` before `late` had committed
+        cursor = {"message_id": new.id, "time": timezone.now().isoformat()}
+        results = await self.assertSourceQueries(5, {"source": "sync", "since": cursor})
+        # sent again with the late one, the client replaces it by id
+        self.assertEqual([m["text"] for m in results["messages"]], ["late", "new"])
+        self.assertEqual(results["cursor"]["message_id"], new.id)
+
+    async def test_session_init(self):
+        results = await self.assertSourceQueries(4, {"source": "session.init"})
+        self.assertEqual(results["user"]["username"], "alice")
+        self.assertEqual(len(results["friends"]), 3)
+        self.assertEqual(len(results["requests"]), 3)
+        self.assertEqual(results["unread"], 0)
+        self.assertEqual(results["online"], [])
+
+    async def test_reply_to_requesting_socket_only(self):
+        sockets = []
+        for _ in range(2):
+            communicator = WebsocketCommunicator(self.consumer.as_asgi(), "/chat/")
+            communicator.scope["user"] = self.user
+            await communicator.connect()
+            sockets.append(communicator)
+
+        def group_sends(source):
+            entry = metrics.group_send_seconds.values.get((source,))
+            # observations of every bucket, the sum last
+            return sum(entry[:-1]) if entry else 0
+
+        replies, fan_outs = group_sends("friend.list"), group_sends("message.type")
+        await sockets[0].send_json_to({"source": "friend.list"})
+        frame = await sockets[0].receive_json_from()
+        self.assertEqual(frame["source"], "friend.list")
+        self.assertTrue(await sockets[1].receive_nothing())
+        self.assertEqual(group_sends("friend.list"), replies)
+        # what is meant for the whole group still goes through the layer
+        await sockets[0].send_json_to({"source": "message.type", "username": "alice"})
+        for communicator in sockets:
+            frame = await communicator.receive_json_from()
+            self.assertEqual(frame["source"], "message.type")
+        self.assertEqual(group_sends("message.type"), fan_outs + 1)
+        for communicator in sockets:
+            await communicator.disconnect()
+
+    async def test_session_init_on_connect(self):
+        communicator = WebsocketCommunicator(self.consumer.as_asgi(), "/chat/?init=1")
+        communicator.scope["user"] = self.user
+        await communicator.connect()
+        frame = await communicator.receive_json_from()
+        self.assertEqual(frame["source"], "session.init")
+        self.assertEqual(len(frame["data"]["friends"]), 3)
+        await communicator.disconnect()
+
+    async def test_presence_list(self):
+        results = await self.assertSourceQueries(1, {"source": "presence.list"})
+        self.assertEqual(results, [])
+
+    async def test_message_list_page(self):
+        results = await self.assertSourceQueries(
+            2,
+            {
+                "source": "message.list",
+                "connectionId": self.connections[0].id,
+                "page": 1,
+            },
+        )
+        self.assertEqual(len(results["messages"]), 8)
+
+    async def test_message_list_cursor(self):
+        results = await self.assertSourceQueries(
+            3, {"source": "message.list", "connectionId": self.connections[0].id}
+        )
+        self.assertEqual(len(results["messages"]), 12)
+        self.assertEqual(set(results["next"]), {"before_id", "before_created"})
+
+    async def test_message_list_invalid_cursor(self):
+        for before_created in ("garbage", "2024-13-45T00:00:00", 5):
+            results = await self.assertSourceQueries(
+                3,
+                {
+                    "source": "message.list",
+                    "connectionId": self.connections[0].id,
+                    "before_created": before_created,
+                    "before_id": 5,
+                },
+            )
+            # the first page, read as without a cursor
+            self.assertEqual(len(results["messages"]), 12)
+
+    async def test_search_repeated_is_debounced(self):
+        results = await self.assertSourceQueries(
+            4, {"source": "search", "query": "bob1"}, repeat=3
+        )
+        self.assertEqual([user["username"] for user in results], ["bob1"])
+
+    async def test_search_query_not_a_string(self):
+        results = await self.assertSourceQueries(0, {"source": "search", "query": 5})
+        self.assertEqual(results, [])
+
+    async def test_message_type(self):
+        await self.assertSourceQueries(
+            0, {"source": "message.type", "username": "alice"}
+        )
+
+
+class SyncConsumerQueryCountTests(AsyncConsumerQueryCountTests):
+    consumer = ChatConsumer
+
+
+class FastSerializerTests(TestCase):
+    """fast_serializers must produce the DRF serializers' exact output."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(
+            username="alice",
+            first_name="alice mary",
+            last_name="smith",
+            thumbnail="thumbnails/alice.png",
+        )
+        cls.friend = User.objects.create(username="bob", first_name="bob")
+        cls.connection = Connection.objects.create(
+            sender=cls.user, receiver=cls.friend, approved=True
+        )
+        open_conversations(cls.connection)
+        Connection.objects.create(sender=cls.friend, receiver=cls.user)
+        for i in range(3):
+            send_message(cls.connection, cls.friend if i % 2 else cls.user, f"hi {i}")
+
+    def assertSameJSON(self, expected, actual):
+        self.assertEqual(json.dumps(expected), json.dumps(actual))
+
+    def test_user(self):
+        self.assertSameJSON(UserSerializer(self.user).data, user_data(self.user))
+
+    def test_messages(self):
+        messages = Message.objects.filter(connection=self.connection).order_by("id")
+        self.assertSameJSON(
+            MessageSerializer(messages, many=True).data,
+            messages_data(messages.values(*MESSAGE_VALUES), self.connection),
+        )
+        self.assertSameJSON(
+            MessageSerializer(messages[0]).data,
+            message_data(messages[0], self.connection),
+        )
+
+    def test_friends(self):
+        conversations = Conversation.objects.order_by("id")
+        self.assertSameJSON(
+            FriendSerializer(conversations, many=True).data,
+            friend_list_data(conversations.values(*FRIEND_VALUES)),
+        )
+        self.assertSameJSON(
+            FriendSerializer(conversations[0]).data, friend_data(conversations[0])
+        )
+
+    def test_requests(self):
+        connections = Connection.objects.order_by("id")
+        self.assertSameJSON(
+            RequestSerializer(connections, many=True).data,
+            request_list_data(connections.values(*REQUEST_VALUES)),
+        )
+        self.assertSameJSON(
+            RequestSerializer(connections[0]).data, request_data(connections[0])
+        )
+
+    def test_search(self):
+        users = User.objects.order_by("id").annotate(
+            pending_them=Value(False), pending_me=Value(True), connected=Value(False)
+        )
+        self.assertSameJSON(
+            SearchSerializer(users, many=True).data,
+            search_data(users.values(*SEARCH_VALUES)),
+        )
+
+
+class ProfileCacheTests(TestCase):
+    def test_user_save_invalidates(self):
+        user = User.objects.create(username="alice", first_name="alice")
+        self.assertEqual(user_data(user)["full_name"], "Alice")
+        user.first_name = "alicia"
+        user.save()
+        self.assertEqual(user_data(user)["full_name"], "Alicia")
+
+    def test_scope_user_never_refills(self):
+        user = User.objects.create(username="alice", first_name="alice")
+        # the instance of a socket that connected before the edit
+        connected = User.objects.get(id=user.id)
+        user.first_name = "alicia"
+        user.save()
+        self.assertEqual(scope_user_data(connected)["full_name"], "Alice")
+        fresh = User.objects.get(id=user.id)
+        self.assertEqual(user_data(fresh)["full_name"], "Alicia")
+
+    @override_settings(CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS)
+    async def test_request_connect_never_refills(self):
+        for consumer in (AsyncChatConsumer, ChatConsumer):
+            alice = await User.objects.acreate(username="alice", first_name="alice")
+            await User.objects.acreate(username="bob")
+            communicator = WebsocketCommunicator(consumer.as_asgi(), "/chat/")
+            communicator.scope["user"] = alice
+            await communicator.connect()
+            renamed = await User.objects.aget(id=alice.id)
+            renamed.first_name = "alicia"
+            await renamed.asave()
+            await communicator.send_json_to(
+                {"source": "request.connect", "username": "bob"}
+            )
+            frame = await communicator.receive_json_from()
+            self.assertEqual(frame["data"]["sender"]["full_name"], "Alice")
+            await communicator.disconnect()
+            fresh = await User.objects.aget(id=alice.id)
+            self.assertEqual(user_data(fresh)["full_name"], "Alicia")
+            await User.objects.all().adelete()
+
+    def test_lru_eviction_and_counters(self):
+        cache = ProfileCache(max_size=2, ttl=60)
+        for user_id in (1, 2, 1, 3):
+            cache.get(user_id, lambda: {"id": user_id})
+        self.assertEqual(list(cache.entries), [1, 3])
+        self.assertEqual(
+            {key: cache.stats()[key] for key in ("hits", "misses", "evictions")},
+            {"hits": 1, "misses": 3, "evictions": 1},
+        )
+
+
+class AuthTests(TestCase):
+    def setUp(self):
+        token_cache.clear()
+
+    async def test_cached_until_revoked(self):
+        user = await User.objects.acreate(username="alice")
+        token = str(AccessToken.for_user(user))
+        self.assertEqual((await authenticate(token))[1], "verified")
+        cached, outcome = await authenticate(token)
+        self.assertEqual((cached.id, outcome), (user.id, "cached"))
+        # saving drops the cached tokens, inactive users are refused
+        user.is_active = False
+        await user.asave()
+        self.assertEqual(await authenticate(token), (None, "rejected"))
+        self.assertEqual(await authenticate("not.a.token"), (None, "invalid"))
+
+    async def test_revoked_while_loading(self):
+        user = await User.objects.acreate(username="alice")
+        token = str(AccessToken.for_user(user))
+
+        def load_then_deactivate(user_id):
+            loaded = load_user(user_id)
+            # saved by another request before the load is cached
+            other = User.objects.get(pk=user_id)
+            other.is_active = False
+            other.save()
+            return loaded
+
+        with patch("chat.auth.load_user", load_then_deactivate):
+            self.assertEqual((await authenticate(token))[1], "verified")
+        self.assertEqual(token_cache.loads, {})
+        self.assertEqual(await authenticate(token), (None, "rejected"))
+
+    async def test_middleware(self):
+        user = await User.objects.acreate(username="alice")
+        token = str(AccessToken.for_user(user))
+        scopes = []
+
+        async def app(scope, receive, send):
+            scopes.append(scope)
+
+        middleware = JWTAuthMiddleware(app)
+        hits = token_cache.stats()["hits"]
+        for query_string in (f"token={token}", f"token={token}", ""):
+            await middleware({"query_string": query_string.encode()}, None, None)
+        self.assertEqual([scope["user"].id for scope in scopes[:2]], [user.id] * 2)
+        # every socket gets its own copy
+        self.assertIsNot(scopes[0]["user"], scopes[1]["user"])
+        self.assertFalse(scopes[2]["user"].is_authenticated)
+        self.assertEqual(token_cache.stats()["hits"], hits + 1)
+
+
+@override_settings(PASSWORD_HASHERS=["django.contrib.auth.hashers.MD5PasswordHasher"])
+class SignInTests(TestCase):
+    async def test_sign_up_then_in(self):
+        response = await self.async_client.post(
+            "/chat/signup/",
+            {"username": "alice", "password": "secret"},
+            content_type="application/json",
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["user"]["username"], "alice")
+        response = await self.async_client.post(
+            "/chat/signin/", {"username": "alice", "password": "secret"}
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("access", response.json()["tokens"])
+        for data, code in (
+            ({"username": "alice", "password": "wrong"}, 401),
+            ({"username": "bob", "password": "secret"}, 401),
+            ({"username": "alice"}, 400),
+        ):
+            response = await self.async_client.post("/chat/signin/", data)
+            self.assertEqual(response.status_code, code)
+        response = await self.async_client.post("/chat/signup/", {"username": "alice"})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("username", response.json())
+
+    async def test_overloaded(self):
+        await User.objects.acreate(username="alice")
+        limit, password_pool.limit = password_pool.limit, 0
+        try:
+            response = await self.async_client.post(
+                "/chat/signin/", {"username": "alice", "password": "secret"}
+            )
+        finally:
+            password_pool.limit = limit
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response["Retry-After"], "1")
+
+
+class MessageSearchTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.alice, cls.bob, cls.carol = [
+            User.objects.create(username=username)
+            for username in ("alice", "bob", "carol")
+        ]
+        cls.connection = Connection.objects.create(
+            sender=cls.alice, receiver=cls.bob, approved=True
+        )
+        stranger = Connection.objects.create(
+            sender=cls.bob, receiver=cls.carol, approved=True
+        )
+        cls.messages = [
+            send_message(cls.connection, cls.alice, "Dinner on Friday?"),
+            send_message(cls.connection, cls.bob, "Café <b>tonight</b> then"),
+            send_message(cls.connection, cls.bob, "no, dinner friday it is"),
+            send_message(stranger, cls.carol, "dinner friday with alice"),
+        ]
+
+    def setUp(self):
+        social_graph.clear()
+
+    def search(self, user, query, **data):
+        return message_search_data(user.id, {"query": query, **data})
+
+    def test_scoped_and_highlighted(self):
+        results = self.search(self.alice, "dinner fri")["results"]
+        self.assertEqual(
+            [r["id"] for r in results], [self.messages[2].id, self.messages[0].id]
+        )
+        self.assertEqual(
+            results[1]["snippet"], "<mark>Dinner</mark> on <mark>Friday</mark>?"
+        )
+        self.assertEqual(results[1]["sender"]["username"], "alice")
+        # accents are ignored, the text is escaped
+        results = self.search(self.alice, "cafe")["results"]
+        self.assertEqual(
+            results[0]["snippet"], "<mark>Café</mark> &lt;b&gt;tonight&lt;/b&gt; then"
+        )
+        self.assertEqual(self.search(self.carol, "tonight")["results"], [])
+
+    def test_pages(self):
+        page = self.search(self.bob, "dinner", page_size=2)
+        self.assertEqual(len(page["results"]), 2)
+        page = self.search(self.bob, "dinner", page_size=2, **page["next"])
+        self.assertEqual([r["id"] for r in page["results"]], [self.messages[0].id])
+        self.assertIsNone(page["next"])
+
+    def test_index_follows_deletes(self):
+        self.messages[1].delete()
+        self.assertEqual(self.search(self.alice, "tonight")["results"], [])
+
+
+class ExportTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.alice, cls.bob, cls.carol = [
+            User.objects.create(username=username)
+            for username in ("alice", "bob", "carol")
+        ]
+        cls.connection = Connection.objects.create(
+            sender=cls.alice, receiver=cls.bob, approved=True
+        )
+        cls.messages = [
+            send_message(cls.connection, cls.alice, f"hello {i}") for i in range(5)
+        ]
+
+    def setUp(self):
+        social_graph.clear()
+
+    async def export(self, user, query="", **headers):
+        token = AccessToken.for_user(user)
+        return await self.async_client.get(
+            f"/chat/connections/{self.connection.id}/export/{query}",
+            headers={"Authorization": f"Bearer {token}", **headers},
+        )
+
+    async def lines(self, response):
+        content = b"".join([chunk async for chunk in response.streaming_content])
+        if response.get("Content-Encoding") == "gzip":
+            content = gzip.decompress(content)
+        return [json.loads(line) for line in content.decode().splitlines()]
+
+    async def test_export(self):
+        with patch("chat.export.EXPORT_CHUNK_SIZE", 2):
+            response = await self.export(self.bob)
+            self.assertEqual(response["Content-Type"], "application/x-ndjson")
+            lines = await self.lines(response)
+            self.assertEqual(
+                [line["text"] for line in lines], [f"hello {i}" for i in range(5)]
+            )
+            self.assertEqual(lines[0]["receiver"]["username"], "bob")
+            response = await self.export(
+                self.alice,
+                f"?after_id={self.messages[2].id}",
+                **{"Accept-Encoding": "gzip"},
+            )
+            self.assertEqual(response["Content-Encoding"], "gzip")
+            lines = await self.lines(response)
+            self.assertEqual(
+                [line["id"] for line in lines], [m.id for m in self.messages[3:]]
+            )
+
+    async def test_gzip_only_when_accepted(self):
+        for accept_encoding, compressed in (
+            ("gzip;q=0, identity", False),
+            ("br, GZIP;q=0.5", True),
+            ("*", True),
+            ("*;q=0", False),
+        ):
+            response = await self.export(
+                self.bob, **{"Accept-Encoding": accept_encoding}
+            )
+            self.assertEqual(response.has_header("Content-Encoding"), compressed)
+            self.assertEqual(len(await self.lines(response)), 5)
+
+    async def test_refused(self):
+        self.assertEqual((await self.export(self.carol)).status_code, 404)
+        # a pending request is no conversation
+        pending = await Connection.objects.acreate(sender=self.carol, receiver=self.bob)
+        token = AccessToken.for_user(self.carol)
+        response = await self.async_client.get(
+            f"/chat/connections/{pending.id}/export/",
+            headers={"Authorization": f"Bearer {token}"},
+        )
+        self.assertEqual(response.status_code, 404)
+        response = await self.async_client.get(
+            f"/chat/connections/{self.connection.id}/export/"
+        )
+        self.assertEqual(response.status_code, 401)
+        response = await self.export(self.bob, "?since=yesterday")
+        self.assertEqual(response.status_code, 400)
+
+
+class RecordingLayer:
+    def __init__(self):
+        self.sent = []
+
+    async def group_send(self, group, message):
+        self.sent.append((group, message["source"]))
+
+
+class EphemeralTests(TestCase):
+    async def test_coalesced_then_expired(self):
+        layer = RecordingLayer()
+        channel = EphemeralChannel(window=60, expiry=0.05, rate=20)
+        for _ in range(5):
+            await channel.emit(layer, "alice", "bob", "typing.on", {})
+        await channel.emit(layer, "alice", "bob", "message.type", {})
+        self.assertEqual(layer.sent, [("bob", "typing.on"), ("bob", "message.type")])
+        await asyncio.sleep(0.1)
+        self.assertEqual(layer.sent[-1], ("bob", "typing.off"))
+        self.assertEqual(
+            channel.stats(),
+            {"emitted": 2, "coalesced": 4, "dropped": 0, "expired": 1, "typing": 0},
+        )
+        # the window starts over once the sender stopped typing
+        await channel.emit(layer, "alice", "bob", "typing.on", {})
+        self.assertEqual(layer.sent[-1], ("bob", "typing.on"))
+        channel.clear()
+
+    def test_rate_per_recipient_second(self):
+        channel = EphemeralChannel(window=1, expiry=60, rate=2)
+        spent = [channel.spend("bob", now) for now in (5.0, 5.5, 5.9, 6.0)]
+        self.assertEqual(spent, [True, True, False, True])
+        self.assertTrue(channel.spend("erin", 5.9))
+
+
+class SlowSocket:
+    """An ASGI send whose client reads nothing until `reading` is set."""
+
+    def __init__(self):
+        self.reading = asyncio.Event()
+        self.sent = []
+
+    async def send(self, message):
+        await self.reading.wait()
+        if message["type"] == "websocket.close":
+            self.sent.append(("close", message["code"]))
+        else:
+            self.sent.append(json.loads(message["text"])["source"])
+
+
+class OutboundTests(TestCase):
+    def setUp(self):
+        self.socket = SlowSocket()
+        self.wire, _ = negotiate({})
+        self.outbound = Outbound(
+            self.socket.send, self.wire, high=350, low=100, limit=600
+        )
+
+    async def push(self, source):
+        # a frame of 100 bytes
+        empty = frame_size(self.wire.frame({"source": source, "data": ""}))
+        await self.outbound.push({"source": source, "data": "x" * (100 - empty)})
+
+    async def test_ephemeral_dropped_while_congested(self):
+        dropped = metrics.outbound_dropped.values.get(("typing.on",), 0)
+        await self.push("message.send")
+        await asyncio.sleep(0)
+        # the first frame is waiting on the client, the rest is queued
+        await self.push("typing.on")
+        await self.push("message.send")
+        self.assertFalse(self.outbound.congested)
+        # past the high watermark the queued typing.on goes first
+        await self.push("message.send")
+        self.assertTrue(self.outbound.congested)
+        await self.push("typing.on")
+        # presence is never dropped, nothing would correct it
+        await self.push("presence")
+        self.assertEqual(self.outbound.queued, 400)
+        self.assertEqual(metrics.outbound_dropped.values[("typing.on",)] - dropped, 2)
+        self.socket.reading.set()
+        await asyncio.sleep(0.01)
+        self.assertEqual(self.socket.sent, ["message.send"] * 3 + ["presence"])
+        self.assertFalse(self.outbound.congested)
+        self.assertEqual(self.outbound.queued, 0)
+        # typing events go out again once the client caught up
+        await self.push("typing.on")
+        await self.push("typing.off")
+        await asyncio.sleep(0.01)
+        self.assertEqual(self.socket.sent[-2:], ["typing.on", "typing.off"])
+
+    async def test_priority_over_presence_and_typing(self):
+        self.outbound.high = 1000
+        await self.push("typing.on")
+        await asyncio.sleep(0)
+        await self.push("typing.off")
+        await self.push("presence")
+        await self.push("message.send")
+        self.socket.reading.set()
+        await asyncio.sleep(0.01)
+        self.assertEqual(
+            self.socket.sent, ["typing.on", "message.send", "presence", "typing.off"]
+        )
+
+    async def test_layer_delay(self):
+        observed = metrics.layer_delay_seconds.values.get((), [0])[-1]
+        sent = []
+
+        async def send(message):
+            sent.append(json.loads(message["text"]))
+
+        self.outbound.send = send
+        await self.outbound.push(
+            {"source": "message.send", "data": "", "sent_at": time.time() - 3}
+        )
+        await asyncio.sleep(0.01)
+        self.assertGreaterEqual(
+            metrics.layer_delay_seconds.values[()][-1] - observed, 3
+        )
+        # the stamp isn't sent to the client
+        self.assertEqual(sent, [{"source": "message.send", "data": ""}])
+
+    async def test_resync_past_limit(self):
+        resyncs = metrics.outbound_resyncs.values.get((), 0)
+        for _ in range(7):
+            await self.push("message.send")
+            await asyncio.sleep(0)
+        self.assertTrue(self.outbound.closed)
+        self.assertEqual(self.outbound.queued, 100)
+        await self.push("message.send")
+        self.socket.reading.set()
+        await asyncio.sleep(0.01)
+        # the frame that was being sent, then the hint and nothing else
+        self.assertEqual(
+            self.socket.sent,
+            ["message.send", "resync", ("close", RESYNC_CLOSE_CODE)],
+        )
+        self.assertEqual(self.outbound.queued, 0)
+        self.assertEqual(metrics.outbound_resyncs.values[()] - resyncs, 1)
+
+    async def test_close_not_counted_as_dropped(self):
+        dropped = metrics.outbound_dropped.values.get(("message.send",), 0)
+        for _ in range(3):
+            await self.push("message.send")
+            await asyncio.sleep(0)
+        await self.outbound.close()
+        # the frame being sent is released as the task is cancelled
+        await asyncio.sleep(0)
+        self.assertEqual(self.outbound.queued, 0)
+        self.assertEqual(
+            metrics.outbound_dropped.values.get(("message.send",), 0), dropped
+        )
+
+    async def test_failed_send_closes_queue(self):
+        async def send(message):
+            raise OSError("connection reset")
+
+        self.outbound.send = send
+        await self.push("message.send")
+        await self.push("message.send")
+        task = self.outbound.task
+        with self.assertLogs("chat.outbound", "WARNING"):
+            await task
+        self.assertTrue(self.outbound.closed)
+        self.assertIsNone(self.outbound.task)
+        self.assertEqual(self.outbound.queued, 0)
+
+
+class SearchTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(username="me")
+        User.objects.create(username="zoe", first_name="Ana", last_name="Lopez")
+        User.objects.create(username="anabel", first_name="Zed")
+        User.objects.create(username="ana", first_name="Émile", last_name="Zola")
+
+    def usernames(self, query):
+        ids = search_user_ids(query, self.user.id)
+        names = dict(User.objects.filter(id__in=ids).values_list("id", "username"))
+        return [names[user_id] for user_id in ids]
+
+    def test_username_matches_rank_first(self):
+        self.assertEqual(self.usernames("ANA"), ["ana", "anabel", "zoe"])
+
+    def test_accents_and_terms(self):
+        self.assertEqual(self.usernames("emile z"), ["ana"])
+        self.assertEqual(self.usernames("z lop"), ["zoe"])
+
+    def test_reindexed_on_save(self):
+        user = User.objects.get(username="zoe")
+        user.last_name = "Perez"
+        user.save()
+        self.assertEqual(self.usernames("lopez"), [])
+        self.assertEqual(self.usernames("perez"), ["zoe"])
+
+    def test_excludes_searcher_and_empty_query(self):
+        self.assertEqual(self.usernames("me"), [])
+        self.assertEqual(self.usernames("  "), [])
+
+
+class SocialGraphTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.alice = User.objects.create(username="alice")
+        cls.bob = User.objects.create(username="bob")
+        cls.request = Connection.objects.create(sender=cls.alice, receiver=cls.bob)
+
+    def setUp(self):
+        self.graph = SocialGraph(max_size=10, ttl=60)
+
+    def test_loaded_and_updated_on_accept(self):
+        alice = self.graph.get(self.alice.id)
+        bob = self.graph.get(self.bob.id)
+        self.assertEqual(alice.flags(self.bob.id), (True, False, False))
+        self.assertEqual(bob.flags(self.alice.id), (False, True, False))
+        self.request.approved = True
+        with self.assertNumQueries(0):
+            self.graph.add(self.request)
+        self.assertEqual(alice.flags(self.bob.id), (False, False, True))
+        self.assertEqual(bob.flags(self.alice.id), (False, False, True))
+
+    def test_is_member(self):
+        self.graph.get(self.bob.id)
+        with self.assertNumQueries(0):
+            self.assertTrue(self.graph.is_member(self.bob.id, self.request.id))
+            self.assertTrue(
+                self.graph.is_member(self.bob.id, str(self.request.id), RECEIVED)
+            )
+            self.assertFalse(self.graph.is_member(self.bob.id, "x"))
+        # a miss reloads once, for connections made by other processes
+        with self.assertNumQueries(1):
+            self.assertFalse(self.graph.is_member(self.bob.id, self.request.id, SENT))
+        carol = User.objects.create(username="carol")
+        connection = Connection.objects.create(sender=carol, receiver=self.bob)
+        self.assertTrue(self.graph.is_member(self.bob.id, connection.id, RECEIVED))
+        self.assertFalse(self.graph.is_member(self.alice.id, connection.id, FRIEND))
+
+    def test_verify_against_row(self):
+        carol = User.objects.create(username="carol")
+        elsewhere = Connection.objects.create(sender=carol, receiver=self.alice)
+        self.graph.get(self.bob.id)
+        # a hit that is wrong, as if the cache were stale
+        self.graph.peek(self.bob.id).add(elsewhere.id, carol.id, FRIEND)
+        self.assertTrue(self.graph.is_member(self.bob.id, elsewhere.id))
+        with self.assertNumQueries(0):
+            self.assertFalse(self.graph.verify(elsewhere, self.bob.id))
+        self.assertIsNone(self.graph.peek(self.bob.id))
+        self.assertFalse(self.graph.is_member(self.bob.id, elsewhere.id))
+        self.assertTrue(self.graph.verify(self.request, self.bob.id, RECEIVED))
+        self.assertFalse(self.graph.verify(self.request, self.bob.id, FRIEND))
+
+    def test_forgotten_on_delete(self):
+        social_graph.clear()
+        social_graph.get(self.alice.id)
+        self.request.delete()
+        self.assertIsNone(social_graph.peek(self.alice.id))
+        self.assertEqual(
+            social_graph.get(self.alice.id).flags(self.bob.id), (False, False, False)
+        )
+
+
+class ThumbnailTests(TestCase):
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        media = override_settings(MEDIA_ROOT=media_root)
+        media.enable()
+        self.addCleanup(media.disable)
+        self.storage = User._meta.get_field("thumbnail").storage
+
+    def image(self, size=(300, 200), color="red"):
+        output = BytesIO()
+        exif = Image.Exif()
+        exif[0x010F] = "camera"
+        Image.new("RGB", size, color).save(output, "JPEG", exif=exif)
+        return output.getvalue()
+
+    def test_variants(self):
+        variants = render(BytesIO(self.image()))
+        self.assertEqual(list(variants), [64, 128, 256])
+        for size, content in variants.items():
+            with Image.open(BytesIO(content)) as image:
+                self.assertEqual((image.format, image.size), ("WEBP", (size, size)))
+                self.assertFalse(image.getexif())
+
+    def test_invalid(self):
+        with self.assertRaises(ThumbnailError):
+            render(BytesIO(b"not an image"))
+
+    def test_ingest_dedups_and_serializes_small_variant(self):
+        user = User.objects.create(username="alice")
+        friend = User.objects.create(username="bob")
+        name = ingest(user.id, BytesIO(self.image()))
+        self.assertEqual(ingest(friend.id, BytesIO(self.image())), name)
+        self.assertNotEqual(ingest(friend.id, BytesIO(self.image(color="blue"))), name)
+        user.refresh_from_db()
+        self.assertEqual(user.thumbnail.name, name)
+        self.assertTrue(user_data(user)["thumbnail"].endswith("-64.webp"))
+        self.assertEqual(
+            json.dumps(UserSerializer(user).data), json.dumps(user_data(user))
+        )
+
+    def test_replaced_files_deleted_once_unused(self):
+        user = User.objects.create(username="alice")
+        friend = User.objects.create(username="bob")
+        red = ingest(user.id, BytesIO(self.image()))
+        ingest(friend.id, BytesIO(self.image()))
+        ingest(user.id, BytesIO(self.image(color="blue")))
+        # bob still has the red one
+        self.assertTrue(self.storage.exists(variant(red, 64)))
+        remove_thumbnail(friend.id)
+        for size in (64, 128, 256):
+            self.assertFalse(self.storage.exists(variant(red, size)))
+        blue = User.objects.get(id=user.id).thumbnail.name
+        self.assertTrue(self.storage.exists(variant(blue, 64)))
+
+    def test_variant_of_old_uploads(self):
+        self.assertEqual(variant("thumbnails/alice.png"), "thumbnails/alice.png")
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS)
+class UploadTests(TestCase):
+    data = bytes(range(256)) * 100
+
+    def upload(self, data=data, checksum=None):
+        checksum = checksum or hashlib.sha256(data).hexdigest()
+        return Upload("thumbnail", len(data), checksum)
+
+    def test_streamed_to_file(self):
+        upload = self.upload()
+        for start in range(0, len(self.data), 4096):
+            self.assertFalse(upload.complete)
+            upload.write(self.data[start : start + 4096])
+        self.assertTrue(upload.complete)
+        with upload.finish() as file:
+            self.assertEqual(file.read(), self.data)
+
+    def test_rejected(self):
+        with self.assertRaises(UploadError):
+            Upload("video", 10, "0" * 64)
+        with self.assertRaises(UploadError):
+            Upload("thumbnail", 2**40, "0" * 64)
+        upload = self.upload()
+        with self.assertRaises(UploadError):
+            upload.write(self.data + b"!")
+        upload = self.upload(checksum="0" * 64)
+        upload.write(self.data)
+        with self.assertRaises(UploadError):
+            upload.finish()
+
+    async def test_consumer_errors(self):
+        communicator = WebsocketCommunicator(AsyncChatConsumer.as_asgi(), "/chat/")
+        communicator.scope["user"] = await User.objects.acreate(username="alice")
+        await communicator.connect()
+        await communicator.send_to(bytes_data=b"chunk")
+        frame = await communicator.receive_json_from()
+        self.assertEqual(frame["data"], {"error": "No upload in progress"})
+        await communicator.send_json_to(
+            {"source": "upload.start", "kind": "thumbnail", "size": 3}
+        )
+        frame = await communicator.receive_json_from()
+        self.assertEqual(frame["data"], {"error": "Upload sha256 must be a hex digest"})
+        await communicator.disconnect()
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS)
+class WireTests(TestCase):
+    def setUp(self):
+        ephemeral.clear()
+
+    def test_negotiate(self):
+        self.assertEqual(negotiate({})[0].name, "json")
+        wire, subprotocol = negotiate({"subprotocols": ["v2", "chat.msgpack"]})
+        self.assertEqual((wire.name, subprotocol), ("msgpack", "chat.msgpack"))
+        wire, subprotocol = negotiate({"query_string": b"token=x&format=msgpack"})
+        self.assertEqual((wire.name, subprotocol), ("msgpack", None))
+        self.assertEqual(negotiate({"query_string": b"format=xml"})[0].name, "json")
+
+    async def exchange(self, consumer, path, data, **kwargs):
+        communicator = WebsocketCommunicator(consumer.as_asgi(), path, **kwargs)
+        communicator.scope["user"] = await User.objects.acreate(username="alice")
+        connected, subprotocol = await communicator.connect()
+        self.assertTrue(connected)
+        await communicator.send_to(bytes_data=msgpack.packb(data))
+        frame = await communicator.receive_from()
+        await communicator.disconnect()
+        return subprotocol, msgpack.unpackb(frame)
+
+    async def test_subprotocol(self):
+        subprotocol, frame = await self.exchange(
+            AsyncChatConsumer,
+            "/chat/",
+            {"source": "message.type", "username": "alice"},
+            subprotocols=["chat.msgpack"],
+        )
+        self.assertEqual(subprotocol, "chat.msgpack")
+        self.assertEqual(frame["source"], "message.type")
+        self.assertEqual(frame["data"], {"username": "alice"})
+
+    async def test_query_parameter_upload_chunk(self):
+        _, frame = await self.exchange(
+            ChatConsumer,
+            "/chat/?format=msgpack",
+            {"source": "upload.chunk", "chunk": b"chunk"},
+        )
+        self.assertEqual(frame["source"], "upload.error")
+        self.assertEqual(frame["data"], {"error": "No upload in progress"})
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS)
+class MetricsTests(TestCase):
+    def test_histogram_render(self):
+        histogram = metrics.Histogram("test_seconds", "Test.", ("source",), (0.1, 1))
+        metrics.registry.remove(histogram)
+        for value in (0.05, 0.5, 3):
+            histogram.observe(value, "search")
+        self.assertEqual(
+            [
+                (name, labels.get("le"), value)
+                for name, labels, value in histogram.samples()
+            ],
+            [
+                ("test_seconds_bucket", "0.1", 1),
+                ("test_seconds_bucket", "1", 2),
+                ("test_seconds_bucket", "+Inf", 3),
+                ("test_seconds_sum", None, 3.55),
+                ("test_seconds_count", None, 3),
+            ],
+        )
+
+    async def test_consumer_counts(self):
+        handled = metrics.handler_queries.values.get(("friend.list",), 0)
+        unknown = metrics.frames_received.values.get(("unknown",), 0)
+        communicator = WebsocketCommunicator(AsyncChatConsumer.as_asgi(), "/chat/")
+        communicator.scope["user"] = await User.objects.acreate(username="alice")
+        await communicator.connect()
+        self.assertEqual(metrics.open_sockets.values[()], 1)
+        await communicator.send_json_to({"source": "no.such.source"})
+        await communicator.send_json_to({"source": "friend.list"})
+        await communicator.receive_json_from()
+        await communicator.disconnect()
+        self.assertEqual(metrics.open_sockets.values[()], 0)
+        self.assertEqual(metrics.handler_queries.values[("friend.list",)], handled + 1)
+        self.assertEqual(metrics.frames_received.values[("unknown",)], unknown + 1)
+
+    @override_settings(CHAT_METRICS_TOKEN="secret")
+    def test_endpoint(self):
+        self.assertEqual(self.client.get("/chat/metrics/").status_code, 401)
+        response = self.client.get(
+            "/chat/metrics/", headers={"Authorization": "Bearer secret"}
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b"# TYPE chat_handler_seconds histogram", response.content)
+
+    @override_settings(CHAT_METRICS_TOKEN=None)
+    def test_endpoint_closed_without_token(self):
+        self.assertEqual(self.client.get("/chat/metrics/").status_code, 401)
+        self.client.force_login(User.objects.create(username="alice"))
+        self.assertEqual(self.client.get("/chat/metrics/").status_code, 401)
+        self.client.force_login(User.objects.create(username="admin", is_staff=True))
+        self.assertEqual(self.client.get("/chat/metrics/").status_code, 200)
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS)
+class PresenceTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.alice, cls.bob, cls.carol = [
+            User.objects.create(username=username)
+            for username in ("alice", "bob", "carol")
+        ]
+        Connection.objects.create(sender=cls.alice, receiver=cls.bob, approved=True)
+        Connection.objects.create(sender=cls.alice, receiver=cls.carol)
+
+    def setUp(self):
+        social_graph.clear()
+        presence.clear()
+        grace = presence.grace
+        presence.grace = 0.05
+        self.addCleanup(setattr, presence, "grace", grace)
+
+    async def socket(self, user):
+        communicator = WebsocketCommunicator(AsyncChatConsumer.as_asgi(), "/chat/")
+        communicator.scope["user"] = user
+        await communicator.connect()
+        return communicator
+
+    async def test_transitions_reach_friends_once(self):
+        bob = await self.socket(self.bob)
+        carol = await self.socket(self.carol)
+        phone = await self.socket(self.alice)
+        frame = await bob.receive_json_from()
+        self.assertEqual(frame["data"], {"username": "alice", "online": True})
+        laptop = await self.socket(self.alice)
+        await phone.disconnect()
+        # a flapping reconnect within the grace period
+        await laptop.disconnect()
+        laptop = await self.socket(self.alice)
+        await asyncio.sleep(0.1)
+        self.assertTrue(await bob.receive_nothing())
+        await laptop.disconnect()
+        await asyncio.sleep(0.1)
+        frame = await bob.receive_json_from()
+        self.assertEqual(frame["data"], {"username": "alice", "online": False})
+        # pending requests are not friends
+        self.assertTrue(await carol.receive_nothing())
+        await bob.disconnect()
+        await carol.disconnect()
+
+    def test_dead_worker_swept(self):
+        PresenceSocket.objects.create(
+            user=self.alice,
+            channel_name="dead",
+            worker="dead",
+            expires=timezone.now() - timedelta(seconds=1),
+        )
+        PresenceSocket.objects.create(
+            user=self.bob, channel_name="alive", worker=WORKER, expires=timezone.now()
+        )
+        OnlineUser.objects.create(user=self.alice)
+        OnlineUser.objects.create(user=self.bob)
+        self.assertEqual(heartbeat(ttl=60), [(self.alice.id, "alice")])
+        self.assertEqual(
+            list(PresenceSocket.objects.values_list("channel_name", flat=True)),
+            ["alive"],
+        )
+
+
+class MessageWriterTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.alice, cls.bob, cls.carol = [
+            User.objects.create(username=username)
+            for username in ("alice", "bob", "carol")
+        ]
+        cls.with_bob = Connection.objects.create(
+            sender=cls.alice, receiver=cls.bob, approved=True
+        )
+        cls.with_carol = Connection.objects.create(
+            sender=cls.carol, receiver=cls.alice, approved=True
+        )
+        open_conversations(cls.with_bob)
+        open_conversations(cls.with_carol)
+
+    async def test_one_batch_in_order(self):
+        writer = MessageWriter(window=0.01, max_batch=100)
+        layer = RecordingLayer()
+        messages = await asyncio.gather(
+            writer.send(layer, self.with_bob.id, self.alice, "1"),
+            writer.send(layer, self.with_carol.id, self.carol, "2"),
+            writer.send(layer, self.with_bob.id, self.bob, "3"),
+            writer.send(layer, self.with_bob.id, self.alice, "4"),
+            writer.send(layer, 0, self.alice, "lost"),
+            # not on the connection, whatever the cache says
+            writer.send(layer, self.with_bob.id, self.carol, "refused"),
+        )
+        self.assertEqual(writer.batches, 1)
+        self.assertIsNone(messages.pop())
+        self.assertIsNone(messages.pop())
+        ids = [message.id for message in messages]
+        self.assertEqual(ids, sorted(ids))
+        # broadcast only once stored, in the order sent
+        self.assertEqual(
+            [group for group, _ in layer.sent],
+            ["alice", "bob", "carol", "alice", "alice", "bob", "alice", "bob"],
+        )
+        sides = Conversation.objects.filter(connection=self.with_bob)
+        self.assertEqual(
+            {side.user_id: (side.unread, side.preview) async for side in sides},
+            {self.alice.id: (1, "4"), self.bob.id: (2, "4")},
+        )
+
+    async def test_batch_size(self):
+        writer = MessageWriter(window=0.01, max_batch=2)
+        await asyncio.gather(
+            *(
+                writer.send(RecordingLayer(), self.with_bob.id, self.alice, str(i))
+                for i in range(5)
+            )
+        )
+        self.assertEqual((writer.batches, writer.messages), (3, 5))
@@ -0,0 +1,156 @@
+"""
+Thumbnail ingestion: uploaded images become fixed size square variants.
+
+Uploads are decoded and checked with Pillow, their metadata is dropped by
+re-encoding, and each size in CHAT_THUMBNAIL_SIZES is written as
+`thumbnails/<content hash>-<size>.<format>`. The same image uploaded
+twice maps to the same files, and a new image always gets a new URL, so
+clients can cache them forever. User.thumbnail stores the largest variant;
+profiles expose CHAT_THUMBNAIL_SIZE. Files of a thumbnail that is
+replaced or removed are deleted once no user has it anymore.
+
+Pillow releases the GIL while decoding and resizing, so the work runs in
+`thumbnail_pool` threads instead of the consumer handling the socket.
+"""
+
+import hashlib
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import close_old_connections
+from PIL import Image, ImageOps, UnidentifiedImageError
+from .auth import token_cache
+from .models import User
+from .profiles import profile_cache
+
+SIZES = tuple(sorted(getattr(settings, "CHAT_THUMBNAIL_SIZES", (64, 128, 256))))
+DEFAULT_SIZE = getattr(settings, "CHAT_THUMBNAIL_SIZE", SIZES[0])
+FORMAT = getattr(settings, "CHAT_THUMBNAIL_FORMAT", "WEBP")
+QUALITY = getattr(settings, "CHAT_THUMBNAIL_QUALITY", 80)
+MAX_UPLOAD_SIZE = getattr(settings, "CHAT_THUMBNAIL_MAX_UPLOAD_SIZE", 10 * 2**20)
+# refuse decompression bombs long before they reach memory
+MAX_PIXELS = 40_000_000
+
+variant_name = re.compile(r"^(?P<prefix>thumbnails/[0-9a-f]{32})-\d+\.(?P<ext>\w+)$")
+
+thumbnail_pool = ThreadPoolExecutor(
+    max_workers=getattr(settings, "CHAT_THUMBNAIL_WORKERS", 2),
+    thread_name_prefix="thumbnail",
+)
+
+
+class ThumbnailError(ValueError):
+    pass
+
+
+def variant(name, size=DEFAULT_SIZE):
+    """Stored name of the `size` variant of the thumbnail stored as `name`."""
+    match = variant_name.match(name or "")
+    if match is None:
+        # uploaded before variants existed
+        return name
+    return f"{match['prefix']}-{size}.{match['ext']}"
+
+
+def file_size(file):
+    file.seek(0, os.SEEK_END)
+    size = file.tell()
+    file.seek(0)
+    return size
+
+
+def render(file):
+    """{size: encoded bytes} of every variant of the image in binary `file`."""
+    if file_size(file) > MAX_UPLOAD_SIZE:
+        raise ThumbnailError("Image is too large")
+    try:
+        with Image.open(file) as image:
+            if image.width * image.height > MAX_PIXELS:
+                raise ThumbnailError("Image is too large")
+            image.load()
+            image = ImageOps.exif_transpose(image)
+    except (UnidentifiedImageError, OSError, Image.DecompressionBombError):
+        raise ThumbnailError("Not a valid image") from None
+    alpha = "A" in image.getbands() and FORMAT != "JPEG"
+    image = image.convert("RGBA" if alpha else "RGB")
+    variants = {}
+    for size in SIZES:
+        output = BytesIO()
+        # center crop to a square, then scale to exactly `size`
+        resized = ImageOps.fit(image, (size, size), Image.LANCZOS)
+        # nothing but pixels is written: no EXIF, ICC or text chunks
+        resized.save(output, FORMAT, quality=QUALITY, method=4)
+        variants[size] = output.getvalue()
+    return variants
+
+
+def store(file):
+    """Write the variants of `file`, returning the name User.thumbnail stores."""
+    digest = hashlib.blake2b(digest_size=16)
+    for chunk in iter(lambda: file.read(2**16), b""):
+        digest.update(chunk)
+    digest = digest.hexdigest()
+    storage = User._meta.get_field("thumbnail").storage
+    extension = FORMAT.lower()
+    name = f"thumbnails/{digest}-{SIZES[-1]}.{extension}"
+    if all(storage.exists(variant(name, size)) for size in SIZES):
+        return name
+    for size, content in render(file).items():
+        path = variant(name, size)
+        if not storage.exists(path):
+            storage.save(path, ContentFile(content))
+    return name
+
+
+def release(name):
+    """
+    Delete the files of the thumbnail stored as `name` unless a user still
+    has it: everyone who uploaded the same image shares its variants. An
+    upload of that same image racing with this may lose its files, and
+    gets them back the next time it is uploaded.
+    """
+    if not name or User.objects.filter(thumbnail=name).exists():
+        return
+    storage = User._meta.get_field("thumbnail").storage
+    for path in {variant(name, size) for size in SIZES} | {name}:
+        storage.delete(path)
+
+
+def current(user_id):
+    return User.objects.filter(id=user_id).values_list("thumbnail", flat=True).first()
+
+
+def ingest(user_id, file):
+    """
+    Store the image in binary `file` as the thumbnail of `user_id` and
+    return its name.
+
+    Runs in `thumbnail_pool`, which like any thread outside a request
+    manages its own database connection.
+    """
+    close_old_connections()
+    try:
+        previous = current(user_id)
+        name = store(file)
+        User.objects.filter(id=user_id).update(thumbnail=name)
+        if previous != name:
+            release(previous)
+    finally:
+        close_old_connections()
+    # saved with update(), which sends no post_save
+    profile_cache.invalidate(user_id)
+    token_cache.revoke(user_id)
+    return name
+
+
+def remove_thumbnail(user_id):
+    """Remove the thumbnail of `user_id`, deleting its files if unused."""
+    previous = current(user_id)
+    User.objects.filter(id=user_id).update(thumbnail=None)
+    release(previous)
+    # saved with update(), which sends no post_save
+    profile_cache.invalidate(user_id)
+    token_cache.revoke(user_id)
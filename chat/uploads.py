@@ -0,0 +1,77 @@
+"""
+Binary uploads over the websocket.
+
+A client announces an upload with a JSON frame
+
+    {"source": "upload.start", "kind": "thumbnail", "size": 48213,
+     "sha256": "<hex digest of the whole file>"}
+
+then sends the file as binary frames of any size up to
+CHAT_UPLOAD_CHUNK_SIZE (wrapped in "upload.chunk" frames over MessagePack,
+see wire.py). Chunks are streamed to a temporary file, so the
+upload is never held in memory or parsed as JSON. Once `size` bytes have
+arrived and their digest matches, the file goes to the handler of its
+`kind`. A socket has at most one upload in progress: starting another
+one drops it.
+"""
+
+import hashlib
+import re
+import tempfile
+from django.conf import settings
+from .thumbnails import MAX_UPLOAD_SIZE as MAX_THUMBNAIL_SIZE
+
+CHUNK_SIZE = getattr(settings, "CHAT_UPLOAD_CHUNK_SIZE", 2**16)
+# largest upload accepted for each kind
+MAX_SIZES = {"thumbnail": MAX_THUMBNAIL_SIZE}
+
+sha256_hex = re.compile(r"^[0-9a-f]{64}$")
+
+
+class UploadError(ValueError):
+    pass
+
+
+class Upload:
+    def __init__(self, kind, size, checksum):
+        if kind not in MAX_SIZES:
+            raise UploadError(f"Unknown upload kind {kind!r}")
+        if not isinstance(size, int) or isinstance(size, bool) or size <= 0:
+            raise UploadError("Upload size must be a positive integer")
+        if size > MAX_SIZES[kind]:
+            raise UploadError(
+                f"Uploads of {kind} are limited to {MAX_SIZES[kind]} bytes"
+            )
+        if not isinstance(checksum, str) or not sha256_hex.match(checksum.lower()):
+            raise UploadError("Upload sha256 must be a hex digest")
+        self.kind = kind
+        self.size = size
+        self.checksum = checksum.lower()
+        self.received = 0
+        self.digest = hashlib.sha256()
+        self.file = tempfile.TemporaryFile()
+
+    @property
+    def complete(self):
+        return self.received == self.size
+
+    def write(self, chunk):
+        if not isinstance(chunk, bytes):
+            raise UploadError("Chunks must be binary")
+        if len(chunk) > CHUNK_SIZE:
+            raise UploadError(f"Chunks are limited to {CHUNK_SIZE} bytes")
+        if self.received + len(chunk) > self.size:
+            raise UploadError("Upload is larger than announced")
+        self.file.write(chunk)
+        self.digest.update(chunk)
+        self.received += len(chunk)
+
+    def finish(self):
+        """The uploaded file, rewound. The caller closes it."""
+        if self.digest.hexdigest() != self.checksum:
+            raise UploadError("Upload checksum does not match")
+        self.file.seek(0)
+        return self.file
+
+    def close(self):
+        self.file.close()
@@ -4,4 +4,25 @@ from . import views
 urlpatterns = [
     path("signin/", views.SignInView.as_view(), name="signin"),
     path("signup/", views.SignUpView.as_view(), name="signup"),
+    path(
+        "connections/<int:connection_id>/export/",
+        views.ExportView.as_view(),
+        name="export",
+    ),
+    path(
+        "stats/profile-cache/",
+        views.ProfileCacheStatsView.as_view(),
+        name="profile-cache-stats",
+    ),
+    path(
+        "stats/ephemeral/",
+        views.EphemeralStatsView.as_view(),
+        name="ephemeral-stats",
+    ),
+    path(
+        "stats/token-cache/",
+        views.TokenCacheStatsView.as_view(),
+        name="token-cache-stats",
+    ),
+    path("metrics/", views.MetricsView.as_view(), name="metrics"),
 ]
@@ -1,11 +1,26 @@
+import hmac
+import json
+from asgiref.sync import sync_to_async
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
 from django.shortcuts import render
+from django.utils.decorators import method_decorator
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
 from rest_framework.views import APIView
-from rest_framework.permissions import AllowAny
+from rest_framework.permissions import IsAdminUser
 from rest_framework.response import Response
-from rest_framework import status
-from django.contrib.auth import authenticate
 from rest_framework_simplejwt.tokens import RefreshToken
 from .serializers import UserSerializer, SignUpUserSerializer
+from . import metrics
+from .auth import bearer_user, token_cache
+from .ephemeral import ephemeral
+from .export import ExportError, accepts_gzip, export_queryset, export_stream
+from .graph import FRIEND, social_graph
+from .models import Connection, User
+from .passwords import Overloaded, hash_password, password_pool, verify_password
+from .profiles import profile_cache
 
 
 def get_auth_for_user(user):
@@ -19,27 +34,141 @@ def get_auth_for_user(user):
     }
 
 
-class SignInView(APIView):
-    permission_classes = [AllowAny]
+def request_data(request):
+    """The JSON or form body of `request`, like DRF's request.data."""
+    if request.content_type == "application/json":
+        try:
+            data = json.loads(request.body or b"{}")
+        except ValueError:
+            return {}
+        return data if isinstance(data, dict) else {}
+    return {**request.POST.dict(), **request.FILES.dict()}
 
-    def post(self, request):
-        username = request.data.get("username")
-        password = request.data.get("password")
+
+def overloaded():
+    response = JsonResponse({"detail": "Too many sign ins, retry shortly."}, status=503)
+    response["Retry-After"] = "1"
+    return response
+
+
+# Async, so that hashing passwords in the password pool doesn't hold a
+# thread of the process serving the websockets, see passwords.py
+
+
+@method_decorator(csrf_exempt, name="dispatch")
+class SignInView(View):
+    async def post(self, request):
+        data = request_data(request)
+        username = data.get("username")
+        password = data.get("password")
         if not username or not password:
-            return Response(status=status.HTTP_400_BAD_REQUEST)
-        user = authenticate(username=username, password=password)
-        if not user:
-            return Response(status=status.HTTP_401_UNAUTHORIZED)
-        user_data = get_auth_for_user(user)
-        return Response(user_data)
-
-
-class SignUpView(APIView):
-    permission_classes = [AllowAny]
-
-    def post(self, request):
-        new_user = SignUpUserSerializer(data=request.data)
-        new_user.is_valid(raise_exception=True)
-        user = new_user.save()
-        user_data = get_auth_for_user(user)
-        return Response(user_data)
+            return HttpResponse(status=400)
+        user = await User.objects.filter(username=username).afirst()
+        try:
+            if user is None:
+                # hash anyway, unknown usernames take as long to refuse
+                await password_pool.run(hash_password, password)
+                return HttpResponse(status=401)
+            matches, upgraded = await password_pool.run(
+                verify_password, password, user.password
+            )
+        except Overloaded:
+            return overloaded()
+        if not matches or not user.is_active:
+            return HttpResponse(status=401)
+        if upgraded is not None:
+            user.password = upgraded
+            await user.asave(update_fields=["password"])
+        return JsonResponse(get_auth_for_user(user))
+
+
+@method_decorator(csrf_exempt, name="dispatch")
+class SignUpView(View):
+    async def post(self, request):
+        new_user = SignUpUserSerializer(data=request_data(request))
+        if not await sync_to_async(new_user.is_valid)():
+            return JsonResponse(new_user.errors, status=400)
+        fields = dict(new_user.validated_data)
+        try:
+            password = await password_pool.run(hash_password, fields.pop("password"))
+        except Overloaded:
+            return overloaded()
+        user = User(**fields, password=password)
+        await user.asave()
+        return JsonResponse(get_auth_for_user(user))
+
+
+class ExportView(View):
+    """NDJSON stream of a conversation, see export.py."""
+
+    async def get(self, request, connection_id):
+        user = await bearer_user(request)
+        if user is None:
+            return HttpResponse(status=401)
+        # friends only, a pending request has no conversation to export
+        if not await database_sync_to_async(social_graph.is_member)(
+            user.id, connection_id, FRIEND
+        ):
+            return HttpResponse(status=404)
+        connection = (
+            await Connection.objects.select_related("sender", "receiver")
+            .filter(pk=connection_id)
+            .afirst()
+        )
+        if connection is None or not social_graph.verify(connection, user.id, FRIEND):
+            return HttpResponse(status=404)
+        try:
+            messages = export_queryset(
+                connection, request.GET.get("after_id"), request.GET.get("since")
+            )
+        except ExportError as error:
+            return JsonResponse({"detail": str(error)}, status=400)
+        compress = accepts_gzip(request.headers.get("Accept-Encoding", ""))
+        response = StreamingHttpResponse(
+            export_stream(connection, messages, compress),
+            content_type="application/x-ndjson",
+        )
+        if compress:
+            response["Content-Encoding"] = "gzip"
+        response["Vary"] = "Accept-Encoding"
+        return response
+
+
+class ProfileCacheStatsView(APIView):
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        return Response(profile_cache.stats())
+
+
+class EphemeralStatsView(APIView):
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        return Response(ephemeral.stats())
+
+
+class TokenCacheStatsView(APIView):
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        return Response(token_cache.stats())
+
+
+class MetricsView(View):
+    """Prometheus scrape endpoint, see metrics.py."""
+
+    def get(self, request):
+        token = getattr(settings, "CHAT_METRICS_TOKEN", None)
+        if token:
+            allowed = hmac.compare_digest(
+                request.headers.get("Authorization", ""), f"Bearer {token}"
+            )
+        else:
+            # without a scrape token, staff only like the stats views
+            allowed = request.user.is_staff
+        if not allowed:
+            return HttpResponse(status=401)
+        return HttpResponse(
+            metrics.render(), content_type="text/plain; version=0.0.4; charset=utf-8"
+        )
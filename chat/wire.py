@@ -0,0 +1,60 @@
+"""
+Wire formats of websocket frames.
+
+Frames are JSON text by default. A client picks MessagePack when
+connecting, either by offering the `chat.msgpack` subprotocol
+(Sec-WebSocket-Protocol) or with a `format=msgpack` query parameter for
+clients that can't set headers. Frames are then binary MessagePack maps
+with the same keys as the JSON ones, both ways.
+
+Binary frames are raw upload chunks in JSON. In MessagePack every binary
+frame is a map, so chunks are sent as
+
+    {"source": "upload.chunk", "chunk": <bin>}
+"""
+
+import json
+from urllib.parse import parse_qs
+import msgpack
+from .encoders import dumps
+
+
+class JSONWire:
+    name = "json"
+    # binary frames are upload chunks
+    binary = False
+
+    def frame(self, data):
+        """Keyword arguments of `send` for `data`."""
+        return {"text_data": dumps(data)}
+
+    def loads(self, text_data, bytes_data):
+        return json.loads(text_data)
+
+
+class MessagePackWire:
+    name = "msgpack"
+    binary = True
+
+    def frame(self, data):
+        return {"bytes_data": msgpack.packb(data)}
+
+    def loads(self, text_data, bytes_data):
+        if bytes_data is None:
+            # JSON text is still understood
+            return json.loads(text_data)
+        return msgpack.unpackb(bytes_data)
+
+
+WIRES = {wire.name: wire for wire in (JSONWire(), MessagePackWire())}
+SUBPROTOCOLS = {f"chat.{name}": name for name in WIRES}
+
+
+def negotiate(scope):
+    """(wire, subprotocol to accept or None) for a connecting socket."""
+    for subprotocol in scope.get("subprotocols") or ():
+        if subprotocol in SUBPROTOCOLS:
+            return WIRES[SUBPROTOCOLS[subprotocol]], subprotocol
+    query = parse_qs(scope.get("query_string", b"").decode())
+    name = query.get("format", ["json"])[-1]
+    return WIRES.get(name, WIRES["json"]), None
@@ -0,0 +1,141 @@
+"""
+Group commit for message.send.
+
+Sends arriving within CHAT_MESSAGE_BATCH_WINDOW seconds of each other are
+stored together: one query loads their connections and one transaction
+inserts them all, instead of a lookup and a transaction per frame. Only
+once that transaction has committed are the messages broadcast, in the
+order they were sent.
+
+One batch is written at a time. Sends arriving meanwhile wait for the next
+one, so batches grow as the database slows down, up to
+CHAT_MESSAGE_BATCH_SIZE messages.
+"""
+
+import asyncio
+from channels.db import database_sync_to_async
+from django.conf import settings
+from .conversations import send_messages
+from .fast_serializers import message_data
+from .graph import social_graph
+from .metrics import group_send
+from .models import Connection
+
+
+def commit(pending):
+    """
+    Store `pending` [(connection id, sender, text)], returning for each one
+    its (message, connection), or None when the connection is gone or the
+    sender is no longer on it.
+    """
+    connections = Connection.objects.select_related("sender", "receiver").in_bulk(
+        {connection_id for connection_id, _, _ in pending}
+    )
+    stored = [
+        connection_id in connections
+        and social_graph.verify(connections[connection_id], sender.id)
+        for connection_id, sender, _ in pending
+    ]
+    entries = [
+        (connections[connection_id], sender, text)
+        for (connection_id, sender, text), store in zip(pending, stored)
+        if store
+    ]
+    messages = iter(send_messages(entries) if entries else [])
+    return [
+        (next(messages), connections[connection_id]) if store else None
+        for (connection_id, _, _), store in zip(pending, stored)
+    ]
+
+
+class MessageWriter:
+    def __init__(self, window, max_batch):
+        self.window = window
+        self.max_batch = max_batch
+        # [(channel layer, connection id, sender, text, future)]
+        self.pending = []
+        self.timer = None
+        self.flushing = None
+        self.batches = 0
+        self.messages = 0
+
+    async def send(self, channel_layer, connection_id, sender, text):
+        """
+        Store a message and broadcast it to both users of the connection.
+        Returns the message once broadcast, or None if the connection does
+        not exist.
+        """
+        future = asyncio.get_running_loop().create_future()
+        self.pending.append((channel_layer, connection_id, sender, text, future))
+        if self.flushing is None:
+            if len(self.pending) >= self.max_batch:
+                self.start()
+            elif self.timer is None:
+                self.timer = asyncio.get_running_loop().call_later(
+                    self.window, self.start
+                )
+        return await future
+
+    def start(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        self.flushing = asyncio.ensure_future(self.flush())
+
+    async def flush(self):
+        try:
+            while self.pending:
+                batch = self.pending[: self.max_batch]
+                del self.pending[: self.max_batch]
+                await self.write(batch)
+        finally:
+            self.flushing = None
+
+    async def write(self, batch):
+        try:
+            results = await database_sync_to_async(commit)(
+                [
+                    (connection_id, sender, text)
+                    for _, connection_id, sender, text, _ in batch
+                ]
+            )
+        except Exception as error:
+            for *_, future in batch:
+                if not future.done():
+                    future.set_exception(error)
+            return
+        self.batches += 1
+        self.messages += len(batch)
+        for (channel_layer, *_, future), result in zip(batch, results):
+            try:
+                if result is not None:
+                    await self.broadcast(channel_layer, *result)
+                    result = result[0]
+            except Exception as error:
+                if not future.done():
+                    future.set_exception(error)
+            else:
+                if not future.done():
+                    future.set_result(result)
+
+    async def broadcast(self, channel_layer, message, connection):
+        response = {
+            "type": "broadcast_group",
+            "source": "message.send",
+            "data": message_data(message, connection),
+        }
+        await group_send(channel_layer, connection.sender.username, response)
+        await group_send(channel_layer, connection.receiver.username, response)
+
+    def stats(self):
+        return {
+            "batches": self.batches,
+            "messages": self.messages,
+            "pending": len(self.pending),
+        }
+
+
+message_writer = MessageWriter(
+    window=getattr(settings, "CHAT_MESSAGE_BATCH_WINDOW", 0.005),
+    max_batch=getattr(settings, "CHAT_MESSAGE_BATCH_SIZE", 100),
+)
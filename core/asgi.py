@@ -11,7 +11,7 @@ import os
 import chat.routing
 from channels.routing import ProtocolTypeRouter, URLRouter
 from channels.security.websocket import AllowedHostsOriginValidator
-from django_channels_jwt_auth_middleware.auth import JWTAuthMiddlewareStack
+from chat.auth import JWTAuthMiddleware
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'core.settings')
@@ -21,7 +21,7 @@ application = ProtocolTypeRouter(
     {
         "http": get_asgi_application(),
         "websocket": AllowedHostsOriginValidator(
-            JWTAuthMiddlewareStack(URLRouter(chat.routing.websocket_urlpatterns))
+            JWTAuthMiddleware(URLRouter(chat.routing.websocket_urlpatterns))
         ),
         # Just HTTP for now. (We can add other protocols later.)
     }
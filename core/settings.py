@@ -153,3 +153,91 @@ CHANNEL_LAYERS = {
 # Thumbnail uploads
 MEDIA_ROOT = os.path.join(BASE_DIR, "media")
 MEDIA_URL = "/media/"
+
+# Websocket consumer: "async" (AsyncChatConsumer) or "sync" (ChatConsumer)
+CHAT_CONSUMER = os.environ.get("CHAT_CONSUMER", "async")
+
+# Websocket frame JSON encoder: "json", or "orjson", "ujson" and "auto" (the
+# fastest installed) for compact frames that are not byte-identical
+CHAT_JSON_ENCODER = os.environ.get("CHAT_JSON_ENCODER", "json")
+
+# Serialized user profile cache: entries per process, seconds an entry is
+# trusted, and an optional CACHES alias shared between processes
+CHAT_PROFILE_CACHE_SIZE = 10000
+CHAT_PROFILE_CACHE_TTL = 60
+CHAT_PROFILE_CACHE_BACKEND = None
+
+# Social graph cache of who each user is connected to: users per process
+# and seconds an entry is trusted
+CHAT_SOCIAL_GRAPH_SIZE = 10000
+CHAT_SOCIAL_GRAPH_TTL = 60
+
+# Thumbnail variants: square sizes in pixels, the one profiles link to,
+# encoding, and threads resizing uploads
+CHAT_THUMBNAIL_SIZES = (64, 128, 256)
+CHAT_THUMBNAIL_SIZE = 64
+CHAT_THUMBNAIL_FORMAT = "WEBP"
+CHAT_THUMBNAIL_WORKERS = 2
+
+# Largest binary frame accepted while uploading, see chat/uploads.py
+CHAT_UPLOAD_CHUNK_SIZE = 64 * 1024
+
+# Typing indicators, see chat/ephemeral.py: seconds repeats are coalesced,
+# seconds of silence before typing.off, and events per second a recipient
+# accepts before the rest are dropped
+CHAT_TYPING_WINDOW = 1.0
+CHAT_TYPING_EXPIRY = 3.0
+CHAT_EPHEMERAL_RATE = 20
+
+# Group commit of message.send, see chat/writer.py: seconds sends wait for
+# others to share their transaction, and most messages written at once
+CHAT_MESSAGE_BATCH_WINDOW = 0.005
+CHAT_MESSAGE_BATCH_SIZE = 100
+
+# Prometheus metrics at /chat/metrics/, see chat/metrics.py: bearer token
+# scrapers must send (None leaves it to signed in staff), and the fraction of
+# received frames logged to "chat.frames"
+CHAT_METRICS_TOKEN = os.environ.get("CHAT_METRICS_TOKEN")
+CHAT_FRAME_LOG_RATE = float(os.environ.get("CHAT_FRAME_LOG_RATE", 0))
+
+# Presence, see chat/presence.py: seconds a socket lease lasts, seconds
+# between lease renewals, and seconds offline waits for a reconnect
+CHAT_PRESENCE_TTL = 90
+CHAT_PRESENCE_HEARTBEAT = 30
+CHAT_PRESENCE_GRACE = 5
+
+# Most messages one sync response catches up on, see chat/catchup.py
+CHAT_SYNC_MESSAGE_LIMIT = 200
+
+# Access tokens of websocket connects whose user is cached, see chat/auth.py
+CHAT_AUTH_CACHE_SIZE = 10000
+
+# Password hashing of sign in and sign up, see chat/passwords.py: threads
+# hashing, and requests waiting for one before others are refused with 503
+CHAT_PASSWORD_WORKERS = 2
+CHAT_PASSWORD_BACKLOG = 32
+
+# Messages read and written at a time by the conversation export, see
+# chat/export.py
+CHAT_EXPORT_CHUNK_SIZE = 2000
+
+# Results per message.search page, see chat/message_search.py
+CHAT_MESSAGE_SEARCH_PAGE_SIZE = 20
+
+# Outbound queue of each socket, see chat/outbound.py: bytes queued before
+# typing events are dropped, bytes it must fall back under for them to be
+# sent again, and bytes past which the socket is closed with a resync frame.
+# Daphne doesn't make consumers wait on slow clients, so there these limits
+# are seldom reached: watch chat_layer_delay_seconds instead
+CHAT_OUTBOUND_HIGH_WATERMARK = 256 * 1024
+CHAT_OUTBOUND_LOW_WATERMARK = 64 * 1024
+CHAT_OUTBOUND_LIMIT = 4 * 1024 * 1024
+
+LOGGING = {
+    "version": 1,
+    "disable_existing_loggers": False,
+    "handlers": {"console": {"class": "logging.StreamHandler"}},
+    "loggers": {
+        "chat.frames": {"handlers": ["console"], "level": "INFO", "propagate": False}
+    },
+}